@@ -39,7 +39,7 @@ class BrickInstanceTable(collections.abc.MutableMapping):
             if instance_id >= self.next_instance_id:
                 self.next_instance_id = instance_id + 1
             
-        new_instance = BrickInstance(
+        new_instance = self.make_instance(
                 instance_id,
                 self.shape_library[brick_shape],
                 self.color_library[brick_color],
@@ -48,6 +48,12 @@ class BrickInstanceTable(collections.abc.MutableMapping):
         self[instance_id] = new_instance
         return new_instance
     
+    def make_instance(
+        self, instance_id, brick_shape, color, transform, mask_color=None
+    ):
+        return BrickInstance(
+            instance_id, brick_shape, color, transform, mask_color=mask_color)
+    
     def import_document(self, document, transform=None, color=None):
         new_instances = []
         try:
@@ -105,7 +111,246 @@ class BrickInstanceTable(collections.abc.MutableMapping):
     
     def __len__(self):
         return len(self.instances)
+    
+    # bulk queries -------------------------------------------------------------
+    # These are written one instance at a time here and vectorized in
+    # BrickInstanceArrayTable.  Every method returns rows in instance_id order.
+    def get_instance_ids(self):
+        return numpy.array(sorted(self.instances.keys()), dtype=numpy.int64)
+    
+    def get_poses(self, instance_ids=None):
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        return numpy.stack(
+            [numpy.zeros((4,4))] +
+            [self[i].transform for i in instance_ids]
+        )[1:]
+    
+    def get_bbox_vertices(self, instance_ids=None):
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        return numpy.stack(
+            [numpy.zeros((4,8))] +
+            [self[i].bbox_vertices() for i in instance_ids]
+        )[1:]
+    
+    def get_shape_labels(self, shape_ids, instance_ids=None):
+        '''
+        Returns the label in shape_ids of each instance's brick shape, or -1
+        if the shape is not in shape_ids.
+        '''
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        return numpy.array(
+            [shape_ids.get(str(self[i].brick_shape), -1) for i in instance_ids],
+            dtype=numpy.int64,
+        )
+    
+    def get_color_labels(self, color_ids, instance_ids=None):
+        '''
+        Returns the label in color_ids of each instance's color, or -1 if the
+        color is not in color_ids.
+        '''
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        return numpy.array(
+            [color_ids.get(str(self[i].color), -1) for i in instance_ids],
+            dtype=numpy.int64,
+        )
+    
+    def get_snap_transforms(self, instance_ids=None):
+        '''
+        Returns (instance, snap, transform) arrays listing the world-space
+        transform of every snap belonging to instance_ids.
+        '''
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        snap_instances = [numpy.zeros(0, dtype=numpy.int64)]
+        snap_ids = [numpy.zeros(0, dtype=numpy.int64)]
+        transforms = [numpy.zeros((0,4,4))]
+        for i in instance_ids:
+            instance = self[i]
+            local_transforms = instance.brick_shape.get_snap_arrays()[
+                'transform']
+            num_snaps = local_transforms.shape[0]
+            snap_instances.append(
+                numpy.full(num_snaps, int(instance), dtype=numpy.int64))
+            snap_ids.append(numpy.arange(num_snaps, dtype=numpy.int64))
+            transforms.append(instance.transform @ local_transforms)
+        
+        return (
+            numpy.concatenate(snap_instances),
+            numpy.concatenate(snap_ids),
+            numpy.concatenate(transforms),
+        )
+
+class BrickInstanceArrayTable(BrickInstanceTable):
+    '''
+    A BrickInstanceTable that keeps every instance pose in a single
+    (capacity,4,4) array indexed by instance id, and brick shapes and colors
+    as integer indices into per-table lists.  The instances themselves are
+    ArrayBrickInstance views into these arrays, so the rest of the code can
+    use them exactly like BrickInstances, while scene-wide pose, bounding box
+    and snap queries become a single batched matmul.
+    '''
+    def __init__(
+        self, shape_library, color_library, instances=None, capacity=64
+    ):
+        super(BrickInstanceArrayTable, self).__init__(
+            shape_library, color_library)
+        self.poses = numpy.zeros((capacity, 4, 4))
+        self.shape_index = numpy.full(capacity, -1, dtype=numpy.int64)
+        self.color_index = numpy.full(capacity, -1, dtype=numpy.int64)
         
+        self.shapes = []
+        self.shape_lookup = {}
+        self.shape_bbox_vertices = numpy.zeros((0, 4, 8))
+        self.colors = []
+        self.color_lookup = {}
+        
+        # concatenated local snap transforms for all instances, this only
+        # changes when instances are added or removed
+        self.snap_layout = None
+        
+        if instances is not None:
+            for instance_id, instance in instances.items():
+                self[instance_id] = instance
+    
+    def ensure_capacity(self, instance_id):
+        capacity = self.poses.shape[0]
+        if instance_id < capacity:
+            return
+        
+        new_capacity = max(capacity * 2, instance_id + 1)
+        extra = new_capacity - capacity
+        self.poses = numpy.concatenate(
+            (self.poses, numpy.zeros((extra, 4, 4))))
+        self.shape_index = numpy.concatenate(
+            (self.shape_index, numpy.full(extra, -1, dtype=numpy.int64)))
+        self.color_index = numpy.concatenate(
+            (self.color_index, numpy.full(extra, -1, dtype=numpy.int64)))
+    
+    def get_shape_index(self, brick_shape):
+        name = str(brick_shape)
+        if name not in self.shape_lookup:
+            self.shape_lookup[name] = len(self.shapes)
+            self.shapes.append(brick_shape)
+            self.shape_bbox_vertices = numpy.concatenate((
+                self.shape_bbox_vertices, brick_shape.bbox_vertices[None]))
+        return self.shape_lookup[name]
+    
+    def get_color_index(self, color):
+        name = str(color)
+        if name not in self.color_lookup:
+            self.color_lookup[name] = len(self.colors)
+            self.colors.append(color)
+        return self.color_lookup[name]
+    
+    def make_instance(
+        self, instance_id, brick_shape, color, transform, mask_color=None
+    ):
+        return ArrayBrickInstance(
+            self,
+            instance_id,
+            brick_shape,
+            color,
+            transform,
+            mask_color=mask_color,
+        )
+    
+    def __setitem__(self, key, value):
+        assert isinstance(value, BrickInstance)
+        assert int(key) == int(value)
+        if not (isinstance(value, ArrayBrickInstance) and value.table is self):
+            value = self.make_instance(
+                int(value),
+                value.brick_shape,
+                value.color,
+                value.transform,
+                mask_color=value.mask_color,
+            )
+        self.instances[int(key)] = value
+        self.snap_layout = None
+    
+    def __delitem__(self, key):
+        del(self.instances[int(key)])
+        self.shape_index[int(key)] = -1
+        self.color_index[int(key)] = -1
+        self.snap_layout = None
+    
+    # bulk queries -------------------------------------------------------------
+    def get_instance_ids(self):
+        return numpy.nonzero(self.shape_index >= 0)[0]
+    
+    def get_poses(self, instance_ids=None):
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        return self.poses[instance_ids]
+    
+    def get_bbox_vertices(self, instance_ids=None):
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        return (
+            self.poses[instance_ids] @
+            self.shape_bbox_vertices[self.shape_index[instance_ids]]
+        )
+    
+    def get_shape_labels(self, shape_ids, instance_ids=None):
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        shape_labels = numpy.array(
+            [shape_ids.get(str(shape), -1) for shape in self.shapes] + [-1],
+            dtype=numpy.int64,
+        )
+        return shape_labels[self.shape_index[instance_ids]]
+    
+    def get_color_labels(self, color_ids, instance_ids=None):
+        if instance_ids is None:
+            instance_ids = self.get_instance_ids()
+        color_labels = numpy.array(
+            [color_ids.get(str(color), -1) for color in self.colors] + [-1],
+            dtype=numpy.int64,
+        )
+        return color_labels[self.color_index[instance_ids]]
+    
+    def get_snap_layout(self):
+        if self.snap_layout is None:
+            snap_instances = [numpy.zeros(0, dtype=numpy.int64)]
+            snap_ids = [numpy.zeros(0, dtype=numpy.int64)]
+            local_transforms = [numpy.zeros((0,4,4))]
+            for i in self.get_instance_ids().tolist():
+                transforms = self.instances[i].brick_shape.get_snap_arrays()[
+                    'transform']
+                num_snaps = transforms.shape[0]
+                snap_instances.append(
+                    numpy.full(num_snaps, i, dtype=numpy.int64))
+                snap_ids.append(numpy.arange(num_snaps, dtype=numpy.int64))
+                local_transforms.append(transforms)
+            self.snap_layout = {
+                'instance' : numpy.concatenate(snap_instances),
+                'snap' : numpy.concatenate(snap_ids),
+                'transform' : numpy.concatenate(local_transforms),
+            }
+        
+        return self.snap_layout
+    
+    def get_snap_transforms(self, instance_ids=None):
+        layout = self.get_snap_layout()
+        snap_instances = layout['instance']
+        snap_ids = layout['snap']
+        local_transforms = layout['transform']
+        if instance_ids is not None:
+            selected = numpy.isin(snap_instances, instance_ids)
+            snap_instances = snap_instances[selected]
+            snap_ids = snap_ids[selected]
+            local_transforms = local_transforms[selected]
+        
+        return (
+            snap_instances,
+            snap_ids,
+            self.poses[snap_instances] @ local_transforms,
+        )
+
 class BrickInstance:
     def __init__(self,
             instance_id, brick_shape, color, transform, mask_color=None):
@@ -152,3 +397,41 @@ class BrickInstance:
     
     def bbox_vertices(self):
         return self.transform @ self.brick_shape.bbox_vertices
+
+class ArrayBrickInstance(BrickInstance):
+    '''
+    A BrickInstance whose transform and color are stored in a
+    BrickInstanceArrayTable.  The transform property returns a copy, so
+    holding on to it and moving the instance later behaves the same way as
+    it does for a plain BrickInstance.
+    '''
+    def __init__(self,
+            table, instance_id, brick_shape, color, transform, mask_color=None):
+        self.table = table
+        table.ensure_capacity(instance_id)
+        table.shape_index[instance_id] = table.get_shape_index(brick_shape)
+        super(ArrayBrickInstance, self).__init__(
+            instance_id, brick_shape, color, transform, mask_color=mask_color)
+    
+    def get_transform(self):
+        return self.table.poses[self.instance_id].copy()
+    
+    def set_transform(self, transform):
+        self.table.poses[self.instance_id] = transform
+    
+    transform = property(get_transform, set_transform)
+    
+    def get_color(self):
+        return self.table.colors[self.table.color_index[self.instance_id]]
+    
+    def set_color(self, color):
+        self.table.color_index[self.instance_id] = (
+            self.table.get_color_index(color))
+    
+    color = property(get_color, set_color)
+    
+    def bbox_vertices(self):
+        return (
+            self.table.poses[self.instance_id] @
+            self.brick_shape.bbox_vertices
+        )
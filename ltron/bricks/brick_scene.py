@@ -15,7 +15,8 @@ except ImportError:
 
 from ltron.ldraw.documents import LDrawDocument
 from ltron.bricks.brick_shape import BrickShapeLibrary
-from ltron.bricks.brick_instance import BrickInstanceTable
+from ltron.bricks.brick_instance import (
+    BrickInstanceTable, BrickInstanceArrayTable)
 from ltron.bricks.brick_color import BrickColorLibrary
 from ltron.bricks.snap import SnapInstance, UniversalSnap, UnsupportedSnap
 try:
@@ -23,7 +24,8 @@ try:
     render_available = True
 except ImportError:
     render_available = False
-from ltron.geometry.grid_bucket import GridBucket
+from ltron.render.batch import BatchRenderEnvironment
+from ltron.bricks.snap_connections import SnapConnectionIndex
 try:
     from ltron.geometry.collision import CollisionChecker
     collision_available = True
@@ -66,7 +68,8 @@ class BrickScene:
             track_snaps=False,
             collision_checker=False,
             collision_checker_args=None,
-            shape_library=None):
+            shape_library=None,
+            array_instances=False):
         
         #self.default_image_light = default_image_light
         
@@ -81,12 +84,14 @@ class BrickScene:
         # track_snaps
         self.track_snaps = False
         self.snap_tracker = None
+        self.matching_snap_cache = {}
         if track_snaps:
             self.make_track_snaps()
             self.assembly_cache = None
         
         # collision_checker
         self.collision_checker = None
+        self.instance_box_cache = None
         if collision_checker:
             if collision_checker_args is None:
                 collision_checker_args = {}
@@ -97,20 +102,28 @@ class BrickScene:
             shape_library = BrickShapeLibrary()
         self.shape_library = shape_library
         self.color_library = BrickColorLibrary()
-        self.instances = BrickInstanceTable(
+        if array_instances:
+            instance_table = BrickInstanceArrayTable
+        else:
+            instance_table = BrickInstanceTable
+        self.instances = instance_table(
                 self.shape_library,
                 self.color_library,
         )
     
     def make_renderable(self, **render_args):
-        assert render_available
         if not self.renderable:
-            self.render_environment = RenderEnvironment(**render_args)
+            if render_args.get('opengl_mode', None) == 'batch':
+                self.render_environment = BatchRenderEnvironment(
+                    **render_args)
+            else:
+                assert render_available
+                self.render_environment = RenderEnvironment(**render_args)
             self.renderable = True
     
     def make_track_snaps(self):
         if not self.track_snaps:
-            self.snap_tracker = GridBucket(cell_size=8)
+            self.snap_tracker = SnapConnectionIndex()
             self.track_snaps = True
     
     def make_collision_checker(self, **collision_checker_args):
@@ -157,6 +170,8 @@ class BrickScene:
                 self.update_instance_snaps(brick_instance)
         
         self.assembly_cache = None
+        self.instance_box_cache = None
+        self.matching_snap_cache.clear()
     
     def export_ldraw_text(self, file_name, instances=None):
         if instances is None:
@@ -191,11 +206,90 @@ class BrickScene:
             f.write(text)
     
     def set_assembly(self, assembly, shape_ids, color_ids):
-        self.clear_instances()
-        self.import_assembly(
-            assembly, shape_ids, color_ids, match_instance_ids=True)
+        '''
+        Make the scene match assembly, with instance ids matching the
+        assembly indices.  Only the differences are applied: instances that
+        are missing or have a different shape are (re)added, extra
+        instances are removed, and instances that only differ in color or
+        pose are updated in place.  Instances that are kept are shown if
+        they were hidden, as if the scene had been rebuilt.
+        '''
+        shape_labels = {value:key for key, value in shape_ids.items()}
+        color_labels = {value:key for key, value in color_ids.items()}
+        
+        target_shapes = numpy.asarray(assembly['shape'])
+        target_colors = numpy.asarray(assembly['color'])
+        target_poses = numpy.asarray(assembly['pose'])
+        num_slots = target_shapes.shape[0]
+        
+        # compare the live instances against their assembly slots
+        live_ids = self.instances.get_instance_ids()
+        in_range = live_ids < num_slots
+        common_ids = live_ids[in_range]
+        live_shapes = self.instances.get_shape_labels(shape_ids, common_ids)
+        keep = live_shapes == target_shapes[common_ids]
+        keep &= target_shapes[common_ids] != 0
+        remove_ids = numpy.concatenate(
+            (live_ids[~in_range], common_ids[~keep]))
+        common_ids = common_ids[keep]
+        
+        for instance_id in remove_ids.tolist():
+            self.remove_instance(instance_id)
+        
+        if common_ids.shape[0]:
+            live_colors = self.instances.get_color_labels(
+                color_ids, common_ids)
+            recolor_ids = common_ids[
+                live_colors != target_colors[common_ids]]
+            for instance_id in recolor_ids.tolist():
+                try:
+                    color = color_labels[target_colors[instance_id]]
+                except KeyError:
+                    raise MissingColorError
+                self.set_instance_color(instance_id, color)
+            
+            live_poses = self.instances.get_poses(common_ids)
+            moved = numpy.any(
+                live_poses != target_poses[common_ids], axis=(1,2))
+            for instance_id in common_ids[moved].tolist():
+                self.move_instance(
+                    instance_id, target_poses[instance_id].copy())
+            
+            if self.renderable:
+                for instance_id in common_ids.tolist():
+                    instance = self.instances[instance_id]
+                    if self.instance_hidden(instance):
+                        self.show_instance(instance)
+        
+        # add everything that is missing
+        add_ids = numpy.nonzero(target_shapes)[0]
+        add_ids = add_ids[~numpy.isin(add_ids, common_ids)]
+        for instance_id in add_ids.tolist():
+            try:
+                brick_shape = shape_labels[target_shapes[instance_id]]
+            except KeyError:
+                raise MissingClassError(target_shapes[instance_id])
+            try:
+                color = color_labels[target_colors[instance_id]]
+            except KeyError:
+                raise MissingColorError
+            self.add_instance(
+                brick_shape,
+                color,
+                target_poses[instance_id],
+                instance_id=instance_id,
+            )
+        
+        # instances added and removed since the state was saved leave the
+        # id counter high, reset it to where a rebuilt scene would be
+        target_ids = numpy.nonzero(target_shapes)[0]
+        if target_ids.shape[0]:
+            self.instances.next_instance_id = int(target_ids[-1]) + 1
+        else:
+            self.instances.next_instance_id = 1
         
         self.assembly_cache = None
+        self.instance_box_cache = None
     
     def import_assembly(
         self,
@@ -231,6 +325,7 @@ class BrickScene:
                 brick_shape, color, instance_pose, instance_id=instance_id)
         
         self.assembly_cache = None
+        self.instance_box_cache = None
     
     def make_shape_ids(self):
         brick_shapes = [str(bt) for bt in self.shape_library.values()]
@@ -249,13 +344,27 @@ class BrickScene:
         max_instances=None,
         max_edges=None,
         unidirectional=False,
+        out=None,
     ):
+        '''
+        Returns the scene as a dictionary of 'shape', 'color', 'pose' and
+        'edges' arrays indexed by instance id.  If out is provided (see
+        make_empty_assembly), the arrays in it are overwritten in place and
+        out is returned, so that callers that observe the scene every step
+        can reuse the same memory instead of allocating new arrays.
+        '''
         # this could speed things up, but seems really dangerous, and I'm not
         # sure I trust it right now
         #if self.assembly_cache is not None:
         #    return self.assembly_cache
         
-        assembly = {}
+        if out is not None:
+            if max_instances is None:
+                max_instances = out['shape'].shape[0] - 1
+            assert out['shape'].shape[0] == max_instances + 1
+            if max_edges is None:
+                max_edges = out['edges'].shape[1]
+            assert out['edges'].shape[1] == max_edges
         
         if shape_ids is None:
             shape_ids = self.make_shape_ids()
@@ -275,29 +384,45 @@ class BrickScene:
                     raise TooManyInstancesError(
                         'Instance ids %s larger than max_instances: %i'%(
                         list(self.instances.keys()), max_instances))
-        assembly['shape'] = numpy.zeros((max_instances+1,), dtype=numpy.long)
-        assembly['color'] = numpy.zeros((max_instances+1,), dtype=numpy.long)
-        assembly['pose'] = numpy.zeros((max_instances+1, 4, 4))
-        for instance_id, instance in self.instances.items():
-            try:
-                assembly['shape'][instance_id] = shape_ids[
-                    str(instance.brick_shape)]
-            except KeyError:
-                raise MissingClassError(instance.brick_shape)
-            try:
-                assembly['color'][instance_id] = color_ids[str(instance.color)]
-            except KeyError:
-                raise MissingColorError
-            assembly['pose'][instance_id] = instance.transform
+        if out is None:
+            assembly = {}
+            assembly['shape'] = numpy.zeros(
+                (max_instances+1,), dtype=numpy.long)
+            assembly['color'] = numpy.zeros(
+                (max_instances+1,), dtype=numpy.long)
+            assembly['pose'] = numpy.zeros((max_instances+1, 4, 4))
+        else:
+            assembly = out
+            assembly['shape'].fill(0)
+            assembly['color'].fill(0)
+            assembly['pose'].fill(0)
+        instance_ids = self.instances.get_instance_ids()
+        shape_labels = self.instances.get_shape_labels(shape_ids, instance_ids)
+        missing_shapes = instance_ids[shape_labels == -1]
+        if missing_shapes.shape[0]:
+            raise MissingClassError(
+                self.instances[missing_shapes[0]].brick_shape)
+        color_labels = self.instances.get_color_labels(color_ids, instance_ids)
+        if numpy.any(color_labels == -1):
+            raise MissingColorError
+        assembly['shape'][instance_ids] = shape_labels
+        assembly['color'][instance_ids] = color_labels
+        assembly['pose'][instance_ids] = self.instances.get_poses(instance_ids)
         
         all_edges = self.get_assembly_edges(unidirectional=unidirectional)
         num_edges = all_edges.shape[1]
         if max_edges is not None:
             assert all_edges.shape[1] <= max_edges, 'Too many edges'
-            extra_edges = numpy.zeros(
-                (4, max_edges - num_edges), dtype=numpy.long)
-            all_edges = numpy.concatenate((all_edges, extra_edges), axis=1)
-        assembly['edges'] = all_edges
+        if out is not None:
+            assembly['edges'][:,:num_edges] = all_edges
+            assembly['edges'][:,num_edges:] = 0
+        else:
+            if max_edges is not None:
+                extra_edges = numpy.zeros(
+                    (4, max_edges - num_edges), dtype=numpy.long)
+                all_edges = numpy.concatenate(
+                    (all_edges, extra_edges), axis=1)
+            assembly['edges'] = all_edges
         
         self.assembly_cache = assembly
         
@@ -338,6 +463,8 @@ class BrickScene:
             self.update_instance_snaps(brick_instance)
         
         self.assembly_cache = None
+        self.instance_box_cache = None
+        self.matching_snap_cache.clear()
         return brick_instance
     
     def move_instance(self, instance, transform):
@@ -349,6 +476,7 @@ class BrickScene:
             self.update_instance_snaps(instance)
         
         self.assembly_cache = None
+        self.instance_box_cache = None
     
     def hide_instance(self, instance):
         self.renderer.hide_instance(str(instance))
@@ -364,6 +492,8 @@ class BrickScene:
             self.render_environment.clear_instances()
         
         self.assembly_cache = None
+        self.instance_box_cache = None
+        self.matching_snap_cache.clear()
     
     def set_instance_color(self, instance, new_color):
         self.load_colors([new_color])
@@ -379,23 +509,18 @@ class BrickScene:
         if self.renderable:
             self.render_environment.remove_instance(instance)
         if self.track_snaps:
-            #for i, snap in enumerate(instance.snaps):
-            #    snap_id = (str(instance), i)
-            #    self.snap_tracker.remove(snap_id)
-            for snap in instance.snaps:
-                self.snap_tracker.remove(tuple(snap))
+            self.snap_tracker.remove_instance(instance)
         del(self.instances[instance])
         
         self.assembly_cache = None
+        self.instance_box_cache = None
+        self.matching_snap_cache.clear()
     
     def get_scene_bbox(self):
-        vertices = []
-        for i, instance in self.instances.items():
-            vertices.append(instance.bbox_vertices())
+        vertices = self.instances.get_bbox_vertices()
         if len(vertices):
-            vertices = numpy.concatenate(vertices, axis=1)
-            vmin = numpy.min(vertices[:3], axis=1)
-            vmax = numpy.max(vertices[:3], axis=1)
+            vmin = numpy.min(vertices[:,:3], axis=(0,2))
+            vmax = numpy.max(vertices[:,:3], axis=(0,2))
         else:
             vmin = numpy.zeros(3)
             vmax = numpy.zeros(3)
@@ -405,11 +530,24 @@ class BrickScene:
     # instance snaps -----------------------------------------------------------
     def update_instance_snaps(self, instance):
         assert self.track_snaps
-        for snap in instance.snaps:
-            snap_id = tuple(snap)
-            self.snap_tracker.remove(snap_id)
-            snap_position = snap.transform[:3,3]
-            self.snap_tracker.insert(snap_id, snap_position)
+        self.snap_tracker.update_instance(instance)
+    
+    def get_instance_boxes(self):
+        '''
+        Returns the ids of every instance in the scene together with the
+        world-space axis-aligned bounds (min and max) of their bounding
+        boxes, computed with one bulk query.  The result is cached until an
+        instance is added, moved or removed.
+        '''
+        if self.instance_box_cache is None:
+            instance_ids = self.instances.get_instance_ids()
+            corners = self.instances.get_bbox_vertices(instance_ids)[:,:3]
+            self.instance_box_cache = (
+                instance_ids,
+                numpy.min(corners, axis=2),
+                numpy.max(corners, axis=2),
+            )
+        return self.instance_box_cache
     
     def get_matching_snaps(
         self,
@@ -417,8 +555,23 @@ class BrickScene:
         polarity=None,
         style=None,
     ):
+        '''
+        Returns the snaps of instances that match polarity and style.  When
+        instances is None the result is cached until instances are added or
+        removed, so callers should not modify the returned list.
+        '''
         if instances is None:
-            instances = self.instances
+            if style is not None and not isinstance(style, str):
+                style = tuple(style)
+            key = (polarity, style)
+            if key not in self.matching_snap_cache:
+                self.matching_snap_cache[key] = self.get_matching_snaps(
+                    instances=list(self.instances.keys()),
+                    polarity=polarity,
+                    style=style,
+                )
+            return self.matching_snap_cache[key]
+        
         matching_snaps = []
         for instance in instances:
             instance = self.instances[instance]
@@ -444,53 +597,40 @@ class BrickScene:
         else:
             return None
     
-    def get_instance_snap_connections(self, instance, unidirectional=False):
-        assert self.track_snaps
-        
-        instance = self.instances[instance]
+    def edges_to_snap_connections(self, edges):
         connections = []
-        for snap in instance.snaps:
-            if isinstance(snap.snap_style, UnsupportedSnap):
-                continue
-            snap_position = snap.transform[:3,3]
-            snap_tuples_in_radius = self.snap_tracker.lookup(
-                snap_position, snap.search_radius)
-            
-            for other_snap_tuple in snap_tuples_in_radius:
-                other_snap = self.snap_tuple_to_snap(other_snap_tuple)
-                if snap.connected(other_snap, unidirectional=unidirectional):
-                    connections.append((snap, other_snap))
-        
+        for instance_a, instance_b, snap_a, snap_b in edges.T:
+            connections.append((
+                self.instances[instance_a].snaps[snap_a],
+                self.instances[instance_b].snaps[snap_b],
+            ))
         return connections
     
+    def get_instance_snap_connections(self, instance, unidirectional=False):
+        assert self.track_snaps
+        edges = self.snap_tracker.find_connections(
+            [instance], unidirectional=unidirectional)
+        return self.edges_to_snap_connections(edges)
+    
     def get_all_snap_connections(self, instances=None, unidirectional=False):
         assert self.track_snaps
         if instances is None:
             instances = self.instances
-        
-        snap_connections = {}
-        for instance in instances:
-            connections = self.get_instance_snap_connections(
-                instance, unidirectional=unidirectional)
-            snap_connections[int(instance)] = connections
+            edges = self.snap_tracker.find_connections(
+                unidirectional=unidirectional)
+        else:
+            edges = self.snap_tracker.find_connections(
+                instances, unidirectional=unidirectional)
+        snap_connections = {int(instance):[] for instance in instances}
+        for connection in self.edges_to_snap_connections(edges):
+            snap_connections[int(connection[0][0])].append(connection)
         
         return snap_connections
     
     def get_assembly_edges(self, instances=None, unidirectional=False):
         assert self.track_snaps
-        snap_connections = self.get_all_snap_connections(
-            instances=instances, unidirectional=unidirectional)
-        all_edges = set()
-        for instance_a_id, connections in snap_connections.items():
-            #for instance_b_name, snap_id_b, snap_id_a in connections:
-            for snap_a, snap_b in connections:
-                #instance_b_id = int(instance_b_name)
-                #if instance_a_id < instance_b_id or not unidirectional:
-                #all_edges.add(
-                #    (instance_a_id, instance_b_id, snap_id_a, snap_id_b))
-                all_edges.add((snap_a[0], snap_b[0], snap_a[1], snap_b[1]))
-        num_edges = len(all_edges)
-        all_edges = numpy.array(list(all_edges)).T.reshape(4, num_edges)
+        all_edges = self.snap_tracker.find_connections(
+            instances, unidirectional=unidirectional)
         return all_edges.astype(numpy.long)
     
     def get_all_snaps(self):
@@ -502,6 +642,17 @@ class BrickScene:
         
         return all_snaps
     
+    def get_all_snap_transforms(self, instances=None):
+        '''
+        Returns (instance, snap, transform) arrays containing the world-space
+        transform of every snap in the scene (or in instances), computed in
+        one batch instead of through each SnapInstance.
+        '''
+        if instances is not None:
+            instances = numpy.array(
+                [int(instance) for instance in instances], dtype=numpy.int64)
+        return self.instances.get_snap_transforms(instances)
+    
     def get_occupied_snaps(self):
         # build a list of occupied snaps
         all_snap_connections = self.get_all_snap_connections()
@@ -537,19 +688,15 @@ class BrickScene:
         
         candidate_transforms = pick.pick_and_place_transforms(pick, place)
         
-        pick_instance_transform = pick.brick_instance.transform
-        
         if check_collision:
-            transforms = []
-            for transform in candidate_transforms:
-                self.move_instance(pick.brick_instance, transform)
-                collision = self.check_snap_collision(
-                    [pick.brick_instance],
-                    pick,
-                )
-                self.move_instance(pick.brick_instance, pick_instance_transform)
-                if not collision:
-                    transforms.append(transform)
+            collisions = self.check_pick_and_place_collisions(
+                pick, candidate_transforms)
+            transforms = [
+                transform
+                for transform, collision
+                in zip(candidate_transforms, collisions)
+                if not collision
+            ]
         else:
             transforms = candidate_transforms
         
@@ -709,7 +856,7 @@ class BrickScene:
         self, target_instances, render_transform, scene_instances=None
     ):
         assert self.collision_checker is not None
-        if self.render_environment.window is not None:
+        if self.renderable and self.render_environment.window is not None:
             self.render_environment.window.set_active()
         return self.collision_checker.check_collision(
             target_instances, render_transform, scene_instances=scene_instances)
@@ -718,7 +865,23 @@ class BrickScene:
         self, target_instances, snap, *args, **kwargs
     ):
         assert self.collision_checker is not None
-        if self.render_environment.window is not None:
+        if self.renderable and self.render_environment.window is not None:
             self.render_environment.window.set_active()
         return self.collision_checker.check_snap_collision(
             target_instances, snap, *args, **kwargs)
+    
+    def check_pick_and_place_collisions(self, pick, candidate_transforms):
+        '''
+        Returns a list with one entry per candidate transform of
+        pick.brick_instance, which is True if the pick snap would be blocked
+        at that transform.  All candidates are evaluated in one batch and the
+        scene is not modified.
+        '''
+        inv_pick_instance_transform = numpy.linalg.inv(
+            pick.brick_instance.transform)
+        scene_offsets = [
+            transform @ inv_pick_instance_transform
+            for transform in candidate_transforms
+        ]
+        return self.check_snap_collision(
+            [pick.brick_instance], pick, scene_offsets=scene_offsets)
@@ -8,10 +8,12 @@ from ltron.ldraw.commands import (
     LDCadSnapStyleCommand,
     LDCadSnapClearCommand,
     LDrawContentCommand,
+    LDrawTriangleCommand,
+    LDrawQuadCommand,
 )
 
 #import ltron.ldraw.paths as ldraw_paths
-from ltron.ldraw.parts import LDRAW_PARTS
+from ltron.ldraw.parts import LDRAW_PARTS, get_reference_name
 from ltron.ldraw.documents import (
     LDrawDocument,
     LDrawMPDMainFile,
@@ -21,19 +23,22 @@ from ltron.ldraw.documents import (
 )
 from ltron.bricks.snap import (
     Snap, SnapStyle, SnapStyleSequence, SnapClear, deduplicate_snaps, griderate)
+import ltron.bricks.shape_cache as shape_cache
+from ltron.bricks.snap_connections import make_snap_arrays
 
 class BrickShapeLibrary(collections.abc.MutableMapping):
-    def __init__(self, brick_shapes=None):
+    def __init__(self, brick_shapes=None, use_cache=True):
         if brick_shapes is None:
             brick_shapes = {}
         self.brick_shapes = brick_shapes
+        self.use_cache = use_cache
     
     def add_shape(self, new_shape):
         if new_shape in self:
             return self[new_shape]
         
         if not isinstance(new_shape, BrickShape):
-            new_shape = BrickShape(new_shape)
+            new_shape = BrickShape(new_shape, use_cache=self.use_cache)
         self[new_shape.reference_name] = new_shape
         return new_shape
     
@@ -73,13 +78,36 @@ class BrickShapeLibrary(collections.abc.MutableMapping):
         return len(self.brick_shapes)
 
 class BrickShape:
-    def __init__(self, document):
+    def __init__(self, document, use_cache=False):
         if isinstance(document, str):
-            document = LDrawDocument.parse_document(document)
-        self.reference_name = document.reference_name
+            reference_name = get_reference_name(document)
+        else:
+            reference_name = document.reference_name
+        self.reference_name = reference_name
         self.mesh_name = self.reference_name.replace('.dat', '')
+        self.snap_arrays = None
+        
+        use_cache = use_cache and shape_cache.is_cacheable(reference_name)
+        if use_cache:
+            cached_shape = shape_cache.load_shape(reference_name)
+            if cached_shape is not None:
+                # the parsed document is never needed once the snaps and
+                # vertices have been resolved, so it is not restored
+                self.document = None
+                self.snaps = SnapStyleSequence(cached_shape['snaps'])
+                self.vertices = cached_shape['vertices']
+                self.triangle_vertices = cached_shape['triangle_vertices']
+                self.set_bbox(
+                    cached_shape['bbox'], cached_shape['empty_shape'])
+                return
+        
+        if isinstance(document, str):
+            document = LDrawDocument.parse_document(document)
         self.document = document
         self.construct_snaps_and_vertices()
+        
+        if use_cache:
+            shape_cache.save_shape(self)
     
     def __str__(self):
         return self.reference_name
@@ -102,6 +130,7 @@ class BrickShape:
             reference_table = document.reference_table
             snaps = []
             vertices = [numpy.zeros((4,0))]
+            triangle_vertices = [numpy.zeros((4,0))]
             for command in document.commands:
                 if isinstance(command, LDrawImportCommand):
                     reference_name = command.reference_name
@@ -109,10 +138,11 @@ class BrickShape:
                             reference_table['ldraw'][reference_name])
                     reference_transform = transform @ command.transform
                     try:
-                        s, v = snaps_and_vertices_from_nested_document(
+                        s, v, t = snaps_and_vertices_from_nested_document(
                                 reference_document, reference_transform)
                         snaps.extend(s)
                         vertices.append(v)
+                        triangle_vertices.append(t)
                     except:
                         print('Error while importing: %s'%reference_name)
                         raise
@@ -135,10 +165,11 @@ class BrickShape:
                         reference_transforms = [transform @ command.transform]
                     try:
                         for reference_transform in reference_transforms:
-                            s, v = snaps_and_vertices_from_nested_document(
+                            s, v, t = snaps_and_vertices_from_nested_document(
                                     reference_document, reference_transform)
                             snaps.extend(s)
                             vertices.append(v)
+                            triangle_vertices.append(t)
                     except:
                         print('Error while importing: %s'%reference_name)
                         raise
@@ -149,25 +180,41 @@ class BrickShape:
                     snaps.extend(new_snaps)
                 elif isinstance(command, LDrawContentCommand):
                     vertices.append(transform @ command.vertices)
+                    # triangles are stored as consecutive columns
+                    # and quads are split into two triangles
+                    num_vertices = command.vertices.shape[1]
+                    if (isinstance(command, LDrawTriangleCommand) and
+                        num_vertices == 3
+                    ):
+                        triangle_vertices.append(vertices[-1])
+                    elif (isinstance(command, LDrawQuadCommand) and
+                        num_vertices == 4
+                    ):
+                        triangle_vertices.append(
+                            vertices[-1][:,[0,1,2,0,2,3]])
             
             if not document.shadow:
                 reference_name = document.reference_name
                 if reference_name in reference_table['shadow']:
                     shadow_document = reference_table['shadow'][reference_name]
                     try:
-                        s,v = snaps_and_vertices_from_nested_document(
+                        s,v,t = snaps_and_vertices_from_nested_document(
                                 shadow_document, transform)
                         snaps.extend(s)
                         vertices.append(v)
+                        triangle_vertices.append(t)
                     except:
                         print('Error while importing shadow: %s'%reference_name)
                         raise
             
             vertices = numpy.concatenate(vertices, axis=1)
-            return snaps, vertices
+            triangle_vertices = numpy.concatenate(triangle_vertices, axis=1)
+            return snaps, vertices, triangle_vertices
         
         try:
-            snaps, self.vertices = snaps_and_vertices_from_nested_document(
+            (snaps,
+             self.vertices,
+             self.triangle_vertices) = snaps_and_vertices_from_nested_document(
                 self.document)
         except:
             print('Error while importing: %s'%self.document.reference_name)
@@ -193,10 +240,14 @@ class BrickShape:
                 numpy.min(self.vertices[:3], axis=1),
                 numpy.max(self.vertices[:3], axis=1),
             ])
-            self.empty_shape=False
+            empty_shape=False
         except ValueError:
             bb = numpy.array([[0,0,0], [0,0,0]])
-            self.empty_shape=True
+            empty_shape=True
+        self.set_bbox(bb, empty_shape)
+    
+    def set_bbox(self, bb, empty_shape):
+        self.empty_shape = empty_shape
         self.bbox = bb
         self.bbox_vertices = numpy.array([
             [bb[0][0], bb[0][0], bb[0][0], bb[0][0],
@@ -208,5 +259,10 @@ class BrickShape:
             [1, 1, 1, 1, 1, 1, 1, 1]
         ])
     
+    def get_snap_arrays(self):
+        if self.snap_arrays is None:
+            self.snap_arrays = make_snap_arrays(self.snaps)
+        return self.snap_arrays
+    
     def get_upright_snaps(self):
         return [snap for snap in self.snaps if snap.is_upright()]
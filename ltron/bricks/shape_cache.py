@@ -0,0 +1,161 @@
+import os
+import hashlib
+import tempfile
+
+import numpy
+
+from ltron.home import get_ltron_home
+import ltron.ldraw.parts as ldraw_parts
+from ltron.bricks.snap import SNAP_STYLE_REGISTRY, SNAP_STYLE_NAMES
+
+# bump this whenever the layout of the cached arrays or the way snaps are
+# constructed changes, so that stale caches are ignored
+SHAPE_CACHE_VERSION = 2
+
+source_hash = None
+
+def get_source_hash():
+    '''
+    Hash the LDraw and LDCad source archives (and the cache version) so that
+    cached parts are invalidated whenever either library is reinstalled.
+    This is computed once per process.
+    '''
+    global source_hash
+    if source_hash is None:
+        h = hashlib.sha1()
+        h.update(('shape_cache_v%i'%SHAPE_CACHE_VERSION).encode('utf-8'))
+        for path in ldraw_parts.ldraw_zip_path, ldraw_parts.shadow_zip_path:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda : f.read(2**20), b''):
+                    h.update(chunk)
+        source_hash = h.hexdigest()[:16]
+    
+    return source_hash
+
+def get_shape_cache_directory():
+    return os.path.join(get_ltron_home(), 'shape_cache', get_source_hash())
+
+def is_cacheable(reference_name):
+    # only parts that come directly out of complete.zip are safe to cache,
+    # anything else may change on disk without the source hash changing
+    return reference_name in ldraw_parts.LDRAW_PARTS
+
+def get_shape_cache_path(reference_name):
+    file_name = reference_name.replace('/', '__') + '.npz'
+    return os.path.join(get_shape_cache_directory(), file_name)
+
+def snaps_to_arrays(snaps):
+    num_snaps = len(snaps)
+    arrays = {
+        'snap_style' : numpy.zeros(num_snaps, dtype=numpy.int64),
+        'snap_transform' : numpy.zeros((num_snaps, 4, 4)),
+        'snap_length' : numpy.full(num_snaps, numpy.nan),
+        'snap_radius' : numpy.full(num_snaps, numpy.nan),
+        'snap_has_group' : numpy.zeros(num_snaps, dtype=bool),
+    }
+    style_names = sorted(set(SNAP_STYLE_NAMES[type(snap)] for snap in snaps))
+    style_indices = {name:i for i, name in enumerate(style_names)}
+    type_ids = []
+    groups = []
+    subtype_ids = []
+    for i, snap in enumerate(snaps):
+        arrays['snap_style'][i] = style_indices[SNAP_STYLE_NAMES[type(snap)]]
+        arrays['snap_transform'][i] = snap.transform
+        attrs = vars(snap)
+        if 'length' in attrs:
+            arrays['snap_length'][i] = snap.length
+        if 'radius' in attrs:
+            arrays['snap_radius'][i] = snap.radius
+        arrays['snap_has_group'][i] = snap.group is not None
+        type_ids.append(snap.type_id)
+        groups.append(snap.group if snap.group is not None else '')
+        subtype_ids.append(attrs.get('subtype_id', ''))
+    
+    arrays['snap_style_names'] = numpy.array(style_names, dtype=str)
+    arrays['snap_type_id'] = numpy.array(type_ids, dtype=str)
+    arrays['snap_group'] = numpy.array(groups, dtype=str)
+    arrays['snap_subtype_id'] = numpy.array(subtype_ids, dtype=str)
+    
+    return arrays
+
+def arrays_to_snaps(arrays):
+    style_names = arrays['snap_style_names']
+    snaps = []
+    for i in range(arrays['snap_style'].shape[0]):
+        snap_class = SNAP_STYLE_REGISTRY[
+            str(style_names[arrays['snap_style'][i]])]
+        # bypass __init__, which expects the original LDCad command
+        snap = snap_class.__new__(snap_class)
+        snap.type_id = str(arrays['snap_type_id'][i])
+        if arrays['snap_has_group'][i]:
+            snap.group = str(arrays['snap_group'][i])
+        else:
+            snap.group = None
+        snap.transform = arrays['snap_transform'][i].copy()
+        if not numpy.isnan(arrays['snap_length'][i]):
+            snap.length = float(arrays['snap_length'][i])
+        if not numpy.isnan(arrays['snap_radius'][i]):
+            snap.radius = float(arrays['snap_radius'][i])
+        subtype_id = str(arrays['snap_subtype_id'][i])
+        if subtype_id:
+            snap.subtype_id = subtype_id
+        snaps.append(snap)
+    
+    return snaps
+
+def save_shape(brick_shape):
+    '''
+    Write the resolved snaps, vertices, triangles and bounding box of a
+    BrickShape to the cache.  The file is written to a temporary path first
+    and then moved into place so that concurrent worker processes never see a
+    partial file.
+    '''
+    if not all(type(snap) in SNAP_STYLE_NAMES for snap in brick_shape.snaps):
+        return
+    
+    path = get_shape_cache_path(brick_shape.reference_name)
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    
+    arrays = snaps_to_arrays(brick_shape.snaps)
+    arrays['vertices'] = brick_shape.vertices
+    arrays['triangle_vertices'] = brick_shape.triangle_vertices
+    arrays['bbox'] = brick_shape.bbox
+    arrays['empty_shape'] = numpy.array(brick_shape.empty_shape)
+    
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def load_shape(reference_name):
+    '''
+    Returns a dictionary containing 'snaps', 'vertices', 'triangle_vertices',
+    'bbox' and 'empty_shape' for a cached part, or None if the part is not in
+    the cache.
+    '''
+    path = get_shape_cache_path(reference_name)
+    if not os.path.exists(path):
+        return None
+    
+    try:
+        with numpy.load(path, allow_pickle=False) as data:
+            arrays = {key:data[key] for key in data.files}
+    except (OSError, ValueError, KeyError):
+        # a corrupt or truncated file is treated as a cache miss and will be
+        # overwritten when the part is rebuilt
+        return None
+    
+    return {
+        'snaps' : arrays_to_snaps(arrays),
+        'vertices' : arrays['vertices'],
+        'triangle_vertices' : arrays['triangle_vertices'],
+        'bbox' : arrays['bbox'],
+        'empty_shape' : bool(arrays['empty_shape']),
+    }
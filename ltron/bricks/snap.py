@@ -1031,6 +1031,33 @@ def generic_finger_connected(outside_lockhinge, inside_lockhinge):
 def doublestudhinge_connected(housing, insert):
     return lockhinge_connected(housing, insert)
 
+# snap styles that can be written to and restored from the shape cache, keyed
+# by their module-level name (the finger classes share a __name__, so the
+# class name itself is not enough to look them up again)
+SNAP_STYLE_REGISTRY = {
+    'UnsupportedSnap' : UnsupportedSnap,
+    'UnsupportedCylinderSnap' : UnsupportedCylinderSnap,
+    'UnsupportedFingerSnap' : UnsupportedFingerSnap,
+    'Axle_4_12' : Axle_4_12,
+    'AxleHole_4_12' : AxleHole_4_12,
+    'Stud' : Stud,
+    'StudHole' : StudHole,
+    'HalfPin' : HalfPin,
+    'HalfPinHole' : HalfPinHole,
+    'InsideLockHinge' : InsideLockHinge,
+    'OutsideLockHinge' : OutsideLockHinge,
+    'DoubleStudHingeInsert' : DoubleStudHingeInsert,
+    'DoubleStudHingeHousing' : DoubleStudHingeHousing,
+    'Pos44444Finger' : Pos44444Finger,
+    'Neg44444Finger' : Neg44444Finger,
+    'BoxFinger' : BoxFinger,
+    'BoxCoverFinger' : BoxCoverFinger,
+    'PosQuadHinge' : PosQuadHinge,
+    'NegQuadHinge' : NegQuadHinge,
+}
+SNAP_STYLE_NAMES = {
+    snap_class : name for name, snap_class in SNAP_STYLE_REGISTRY.items()}
+
 # OLD ==========================================================================
 
 class SnapStyleOFF(Snap):
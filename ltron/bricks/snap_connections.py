@@ -0,0 +1,429 @@
+import numpy
+from scipy.spatial import cKDTree
+
+from ltron.bricks.snap import SNAP_STYLE_NAMES
+
+# The connection tests below are vectorized versions of the per-pair tests in
+# ltron.bricks.snap (stud_studhole_connected, stud_halfpinhole_connected, etc.)
+# and must be kept in sync with them.
+
+# every snap within this distance of another is a candidate connection, this
+# matches the largest search_radius of the snap styles in ltron.bricks.snap
+CONNECTION_SEARCH_RADIUS = 10.
+
+# queries smaller than this (query snaps x scene snaps) are answered with a
+# dense distance matrix instead of rebuilding the KD-tree
+DENSE_QUERY_LIMIT = 2**18
+
+UNSUPPORTED_KIND = -1
+SNAP_KINDS = {name:i for i, name in enumerate(sorted(
+    SNAP_STYLE_NAMES.values()))}
+
+NO_GROUP = -1
+snap_group_ids = {None:NO_GROUP}
+
+def get_snap_group_id(group):
+    if group not in snap_group_ids:
+        snap_group_ids[group] = len(snap_group_ids) - 1
+    return snap_group_ids[group]
+
+def get_snap_kind(snap):
+    name = SNAP_STYLE_NAMES.get(type(snap), None)
+    if name is None or name.startswith('Unsupported'):
+        return UNSUPPORTED_KIND
+    return SNAP_KINDS[name]
+
+def make_snap_arrays(snaps):
+    '''
+    Pack the snaps of a single BrickShape into arrays of local transforms,
+    snap kinds and group ids.
+    '''
+    num_snaps = len(snaps)
+    transforms = numpy.zeros((num_snaps, 4, 4))
+    kinds = numpy.zeros(num_snaps, dtype=numpy.int64)
+    groups = numpy.zeros(num_snaps, dtype=numpy.int64)
+    for i, snap in enumerate(snaps):
+        transforms[i] = snap.transform
+        kinds[i] = get_snap_kind(snap)
+        groups[i] = get_snap_group_id(snap.group)
+    
+    return {'transform' : transforms, 'kind' : kinds, 'group' : groups}
+
+def coincident_test(tolerance):
+    def test(first, second, positions, y_axes):
+        offset = positions[first] - positions[second]
+        return numpy.sum(offset**2, axis=-1) <= tolerance**2
+    return test
+
+def pin_test(point, pin, positions, y_axes):
+    # the point snap (a stud or stud hole) must sit at one end of the pin
+    # (a half pin or half pin hole) and point toward its middle
+    p = positions[point]
+    c = positions[pin]
+    y = y_axes[pin]
+    close_a = numpy.sum((p - (c + 5*y))**2, axis=-1) <= 2**2
+    close_b = numpy.sum((p - (c - 5*y))**2, axis=-1) <= 2**2
+    center_to_point = p - c
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        alignment = (
+            numpy.sum(y_axes[point] * center_to_point, axis=-1) /
+            numpy.linalg.norm(center_to_point, axis=-1)
+        )
+    return (close_a | close_b) & (alignment > 0.99)
+
+def finger_test(first, second, positions, y_axes):
+    offset = positions[first] - positions[second]
+    close = numpy.sum(offset**2, axis=-1) <= 2**2
+    alignment = numpy.abs(numpy.sum(y_axes[first] * y_axes[second], axis=-1))
+    return close & (alignment >= 0.975)
+
+CONNECTION_RULES = [
+    ('Stud', 'StudHole', coincident_test(2.)),
+    ('Stud', 'HalfPinHole', pin_test),
+    ('HalfPin', 'StudHole', lambda f, s, p, y : pin_test(s, f, p, y)),
+    ('HalfPin', 'HalfPinHole', coincident_test(1.)),
+    ('Axle_4_12', 'AxleHole_4_12', coincident_test(1.)),
+    ('InsideLockHinge', 'OutsideLockHinge', finger_test),
+    ('DoubleStudHingeInsert', 'DoubleStudHingeHousing', finger_test),
+    ('Pos44444Finger', 'Neg44444Finger', finger_test),
+    ('BoxFinger', 'BoxCoverFinger', finger_test),
+    ('PosQuadHinge', 'NegQuadHinge', finger_test),
+]
+CONNECTION_RULES = [
+    (SNAP_KINDS[a], SNAP_KINDS[b], test) for a, b, test in CONNECTION_RULES]
+
+def ball_point_pairs(tree, query, positions, slots):
+    '''
+    Returns the (query slot, slot) pairs within CONNECTION_SEARCH_RADIUS,
+    where tree was built over the positions of slots.
+    '''
+    neighbors = tree.query_ball_point(positions, CONNECTION_SEARCH_RADIUS)
+    counts = numpy.array([len(n) for n in neighbors], dtype=numpy.int64)
+    a = numpy.repeat(query, counts)
+    b = numpy.concatenate(
+        [numpy.zeros(0, dtype=numpy.int64)] +
+        [numpy.array(n, dtype=numpy.int64) for n in neighbors]
+    )
+    return a, slots[b]
+
+# the packed snap arrays store these fields for every snap
+PACKED_FIELDS = (
+    ('instance', (), numpy.int64),
+    ('snap', (), numpy.int64),
+    ('position', (3,), numpy.float64),
+    ('y_axis', (3,), numpy.float64),
+    ('kind', (), numpy.int64),
+    ('group', (), numpy.int64),
+)
+
+# snaps that were added or moved after the KD-tree was built are searched
+# with a small separate tree until they make up more than this fraction of
+# the packed snaps, then the packed arrays are compacted and the main tree is
+# rebuilt
+TREE_REBUILD_FRACTION = 0.25
+
+class SnapConnectionIndex:
+    '''
+    Tracks the world-space snaps of every instance in a scene as contiguous
+    arrays and finds snap connections with a single spatial query followed by
+    vectorized compatibility and alignment tests.
+    
+    Each instance owns a block of slots in the packed arrays.  Moving an
+    instance overwrites its block in place, and adding an instance appends a
+    new block.  Removing an instance only marks its block as dead.  Slots
+    written since the main KD-tree was built are marked stale.  Queries
+    ignore stale slots in the main tree and search a small side tree built
+    over just the stale slots instead.  The main tree is rebuilt, and dead
+    slots compacted away, only when the stale slots grow past
+    TREE_REBUILD_FRACTION of the packed arrays or when every snap is queried
+    at once.
+    
+    The connection edges are also maintained incrementally.  Adding, moving
+    or removing an instance marks it as dirty, and the next call to
+    find_connections recomputes the edges touching the dirty instances while
+    leaving the rest of the edge set untouched.
+    '''
+    def __init__(self):
+        self.clear()
+    
+    def clear(self):
+        self.instance_blocks = {}
+        self.packed = {
+            key : numpy.zeros((0, *shape), dtype=dtype)
+            for key, shape, dtype in PACKED_FIELDS
+        }
+        self.live = numpy.zeros(0, dtype=bool)
+        self.stale = numpy.zeros(0, dtype=bool)
+        self.num_slots = 0
+        self.num_live = 0
+        self.num_stale = 0
+        self.tree = None
+        self.side_tree = None
+        self.side_slots = None
+        self.instance_edges = {}
+        self.dirty_instances = set()
+    
+    def allocate(self, num_snaps):
+        start = self.num_slots
+        stop = start + num_snaps
+        capacity = self.live.shape[0]
+        if stop > capacity:
+            capacity = max(stop, capacity * 2)
+            for key, shape, dtype in PACKED_FIELDS:
+                data = numpy.zeros((capacity, *shape), dtype=dtype)
+                data[:self.num_slots] = self.packed[key][:self.num_slots]
+                self.packed[key] = data
+            for name in 'live', 'stale':
+                flags = numpy.zeros(capacity, dtype=bool)
+                flags[:self.num_slots] = getattr(self, name)[:self.num_slots]
+                setattr(self, name, flags)
+        
+        self.num_slots = stop
+        return start, stop
+    
+    def mark_stale(self, start, stop):
+        self.num_stale += numpy.count_nonzero(~self.stale[start:stop])
+        self.stale[start:stop] = True
+        self.side_tree = None
+        self.side_slots = None
+    
+    def update_instance(self, instance):
+        instance_id = int(instance)
+        shape_arrays = instance.brick_shape.get_snap_arrays()
+        transforms = instance.transform @ shape_arrays['transform']
+        num_snaps = transforms.shape[0]
+        
+        # reuse the existing block if the number of snaps has not changed
+        block = self.instance_blocks.get(instance_id, None)
+        if block is None or block[1] - block[0] != num_snaps:
+            self.remove_instance(instance)
+            block = self.allocate(num_snaps)
+            self.instance_blocks[instance_id] = block
+            self.live[block[0]:block[1]] = True
+            self.num_live += num_snaps
+        
+        start, stop = block
+        self.packed['instance'][start:stop] = instance_id
+        self.packed['snap'][start:stop] = numpy.arange(num_snaps)
+        self.packed['position'][start:stop] = transforms[:,:3,3]
+        self.packed['y_axis'][start:stop] = transforms[:,:3,1]
+        self.packed['kind'][start:stop] = shape_arrays['kind']
+        self.packed['group'][start:stop] = shape_arrays['group']
+        self.mark_stale(start, stop)
+        self.dirty_instances.add(instance_id)
+    
+    def remove_instance(self, instance):
+        instance_id = int(instance)
+        if instance_id in self.instance_blocks:
+            start, stop = self.instance_blocks.pop(instance_id)
+            self.live[start:stop] = False
+            self.num_live -= stop - start
+            self.mark_stale(start, stop)
+            self.dirty_instances.add(instance_id)
+    
+    def pack(self):
+        '''
+        Returns the packed arrays, including the slots of removed instances.
+        '''
+        return {
+            key : value[:self.num_slots] for key, value in self.packed.items()}
+    
+    def rebuild_tree(self):
+        # compact the live slots to the front, keeping their order so each
+        # instance's block stays contiguous
+        live = numpy.nonzero(self.live[:self.num_slots])[0]
+        new_index = numpy.cumsum(self.live[:self.num_slots]) - 1
+        for key, value in self.packed.items():
+            value[:live.shape[0]] = value[live]
+        self.instance_blocks = {
+            instance_id : (
+                int(new_index[start]), int(new_index[start]) + stop - start)
+            for instance_id, (start, stop) in self.instance_blocks.items()
+        }
+        self.num_slots = live.shape[0]
+        self.live[:] = False
+        self.live[:self.num_slots] = True
+        self.stale[:] = False
+        self.num_stale = 0
+        self.side_tree = None
+        self.side_slots = None
+        
+        self.tree = cKDTree(self.packed['position'][:self.num_slots])
+    
+    def get_tree(self):
+        if (self.tree is None or
+            self.num_stale > TREE_REBUILD_FRACTION * self.num_slots
+        ):
+            self.rebuild_tree()
+        return self.tree
+    
+    def get_side_tree(self):
+        if self.side_slots is None:
+            n = self.num_slots
+            self.side_slots = numpy.nonzero(self.stale[:n] & self.live[:n])[0]
+            if self.side_slots.shape[0]:
+                self.side_tree = cKDTree(
+                    self.packed['position'][self.side_slots])
+        return self.side_slots, self.side_tree
+    
+    def query_slots(self, instance_ids):
+        ranges = [
+            numpy.arange(*self.instance_blocks[i])
+            for i in numpy.asarray(instance_ids).reshape(-1).tolist()
+            if i in self.instance_blocks
+        ]
+        return numpy.concatenate(
+            [numpy.zeros(0, dtype=numpy.int64)] + ranges).astype(numpy.int64)
+    
+    def candidate_pairs(self, instance_ids):
+        query = self.query_slots(instance_ids)
+        num_query = query.shape[0]
+        if num_query == 0:
+            a = numpy.zeros(0, dtype=numpy.int64)
+            b = numpy.zeros(0, dtype=numpy.int64)
+        
+        elif num_query == self.num_live:
+            if self.num_stale:
+                self.rebuild_tree()
+            pairs = self.get_tree().query_pairs(
+                CONNECTION_SEARCH_RADIUS, output_type='ndarray')
+            a = numpy.concatenate((pairs[:,0], pairs[:,1]))
+            b = numpy.concatenate((pairs[:,1], pairs[:,0]))
+        
+        elif num_query * self.num_live <= DENSE_QUERY_LIMIT:
+            packed = self.pack()
+            live = numpy.nonzero(self.live[:self.num_slots])[0]
+            offsets = (
+                packed['position'][query][:,None] -
+                packed['position'][live][None]
+            )
+            distances = numpy.sum(offsets**2, axis=-1)
+            qq, bb = numpy.nonzero(distances <= CONNECTION_SEARCH_RADIUS**2)
+            a = query[qq]
+            b = live[bb]
+        
+        else:
+            # the main tree, skipping slots that changed since it was built
+            # (getting the tree may compact the slots, so look them up again)
+            tree = self.get_tree()
+            query = self.query_slots(instance_ids)
+            positions = self.packed['position'][query]
+            a, b = ball_point_pairs(
+                tree, query, positions, numpy.arange(tree.n))
+            not_stale = ~self.stale[b]
+            a = a[not_stale]
+            b = b[not_stale]
+            
+            # the side tree, holding the current position of those slots
+            side_slots, side_tree = self.get_side_tree()
+            if side_slots.shape[0]:
+                side_a, side_b = ball_point_pairs(
+                    side_tree, query, positions, side_slots)
+                a = numpy.concatenate((a, side_a))
+                b = numpy.concatenate((b, side_b))
+        
+        not_self = a != b
+        return a[not_self].astype(numpy.int64), b[not_self].astype(numpy.int64)
+    
+    def compute_connections(self, instance_ids):
+        '''
+        Compute the (4,E) array of all (instance_a, instance_b, snap_a, snap_b)
+        connections from scratch where instance_a is one of instance_ids.
+        '''
+        a, b = self.candidate_pairs(instance_ids)
+        packed = self.pack()
+        
+        kind_a = packed['kind'][a]
+        kind_b = packed['kind'][b]
+        group_match = packed['group'][a] == packed['group'][b]
+        connected = numpy.zeros(a.shape[0], dtype=bool)
+        for first_kind, second_kind, test in CONNECTION_RULES:
+            for first, second, first_kinds, second_kinds in (
+                (a, b, kind_a, kind_b),
+                (b, a, kind_b, kind_a),
+            ):
+                candidates = numpy.nonzero(
+                    (first_kinds == first_kind) &
+                    (second_kinds == second_kind) &
+                    group_match
+                )[0]
+                if len(candidates):
+                    connected[candidates] = test(
+                        first[candidates],
+                        second[candidates],
+                        packed['position'],
+                        packed['y_axis'],
+                    )
+        
+        a = a[connected]
+        b = b[connected]
+        edges = numpy.stack((
+            packed['instance'][a],
+            packed['instance'][b],
+            packed['snap'][a],
+            packed['snap'][b],
+        ))
+        if edges.shape[1]:
+            edges = numpy.unique(edges, axis=1)
+        
+        return edges
+    
+    def refresh_edges(self):
+        if not self.dirty_instances:
+            return
+        
+        dirty = self.dirty_instances
+        
+        # drop the stale edges that point at dirty instances from their
+        # clean neighbors
+        for i in dirty:
+            old_edges = self.instance_edges.pop(i, None)
+            if old_edges is None:
+                continue
+            for j in numpy.unique(old_edges[1]).tolist():
+                if j in dirty or j not in self.instance_edges:
+                    continue
+                j_edges = self.instance_edges[j]
+                self.instance_edges[j] = j_edges[:, j_edges[1] != i]
+        
+        # recompute the edges of the dirty instances that still exist, then
+        # mirror them onto their clean neighbors since connections are
+        # symmetric
+        live = numpy.array(
+            [i for i in dirty if i in self.instance_blocks], dtype=numpy.int64)
+        new_edges = self.compute_connections(live)
+        for i in live.tolist():
+            self.instance_edges[i] = new_edges[:, new_edges[0] == i]
+        
+        reverse_edges = new_edges[:, ~numpy.isin(new_edges[1], live)]
+        reverse_edges = reverse_edges[[1,0,3,2]]
+        for j in numpy.unique(reverse_edges[0]).tolist():
+            self.instance_edges[j] = numpy.concatenate((
+                self.instance_edges[j],
+                reverse_edges[:, reverse_edges[0] == j],
+            ), axis=1)
+        
+        self.dirty_instances = set()
+    
+    def find_connections(self, instances=None, unidirectional=False):
+        '''
+        Returns a (4,E) array of (instance_a, instance_b, snap_a, snap_b)
+        connections, where instance_a is restricted to the given instances
+        if they are specified.
+        '''
+        self.refresh_edges()
+        if instances is None:
+            instance_ids = sorted(self.instance_edges.keys())
+        else:
+            instance_ids = [int(instance) for instance in instances]
+        
+        edges = numpy.concatenate(
+            [numpy.zeros((4,0), dtype=numpy.int64)] +
+            [self.instance_edges[i] for i in instance_ids
+                if i in self.instance_edges],
+            axis=1,
+        )
+        if unidirectional:
+            edges = edges[:, edges[0] <= edges[1]]
+        
+        return edges
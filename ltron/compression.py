@@ -1,5 +1,9 @@
 import numpy
 
+# maximum number of pixel values compared at once when looking for tiles that
+# change between frames
+DEDUPLICATE_CHUNK_SIZE = 2**24
+
 def tile_frame(frame, tile_height, tile_width):
     h, w, *c = frame.shape
     assert h % tile_height == 0
@@ -155,6 +159,49 @@ def batch_deduplicate_from_masks(
     )
     
 
+def tiled_change_mask(
+    seqs,
+    pad,
+    tile_height,
+    tile_width,
+    background=0,
+    chunk_size=DEDUPLICATE_CHUNK_SIZE,
+):
+    '''
+    Returns an (s, b, hh, ww) boolean array that is True for every tile in
+    seqs that differs from the same tile in the previous frame (or from
+    background for the first frame) and is inside the padded length of its
+    sequence.  The frames are compared through a tiled view of seqs a few
+    at a time so the full per-pixel comparison is never allocated.
+    '''
+    s, b, h, w, c = seqs.shape
+    hh = h // tile_height
+    ww = w // tile_width
+    tiles = seqs.reshape(s, b, hh, tile_height, ww, tile_width, c)
+    
+    background = numpy.asarray(background)
+    if background.ndim:
+        background = background.reshape(
+            1, b, hh, tile_height, ww, tile_width, c)
+    
+    mask = numpy.zeros((s, b, hh, ww), dtype=bool)
+    if s == 0:
+        return mask
+    numpy.any(tiles[:1] != background, axis=(3,5,6), out=mask[:1])
+    
+    frames_per_chunk = max(chunk_size // (b*h*w*c), 1)
+    for start in range(1, s, frames_per_chunk):
+        end = min(start + frames_per_chunk, s)
+        numpy.any(
+            tiles[start:end] != tiles[start-1:end-1],
+            axis=(3,5,6),
+            out=mask[start:end],
+        )
+    
+    mask &= numpy.arange(s).reshape(s, 1, 1, 1) < pad.reshape(1, b, 1, 1)
+    
+    return mask
+
 def batch_deduplicate_tiled_seqs(
     seqs,
     pad,
@@ -162,71 +209,66 @@ def batch_deduplicate_tiled_seqs(
     tile_height,
     background=0,
     s_start=None,
+    chunk_size=DEDUPLICATE_CHUNK_SIZE,
+    out=None,
 ):
+    '''
+    Compresses a batch of (s, b, h, w, c) frame sequences into only the tiles
+    that change from one frame to the next.  Returns an (n, b, tile_height,
+    tile_width, c) array of tiles, an (n, b, 3) array of their (s, hh, ww)
+    coordinates and the number of tiles in each batch entry.
+    
+    If out is provided, it should be a (tiles, coords) tuple of arrays with
+    the shapes above and enough rows to hold every batch entry.  The result
+    is then written into the first n rows of those arrays and views of them
+    are returned, so that the same memory can be reused every batch.
+    '''
     s, b, h, w, c = seqs.shape
     assert h % tile_height == 0
     assert w % tile_width == 0
     hh = h // tile_height
     ww = w // tile_width
     
-    # reshape to b x s x hh x ww x (tile_height*tile_width*c)
-    # batch must come first because this makes it possible to map
-    # the extracted tiles onto the compressed batch tensor later
-    seq_tiles = seqs.reshape(s, b, hh, tile_height, ww, tile_width, c)
-    seq_tiles = seq_tiles.transpose(1, 0, 2, 4, 3, 5, 6)
-    seq_tiles = seq_tiles.reshape(b, s, hh, ww, -1)
-    
-    # make the background
-    try:
-        background = background.reshape(
-            b, 1, hh, tile_height, ww, tile_width, c)
-        background = background.transpose(0, 1, 2, 4, 3, 5, 6)
-        background = background.reshape(b, 1, hh, ww, -1)
-    except AttributeError:
-        background = background * numpy.ones(
-            (b, 1, hh, ww, tile_height*tile_width*c), dtype=seq_tiles.dtype)
-    
-    # compute tiles that change
-    prev_tiles = numpy.concatenate((background, seq_tiles[:,:-1]), axis=1)
-    nonstatic_tiles = numpy.any(seq_tiles != prev_tiles, axis=-1)
+    nonstatic_tiles = tiled_change_mask(
+        seqs, pad, tile_height, tile_width, background, chunk_size)
     
     # get indices of changing tiles
-    b_coord, s_coord, h_coord, w_coord = numpy.where(nonstatic_tiles)
-    max_lengths = pad[b_coord]
-    nonpadded_indices = s_coord < max_lengths
-    b_coord = b_coord[nonpadded_indices]
-    s_coord = s_coord[nonpadded_indices]
-    h_coord = h_coord[nonpadded_indices]
-    w_coord = w_coord[nonpadded_indices]
+    # the batch dimension must come first so that the tiles come out grouped
+    # by batch entry, which lets them be numbered below without a loop
+    b_coord, s_coord, h_coord, w_coord = numpy.nonzero(
+        nonstatic_tiles.transpose(1, 0, 2, 3))
     
-    # extract the changing tiles
-    compressed_len = len(b_coord)
-    compressed_tiles = seq_tiles[b_coord, s_coord, h_coord, w_coord]
-    compressed_tiles = compressed_tiles.reshape(
-        compressed_len, tile_height, tile_width, c)
-    
-    # compute the coordinates for the tiles on the new padded grid
-    # this time the padding is not based on the original frame sequences,
-    # but on the lengths of the newly computed tile sequences
-    # the reason why the batch dimension must come first above, is so that
-    # b_coord will align properly with t_coord below
+    # number the tiles of each batch entry to get their row in the output
     batch_pad = numpy.bincount(b_coord, minlength=b)
-    max_len = numpy.max(batch_pad)
-    t_coord = numpy.concatenate([numpy.arange(cc) for cc in batch_pad])
+    max_len = numpy.max(batch_pad) if b else 0
+    batch_start = numpy.cumsum(batch_pad) - batch_pad
+    t_coord = numpy.arange(len(b_coord)) - batch_start[b_coord]
     
-    # place the tiles in the padded grid and swap the batch and time axes
-    batch_padded_tiles = numpy.zeros(
-        (b, max_len, tile_height, tile_width, c), dtype=compressed_tiles.dtype)
-    batch_padded_tiles[b_coord, t_coord] = compressed_tiles
-    batch_padded_tiles = batch_padded_tiles.transpose(1,0,2,3,4)
+    # allocate or reuse the outputs, which are already (time, batch) ordered
+    if out is None:
+        batch_padded_tiles = numpy.zeros(
+            (max_len, b, tile_height, tile_width, c), dtype=seqs.dtype)
+        batch_padded_coords = numpy.zeros(
+            (max_len, b, 3), dtype=numpy.int64)
+    else:
+        out_tiles, out_coords = out
+        assert out_tiles.shape[0] >= max_len, 'Tile buffer too small'
+        assert out_coords.shape[0] >= max_len, 'Coordinate buffer too small'
+        batch_padded_tiles = out_tiles[:max_len]
+        batch_padded_coords = out_coords[:max_len]
+        batch_padded_tiles.fill(0)
+        batch_padded_coords.fill(0)
     
-    # place the coordinates in a padded grid and swap the batch and time axes
-    batch_padded_coords = numpy.zeros((b, max_len, 3), dtype=s_coord.dtype)
-    shw_coord = numpy.stack((s_coord, h_coord, w_coord), axis=-1)
-    batch_padded_coords[b_coord, t_coord] = shw_coord
+    # copy the changing tiles straight out of a tiled view of the frames
+    seq_tiles = seqs.reshape(s, b, hh, tile_height, ww, tile_width, c)
+    batch_padded_tiles[t_coord, b_coord] = seq_tiles[
+        s_coord, b_coord, h_coord, :, w_coord]
+    
+    batch_padded_coords[t_coord, b_coord, 0] = s_coord
+    batch_padded_coords[t_coord, b_coord, 1] = h_coord
+    batch_padded_coords[t_coord, b_coord, 2] = w_coord
     if s_start is not None:
-        batch_padded_coords[:,:,0] += s_start.reshape(b, 1)
-    batch_padded_coords = batch_padded_coords.transpose(1,0,2)
+        batch_padded_coords[:,:,0] += s_start.reshape(1, b)
     
     return (
         batch_padded_tiles,
@@ -4,81 +4,155 @@ import json
 from ltron.ldraw.documents import LDrawMPDMainFile
 from ltron.bricks.brick_scene import BrickScene
 from pathlib import Path
-import queue
 import tqdm
 
-def BFS(instance, connections, visited):
-    cum_list = [instance]
-    visited[instance-1] = True
-    que = queue.Queue()
-    que.put(instance)
-    while not que.empty():
-        connection = connections[int(que.get())]
-        for conn in connection:
-            target = int(conn[1].brick_instance)
-            if not visited[target-1]:
-                que.put(target)
-                visited[target-1] = True
-                cum_list.append(target)
-    return cum_list
+import numpy
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
-def partition(scene):
+def component_labels(instance_ids, edges):
+    '''
+    Label the connected components of the graph whose nodes are
+    instance_ids and whose edges are the first two rows of edges (for
+    example a (4,E) assembly edge array).  Instance ids do not need to be
+    contiguous, and edges that touch ids not in instance_ids (such as the
+    zero padding in an assembly) are ignored.  Returns an array of labels
+    aligned with instance_ids.  Labels start at 1 and are numbered in order
+    of the smallest instance id in each component.
+    '''
+    instance_ids = numpy.asarray(instance_ids, dtype=numpy.int64)
+    num_instances = instance_ids.shape[0]
+    if not num_instances:
+        return numpy.zeros(0, dtype=numpy.int64)
+    
+    order = numpy.argsort(instance_ids)
+    sorted_ids = instance_ids[order]
+    
+    # map the edge endpoints to node indices, dropping unknown ids
+    edges = numpy.asarray(edges, dtype=numpy.int64)[:2]
+    a = numpy.searchsorted(sorted_ids, edges[0])
+    b = numpy.searchsorted(sorted_ids, edges[1])
+    a = numpy.minimum(a, num_instances-1)
+    b = numpy.minimum(b, num_instances-1)
+    valid = (sorted_ids[a] == edges[0]) & (sorted_ids[b] == edges[1])
+    a = a[valid]
+    b = b[valid]
+    
+    graph = coo_matrix(
+        (numpy.ones(a.shape[0], dtype=numpy.int8), (a, b)),
+        shape=(num_instances, num_instances),
+    )
+    _, sorted_labels = connected_components(graph, directed=False)
+    
+    # renumber so that components are ordered by their smallest id
+    _, first_index, sorted_labels = numpy.unique(
+        sorted_labels, return_index=True, return_inverse=True)
+    rank = numpy.empty_like(first_index)
+    rank[numpy.argsort(first_index)] = numpy.arange(first_index.shape[0])
+    
+    labels = numpy.empty(num_instances, dtype=numpy.int64)
+    labels[order] = rank[sorted_labels] + 1
+    
+    return labels
+
+def assembly_component_labels(assembly):
+    '''
+    Returns an array with one label per instance slot of an assembly (see
+    BrickScene.get_assembly).  Empty slots are labelled 0.
+    '''
+    instance_ids = numpy.nonzero(assembly['shape'])[0]
+    labels = numpy.zeros(len(assembly['shape']), dtype=numpy.int64)
+    labels[instance_ids] = component_labels(instance_ids, assembly['edges'])
+    
+    return labels
+
+def scene_component_labels(scene):
+    '''
+    Returns the instance ids of a scene with snap tracking and their
+    component labels.
+    '''
+    instance_ids = scene.instances.get_instance_ids()
+    edges = scene.get_assembly_edges(unidirectional=True)
+    return instance_ids, component_labels(instance_ids, edges)
+
+def labels_to_components(instance_ids, labels):
+    '''
+    Converts labels into a dictionary mapping each label to a list of
+    instance ids.
+    '''
     components = {}
-    connections = scene.get_all_snap_connections()
-    instance_num = len(scene.instances.instances)
-    visited = [False] * instance_num
+    for instance_id, label in zip(
+        numpy.asarray(instance_ids).tolist(), numpy.asarray(labels).tolist()
+    ):
+        if label:
+            components.setdefault(label, []).append(instance_id)
+    
+    return {label:components[label] for label in sorted(components)}
 
-    comp_num = 1
-    for i in range(instance_num):
-        if visited[i]:
-            continue
-        else:
-            cur_list = BFS(i+1, connections, visited)
-            components[comp_num] = cur_list
-            comp_num += 1
+def partition(scene):
+    return labels_to_components(*scene_component_labels(scene))
 
-    return components
+def partition_assembly(assembly):
+    labels = assembly_component_labels(assembly)
+    return labels_to_components(numpy.arange(labels.shape[0]), labels)
 
 # remove all components that contains less than or equal to the threshold
+def partition_model(model, dest_directory, remove_threshold=0, scene=None):
+    '''
+    Write each connected component of the model at path model with more
+    than remove_threshold bricks to its own file in dest_directory.  Returns
+    the list of files written.
+    '''
+    if scene is None:
+        scene = BrickScene(track_snaps=True)
+    scene.clear_instances()
+    scene.import_ldraw(model)
+    
+    components = partition(scene)
+    #modelname = model.split("/")[-1][:-4]
+    modelname, ext = os.path.splitext(os.path.split(model)[-1])
+    idx = 1
+    out_paths = []
+    for _, comp in components.items():
+        if len(comp) <= remove_threshold:
+            continue
+        out_path = os.path.join(
+            dest_directory, '%s__%i%s'%(modelname, idx, ext))
+        scene.export_ldraw(out_path, instances=comp)
+        out_paths.append(out_path)
+        #scene.export_ldraw(
+        #    folder_name + modelname + "@" + str(idx) +
+        #"." + model.split(".")[-1], instances=comp)
+        idx += 1
+    
+    return out_paths
+
 def partition_omr(src_directory, dest_directory=None, remove_threshold=0):
     src_directory = Path(src_directory).expanduser()
     model_list = list(src_directory.rglob('*'))
     #model_list = [os.path.join(src_directory, '7657-1 - AT-ST.mpd')]
     #model_list = [os.path.join(src_directory, '6832-1 - Super Nova II.mpd')]
     #model_list = [os.path.join(src_directory, '7140-1 - X-wing Fighter.mpd')]
-
+    
+    if dest_directory is None:
+        dest_directory = "conn_comps/"
+    
     # Iterate through mpd files
-    cnt = 0
     scene = BrickScene(track_snaps=True)
     for model in tqdm.tqdm(model_list):
         model = str(model)
         print(model)
-        scene.clear_instances()
         try:
-            scene.import_ldraw(model)
+            partition_model(
+                model,
+                dest_directory,
+                remove_threshold=remove_threshold,
+                scene=scene,
+            )
         except:
             print("Can't open: " + model + " during connected components partition")
             continue
 
-        components = partition(scene)
-        if dest_directory is None:
-            folder_name = "conn_comps/"
-        else:
-            folder_name = dest_directory
-        #modelname = model.split("/")[-1][:-4]
-        modelname, ext = os.path.splitext(os.path.split(model)[-1])
-        idx = 1
-        for _, comp in components.items():
-            if len(comp) <= remove_threshold:
-                continue
-            out_path = os.path.join(
-                folder_name, '%s__%i%s'%(modelname, idx, ext))
-            scene.export_ldraw(out_path, instances=comp)
-            #scene.export_ldraw(
-            #    folder_name + modelname + "@" + str(idx) +
-            #"." + model.split(".")[-1], instances=comp)
-            idx += 1
-
 def main():
     direc = "~/.cache/ltron/collections/omr/ldraw"
     partition_omr(direc)
@@ -47,6 +47,38 @@ def add_large_bricks_to_blacklist(threshold):
     with open(blacklist_path, 'w') as f:
         json.dump(blacklist_data, f, indent=2)
 
+def load_blacklisted_bricks(threshold):
+    blacklist_path = get_blacklist_path()
+    blacklist_data = json.load(open(blacklist_path))
+    if 'large_%i'%threshold not in blacklist_data:
+        add_large_bricks_to_blacklist(threshold)
+    blacklist_data = json.load(open(blacklist_path))
+    return set(blacklist_data['all'] + blacklist_data['large_%i'%threshold])
+
+def remove_blacklisted_parts_from_path(
+    model_src_path,
+    dest_directory,
+    blacklisted_bricks,
+    scene=None,
+):
+    '''
+    Write a copy of the model at model_src_path without any blacklisted
+    bricks to dest_directory.  Returns the list of files written.
+    '''
+    if scene is None:
+        scene = BrickScene(track_snaps=False)
+    model_name = os.path.split(model_src_path)[-1]
+    model_dest_path = os.path.join(dest_directory, model_name)
+    scene.clear_instances()
+    scene.import_ldraw(model_src_path)
+    keep = [
+        instance for i, instance in scene.instances.items()
+        if str(instance.brick_shape) not in blacklisted_bricks
+    ]
+    scene.export_ldraw(model_dest_path, instances=keep)
+    
+    return [model_dest_path]
+
 def remove_blacklisted_parts(
     source_directory,
     dest_directory,
@@ -70,13 +102,7 @@ def remove_blacklisted_parts(
     #with open(blacklist_path, 'w') as f:
     #    json.dump(blacklist, f)
     
-    blacklist_path = get_blacklist_path()
-    blacklist_data = json.load(open(blacklist_path))
-    if 'large_%i'%threshold not in blacklist_data:
-        add_large_bricks_to_blacklist(threshold)
-    blacklist_data = json.load(open(blacklist_path))
-    blacklisted_bricks = set(
-        blacklist_data['all'] + blacklist_data['large_%i'%threshold])
+    blacklisted_bricks = load_blacklisted_bricks(threshold)
     
     source_directory = Path(source_directory).expanduser()
     model_list = list(source_directory.rglob('*'))
@@ -90,25 +116,9 @@ def remove_blacklisted_parts(
         if os.path.exists(model_dest_path) and not overwrite:
             continue
         
-        scene.clear_instances()
         try:
-            scene.import_ldraw(model_src_path)
+            remove_blacklisted_parts_from_path(
+                model_src_path, dest_directory, blacklisted_bricks, scene=scene)
         except:
             print("Can't open: " + model_src_path + " during blacklisting")
             continue
-
-        #keep = [i+1 for i in range(len(scene.instances)) if scene.instances.instances[i+1].brick_shape.reference_name not in blacklist]
-        keep = [
-            instance for i, instance in scene.instances.items()
-            if str(instance.brick_shape) not in blacklisted_bricks
-        ]
-        # for i in range(len(scene.instances)):
-        #     try:
-        #         if scene.instances.instances[i+1].brick_shape.reference_name in blacklist:
-        #             scene.remove_instance(i+1)
-        #     except:
-        #         print(scene.instances.instances)
-        #         print(i)
-        #         print(scene.instances.instances[i+1].brick_shape)
-        scene.export_ldraw(
-            model_dest_path, instances=keep)
@@ -60,13 +60,32 @@ def remap_variants(original_scene, variant_tables):
     
     return remapped_scene
 
+def load_variant_tables():
+    variant_table_path = os.path.join(get_ltron_home(), 'variant_tables.json')
+    with open(variant_table_path) as f:
+        return json.load(f)
+
+def remap_variant_path(path, dest_directory, variant_tables, scene=None):
+    '''
+    Remap the variant bricks in the model at path and write the result to
+    dest_directory.  Returns the list of files written.
+    '''
+    if scene is None:
+        scene = BrickScene()
+    file_name = os.path.split(path)[-1]
+    write_path = os.path.join(dest_directory, file_name)
+    scene.clear_instances()
+    scene.import_ldraw(path)
+    remapped_scene = remap_variants(scene, variant_tables)
+    remapped_scene.export_ldraw(write_path)
+    
+    return [write_path]
+
 def remap_variant_paths(
     paths, dest_directory, variant_tables=None, overwrite=False):
     
     if variant_tables is None:
-        variant_table_path = os.path.join(
-            get_ltron_home(), 'variant_tables.json')
-        variant_tables = json.load(open(variant_table_path))
+        variant_tables = load_variant_tables()
     
     if os.path.isdir(paths):
         #paths = [os.path.join(paths, p) for p in os.listdir(paths)]
@@ -81,14 +100,12 @@ def remap_variant_paths(
         write_path = os.path.join(dest_directory, file_name)
         if not overwrite and os.path.exists(write_path):
             continue
-        original_scene.clear_instances()
         try:
-            original_scene.import_ldraw(path)
+            remap_variant_path(
+                path, dest_directory, variant_tables, scene=original_scene)
         except:
             print("Can't open: " + path + " during variant remapping")
             continue
-        remapped_scene = remap_variants(original_scene, variant_tables)
-        remapped_scene.export_ldraw(write_path)
 
 if __name__ == '__main__':
     #make_brick_variant_tables()
@@ -0,0 +1,207 @@
+import os
+import json
+import glob
+import hashlib
+import multiprocessing
+
+import tqdm
+
+from ltron.bricks.brick_scene import BrickScene
+
+# A small stage runner for the OMR cleaning pipeline.
+#
+# Each Stage reads every model in its source directory and writes its
+# results to its destination directory, one model per work item.  The work
+# items of a stage are spread over a process pool.  Each worker process
+# keeps a single BrickScene, so brick shapes are only loaded once per
+# process.
+#
+# When a model has been processed, a marker file is written to
+# <dest_directory>/.markers/<stage name>/.  It records the content hash of
+# the input, a hash of the stage parameters and the files that were
+# written.  On the next run, models whose input and parameters have not
+# changed and whose outputs still exist are skipped.  An interrupted run
+# therefore resumes where it stopped.  Models that fail to load are also
+# marked, so they are not retried until their contents change.
+
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda : f.read(2**20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_parameters(parameters):
+    def default(value):
+        if isinstance(value, (set, frozenset)):
+            return sorted(value)
+        return repr(value)
+    text = json.dumps(parameters, sort_keys=True, default=default)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class Stage:
+    '''
+    One step of the pipeline.  function is called as
+    function(source_path, dest_directory, scene=scene, **parameters) for
+    each model in source_directory and must return the list of files it
+    wrote.  It must be defined at module level so it can be sent to the
+    worker processes.
+    '''
+    def __init__(
+        self,
+        name,
+        function,
+        source_directory,
+        dest_directory,
+        patterns=('*.ldr', '*.mpd'),
+        track_snaps=False,
+        **parameters,
+    ):
+        self.name = name
+        self.function = function
+        self.source_directory = os.path.expanduser(source_directory)
+        self.dest_directory = os.path.expanduser(dest_directory)
+        self.patterns = patterns
+        self.track_snaps = track_snaps
+        self.parameters = parameters
+        self.parameter_hash = hash_parameters(
+            {'name':name, 'parameters':parameters})
+    
+    def source_paths(self):
+        paths = []
+        for pattern in self.patterns:
+            paths.extend(glob.glob(
+                os.path.join(self.source_directory, pattern)))
+        return sorted(paths)
+    
+    def marker_directory(self):
+        return os.path.join(self.dest_directory, '.markers', self.name)
+    
+    def marker_path(self, source_path):
+        file_name = os.path.split(source_path)[-1]
+        return os.path.join(self.marker_directory(), file_name + '.json')
+    
+    def load_marker(self, source_path):
+        marker_path = self.marker_path(source_path)
+        if not os.path.exists(marker_path):
+            return None
+        try:
+            with open(marker_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def write_marker(self, source_path, marker):
+        marker_path = self.marker_path(source_path)
+        tmp_path = marker_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(marker, f)
+        os.replace(tmp_path, marker_path)
+    
+    def is_complete(self, source_path, input_hash):
+        marker = self.load_marker(source_path)
+        if marker is None:
+            return False
+        if marker['input_hash'] != input_hash:
+            return False
+        if marker['parameter_hash'] != self.parameter_hash:
+            return False
+        return all(os.path.exists(path) for path in marker['outputs'])
+    
+    def remove_stale_outputs(self, source_path):
+        marker = self.load_marker(source_path)
+        if marker is None:
+            return
+        for path in marker['outputs']:
+            if os.path.exists(path):
+                os.unlink(path)
+
+# worker processes =============================================================
+
+worker_stage = None
+worker_scene = None
+
+def initialize_worker(stage):
+    global worker_stage, worker_scene
+    worker_stage = stage
+    worker_scene = BrickScene(track_snaps=stage.track_snaps)
+
+def run_work_item(item):
+    source_path, input_hash = item
+    try:
+        outputs = worker_stage.function(
+            source_path,
+            worker_stage.dest_directory,
+            scene=worker_scene,
+            **worker_stage.parameters,
+        )
+        error = None
+    except Exception as e:
+        outputs = []
+        error = '%s: %s'%(type(e).__name__, e)
+    
+    return source_path, input_hash, outputs, error
+
+# running ======================================================================
+
+def run_stage(stage, processes=None, overwrite=False):
+    '''
+    Run stage over every model in its source directory that is not already
+    complete.  Returns the number of models that were processed.
+    '''
+    if not os.path.exists(stage.marker_directory()):
+        os.makedirs(stage.marker_directory())
+    
+    source_paths = stage.source_paths()
+    work_items = []
+    for source_path in source_paths:
+        input_hash = hash_file(source_path)
+        if not overwrite and stage.is_complete(source_path, input_hash):
+            continue
+        stage.remove_stale_outputs(source_path)
+        work_items.append((source_path, input_hash))
+    
+    print('%s: %i of %i models to process'%(
+        stage.name, len(work_items), len(source_paths)))
+    if not work_items:
+        return 0
+    
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(min(processes, len(work_items)), 1)
+    
+    with multiprocessing.Pool(
+        processes, initializer=initialize_worker, initargs=(stage,)
+    ) as pool:
+        results = pool.imap_unordered(run_work_item, work_items, chunksize=1)
+        for source_path, input_hash, outputs, error in tqdm.tqdm(
+            results, total=len(work_items)
+        ):
+            if error is not None:
+                print("Can't process: %s during %s (%s)"%(
+                    source_path, stage.name, error))
+            stage.write_marker(source_path, {
+                'input_hash' : input_hash,
+                'parameter_hash' : stage.parameter_hash,
+                'outputs' : outputs,
+                'error' : error,
+            })
+    
+    return len(work_items)
+
+def run_stages(stages, processes=None, overwrite=False):
+    '''
+    Run each stage in order.  Stages should be listed after the stages that
+    write their source directories.  Returns the total number of models
+    processed, which is zero if everything was already up to date.
+    '''
+    num_processed = 0
+    for stage in stages:
+        print('='*80)
+        print(stage.name)
+        if not os.path.exists(stage.dest_directory):
+            os.makedirs(stage.dest_directory)
+        num_processed += run_stage(
+            stage, processes=processes, overwrite=overwrite)
+    
+    return num_processed
@@ -1,11 +1,14 @@
 from argparse import ArgumentParser
 
-from ltron.dataset.omr_clean.brick_variants import remap_variant_paths
-from ltron.dataset.datastructure.connected_components import partition_omr
+from ltron.dataset.omr_clean.brick_variants import (
+    load_variant_tables, remap_variant_path)
+from ltron.dataset.datastructure.connected_components import partition_model
 #from rollouts_clean import rollout
 from ltron.dataset.omr_clean.dataset_annotation import generate_json
-from ltron.dataset.omr_clean.blacklist import remove_blacklisted_parts
-from ltron.dataset.submodel_extraction import subcomponent_nonoverlap_extraction
+from ltron.dataset.omr_clean.blacklist import (
+    load_blacklisted_bricks, remove_blacklisted_parts_from_path)
+from ltron.dataset.submodel_extraction import extract_nonoverlap_subcomponents
+from ltron.dataset.omr_clean.pipeline import Stage, run_stages
 from ltron.home import get_ltron_home
 import ltron.settings as settings
 import sys
@@ -14,12 +17,20 @@ import json
 from glob import glob
 import shutil
 
+def slice_model(source_path, dest_directory, scene=None, **kwargs):
+    num_instances, model_paths = extract_nonoverlap_subcomponents(
+        source_path, folder_name=dest_directory, scene=scene, **kwargs)
+    return model_paths
+
 # Overall pipeline
 def clean_omr():
     
     # get arguments
     parser = ArgumentParser()
     parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--partition', action='store_true')
+    parser.add_argument('--slice', action='store_true')
     args = parser.parse_args()
     overwrite = args.overwrite
 
@@ -83,94 +94,65 @@ def clean_omr():
     #]
     #pre_blacklist = []
     
+    # Each stage runs over a process pool and skips models that are
+    # unchanged since the last run, see ltron.dataset.omr_clean.pipeline
+    stages = []
+    
     # Replace the brick variants with standard bricks
-    print('='*80)
-    print('Remapping Variants')
-    remap_variant_paths(raw_dir, remapped_dest, overwrite=overwrite)
+    stages.append(Stage(
+        'remap_variants',
+        remap_variant_path,
+        raw_dir,
+        remapped_dest,
+        variant_tables=load_variant_tables(),
+    ))
     
-    print('='*80)
-    print('Brick Blacklist')
-    remove_blacklisted_parts(
-        remapped_dest, whole_dest, threshold=400, overwrite=overwrite)
+    # remove all blacklisted bricks from the remapped files and save them in
+    # whole
+    stages.append(Stage(
+        'blacklist',
+        remove_blacklisted_parts_from_path,
+        remapped_dest,
+        whole_dest,
+        blacklisted_bricks=load_blacklisted_bricks(400),
+    ))
     
-    # AARON TURNING THIS OFF FOR A MOMENT
-    '''
     # Partition the omr files into connected components
-    print('='*80)
-    print('Partitioning Into Connected Components')
-    partition_omr(whole_dest, component_dest, remove_threshold=1)
-    '''
-    
-    folder2 = os.path.join(omr_clean, 'slice2')
-    folder4 = os.path.join(omr_clean, 'slice4')
-    folder8 = os.path.join(omr_clean, 'slice8')
-    folder32 = os.path.join(omr_clean, 'slice32')
-    # AARON TURNING THIS OFF FOR A MOMENT
-    '''
-    # Slice and dice
-    print('='*80)
-    print('Slicing')
-    print('-'*80)
-    print('Building 2 Brick Slices')
-    folder2 = os.path.join(omr_clean, 'slice2')
-    subcomponent_nonoverlap_extraction(
-        component_dest,
-        2, float('inf'), blacklist=[], min_size=200, max_size=400,
-        folder_name=folder2)
-    
-    print('-'*80)
-    print('Building 4 Brick Slices')
-    folder8 = os.path.join(omr_clean, 'slice4')
-    subcomponent_nonoverlap_extraction(
-        component_dest,
-        4, float('inf'), blacklist=[], min_size=200, max_size=400,
-        folder_name=folder8)
-    print('-'*80)
-    
-    print('-'*80)
-    print('Building 8 Brick Slices')
-    folder8 = os.path.join(omr_clean, 'slice8')
-    subcomponent_nonoverlap_extraction(
-        component_dest,
-        8, float('inf'), blacklist=[], min_size=200, max_size=400,
-        folder_name=folder8)
-    print('-'*80)
-    print('Building 32 Brick Slices')
+    # (off by default for now)
+    if args.partition:
+        stages.append(Stage(
+            'partition',
+            partition_model,
+            whole_dest,
+            component_dest,
+            track_snaps=True,
+            remove_threshold=1,
+        ))
     
-    folder32 = os.path.join(omr_clean, 'slice32')
-    subcomponent_nonoverlap_extraction(
-        component_dest,
-        32, float('inf'), blacklist=[], min_size=200, max_size=400,
-        folder_name=folder32)
-    print('-'*80)
-    print('Building 128 Brick Slices')
-    folder128 = os.path.join(omr_clean, 'slice128')
-    subcomponent_nonoverlap_extraction(
-        component_dest,
-        128, float('inf'), blacklist=[], min_size=200, max_size=400,
-        folder_name=folder128)
-    '''
+    # Slice and dice (off by default for now)
+    if args.slice:
+        for limit in 2, 4, 8, 32, 128:
+            stages.append(Stage(
+                'slice_%i'%limit,
+                slice_model,
+                component_dest,
+                os.path.join(omr_clean, 'slice%i'%limit),
+                track_snaps=True,
+                limit=limit,
+                blacklist=[],
+                min_size=200,
+                max_size=400,
+            ))
     
-    '''
-    for f in glob(os.path.join(folder2, '*')):
-        shutil.move(f, slice_dir2)
-    shutil.rmtree(folder2)
-    for f in glob(os.path.join(folder8, '*')):
-        shutil.move(f, slice_dir8)
-    shutil.rmtree(folder8)
-    for f in glob(os.path.join(folder32, '*')):
-        shutil.move(f, slice_dir32)
-    shutil.rmtree(folder32)
-    for f in glob(os.path.join(folder128, '*')):
-        shutil.move(f, slice_dir128)
-    shutil.rmtree(folder128)
-    '''
+    num_processed = run_stages(
+        stages, processes=args.processes, overwrite=overwrite)
     
     # Generate the annotation omr_clean.json
     print('='*80)
     print('Generating json')
     # PUTS JSON FILE IN CURRENT DIRECTORY RATHER THAN DESTINATION DIRECTORY
-    generate_json(ldraw_dest, "./", mode='clean')
+    if num_processed or overwrite or not os.path.exists('./omr_clean.json'):
+        generate_json(ldraw_dest, "./", mode='clean')
     #generate_json(slice_dir2, "./", mode='clean')
     #generate_json(slice_dir8, "./", mode='clean')
     #generate_json(slice_dir32, "./", mode='clean')
@@ -1,7 +1,6 @@
 import time
 import json
 import tqdm
-from ltron.ldraw.documents import LDrawMPDMainFile
 from ltron.bricks.brick_scene import BrickScene
 from pathlib import Path
 # from ltron.gym.components.scene import SceneComponent
@@ -15,7 +14,6 @@ from ltron.gym.components.viewpoint import (
         RandomizedAzimuthalViewpointComponent,
         FixedAzimuthalViewpointComponent)
 from ltron.bricks.brick_shape import BrickShape
-import copy
 import collections
 import math
 import os
@@ -69,18 +67,126 @@ def compute_boxsize_old(instances, scene):
     # else: return -1000
     return max(abs(max_y - min_y), abs(max_x - min_x), abs(max_z - min_z))
 
-# The complete parameter is somehow not working
 def compute_boxsize(instance, scene, complete=False):
     if complete:
-        all_vertices = numpy.concatenate([scene.instances[ins].bbox_vertices for ins in scene.instances])
+        instance_ids = None
     else:
-        all_vertices = numpy.concatenate([
-            scene.instances[i].bbox_vertices() for i in instance], axis=1)
-    bbox_min = numpy.min(all_vertices[:3], axis=1)
-    bbox_max = numpy.max(all_vertices[:3], axis=1)
+        instance_ids = numpy.array(
+            [int(i) for i in instance], dtype=numpy.int64)
+    all_vertices = scene.instances.get_bbox_vertices(instance_ids)
+    bbox_min = numpy.min(all_vertices[:,:3], axis=(0,2))
+    bbox_max = numpy.max(all_vertices[:,:3], axis=(0,2))
     offset = bbox_max - bbox_min
     return max(offset)
 
+class SubmodelExtractor:
+    '''
+    Grows subassemblies out of a scene one brick at a time, always adding
+    the connected brick that keeps the bounding box smallest.
+
+    The world-space bounding box of every instance and the adjacency of
+    the scene are computed once, from the bulk instance table queries and
+    the assembly edge array.  While a subassembly grows, its bounding box
+    is kept as a running min/max, so scoring the candidate bricks is a
+    single vectorized comparison instead of concatenating the bounding
+    boxes of the whole subassembly for every candidate.
+    '''
+    def __init__(self, scene):
+        self.instance_ids = scene.instances.get_instance_ids()
+        self.instance_index = {
+            instance_id:i
+            for i, instance_id in enumerate(self.instance_ids.tolist())
+        }
+        
+        bbox_vertices = scene.instances.get_bbox_vertices(self.instance_ids)
+        self.bbox_min = numpy.min(bbox_vertices[:,:3], axis=-1)
+        self.bbox_max = numpy.max(bbox_vertices[:,:3], axis=-1)
+        
+        self.shape_names = {
+            instance_id:scene.instances[instance_id].brick_shape.reference_name
+            for instance_id in self.instance_ids.tolist()
+        }
+        
+        # neighbors in the order their connections are listed
+        self.neighbors = {
+            instance_id:[] for instance_id in self.instance_ids.tolist()}
+        edges = scene.get_assembly_edges()
+        for a, b in zip(edges[0].tolist(), edges[1].tolist()):
+            if a == b or a not in self.neighbors or b not in self.neighbors:
+                continue
+            if b not in self.neighbors[a]:
+                self.neighbors[a].append(b)
+    
+    def instances_with_shapes(self, shape_names):
+        shape_names = set(shape_names)
+        return set(
+            instance_id for instance_id, shape_name in self.shape_names.items()
+            if shape_name in shape_names
+        )
+    
+    def grow(
+        self,
+        seed,
+        limit,
+        used=(),
+        blacklisted=(),
+        max_size=100000,
+    ):
+        '''
+        Grow a subassembly of exactly limit bricks starting from seed, never
+        adding bricks in used or blacklisted.  Returns the list of instance
+        ids in the order they were added, or None if the subassembly ends up
+        larger than max_size or runs out of connected bricks before it has
+        limit bricks.
+        '''
+        members = [seed]
+        member_set = {seed}
+        seed_index = self.instance_index[seed]
+        box_min = self.bbox_min[seed_index].copy()
+        box_max = self.bbox_max[seed_index].copy()
+        
+        # candidates in the order they were first reached
+        frontier = []
+        frontier_set = set()
+        def extend_frontier(instance_id):
+            for neighbor in self.neighbors[instance_id]:
+                if (neighbor in member_set or
+                    neighbor in frontier_set or
+                    neighbor in used or
+                    neighbor in blacklisted
+                ):
+                    continue
+                frontier.append(neighbor)
+                frontier_set.add(neighbor)
+        
+        extend_frontier(seed)
+        
+        while True:
+            if not frontier:
+                return None
+            
+            candidate_index = numpy.array(
+                [self.instance_index[c] for c in frontier])
+            candidate_min = numpy.minimum(
+                box_min, self.bbox_min[candidate_index])
+            candidate_max = numpy.maximum(
+                box_max, self.bbox_max[candidate_index])
+            sizes = numpy.max(candidate_max - candidate_min, axis=-1)
+            best = int(numpy.argmin(sizes))
+            
+            best_id = frontier.pop(best)
+            frontier_set.remove(best_id)
+            members.append(best_id)
+            member_set.add(best_id)
+            box_min = candidate_min[best]
+            box_max = candidate_max[best]
+            extend_frontier(best_id)
+            
+            if len(members) >= limit:
+                if numpy.max(box_max - box_min) >= max_size:
+                    return None
+                return members
+
 # moved to omr_clean/blacklist.py
 #def blacklist_computation(threshold):
 #    path = Path("~/.cache/ltron/ldraw/parts").expanduser()
@@ -101,129 +207,82 @@ def compute_boxsize(instance, scene, complete=False):
 #    blacklist.append("30520.dat")
 #    return blacklist
 
-def add_brick(limit, cur_mod, comp_list, instance_id, scene):
-    instance = scene.instances.instances[instance_id]
-    connections = scene.get_all_snap_connections([instance])[str(instance_id)]
-    if len(connections) == 0: return False
-    for conn in connections:
-        target = int(conn[0])
-        if conn[0].reference_name in cur_mod:
-            continue
-        cur_mod.append(target)
-        if len(cur_mod) >= limit:
-            comp_list.append(cur_mod)
-            return True
-        else:
-            add_brick(limit, cur_mod, comp_list, target, scene)
-            return True
-
-def add_brick_box(limit, cur_mod, comp_list, instance_id, scene, used_brick = [], blacklist=[], min_size=100000, max_size=100000, min_brick=3, debug=False, connections={}):
-    instance = scene.instances.instances[instance_id]
-    #connections = scene.get_all_snap_connections(cur_mod)
-    box_map = {}
+# The method in use
+def extract_nonoverlap_subcomponents(
+    mpd,
+    limit,
+    blacklist,
+    min_size=100000,
+    max_size=100000,
+    folder_name='.',
+    max_components=float('inf'),
+    scene=None,
+):
+    '''
+    Extract up to max_components non-overlapping subcomponents of limit
+    bricks from the model at path mpd and write them to folder_name.
+    Returns the number of instances in the model and the list of files
+    written.  Subcomponents always have exactly limit bricks, so only
+    max_size limits their size; min_size is accepted for existing callers
+    but has no effect.
+    '''
+    if scene is None:
+        scene = BrickScene(track_snaps=True)
+    scene.clear_instances()
+    scene.import_ldraw(mpd)
     
-    #for instance_name, connection in connections.items():
-    #    if int(instance_name) not in cur_mod:
-    #        continue
-    for instance_id in cur_mod:
-        connection = connections[instance_id]
-        for conn in connection:
-            temp = copy.deepcopy(cur_mod)
-            #target = int(conn[0])
-            target = int(conn[1].brick_instance)
-            if scene.instances[target].brick_shape.reference_name in blacklist:
-                continue
-            if target in cur_mod:
-                continue
-            if target in used_brick:
-                continue
-            if target in box_map.keys():
-                continue
-            temp.append(target)
-            box_map[target] = compute_boxsize(temp, scene)
-
-    if len(box_map) == 0:
-        size = compute_boxsize(cur_mod, scene)
-        if min_size <= size <= max_size and len(cur_mod) >= min_brick:
-            comp_list.append(cur_mod)
-            return True
-        #print('bail box')
-        return False
-    best_target = min(box_map, key=box_map.get)
-    cur_mod.append(best_target)
-    # used_brick.append(best_target)
-    if len(cur_mod) >= limit:
-        if compute_boxsize(cur_mod, scene) >= max_size:
-            #print('bail big')
-            return False
-        comp_list.append(cur_mod)
-        return True
-    else:
-        status = add_brick_box(limit, cur_mod, comp_list, best_target, scene, used_brick, connections=connections)
-        return status
-
-# limit - number of bricks in each subcomponent
-# num_comp - number of subcomponents want to generate(won't run over this number)
-def subcomponent_extraction(limit, num_comp):
-
-    global_count = 0
-    folder_name = "subcomponents" + str(limit) + "/"
-    try:
-        os.stat(folder_name)
-    except:
-        os.mkdir(folder_name)
-    path = Path("~/.cache/ltron/collections/omr/omrtest").expanduser()
-    mpdlist = path.rglob('*mpd') # 1432
-    ldrlist = path.rglob('*ldr') # 62
-    stat = {"error" : []}
-
-    for mpd in mpdlist:
-        print(mpd)
-        mpd = str(mpd)
-        try:
-            mpdfile = LDrawMPDMainFile(mpd)
-            scene = BrickScene(track_snaps=True)
-            scene.import_ldraw(mpd)
-        except:
-            stat['error'].append(mpd)
+    num_instances = len(scene.instances)
+    if num_instances < limit:
+        return num_instances, []
+    
+    extractor = SubmodelExtractor(scene)
+    blacklisted = extractor.instances_with_shapes(blacklist)
+    components = []
+    component_set = set()
+    used_brick = set()
+    for seed in extractor.instance_ids.tolist():
+        if len(components) == max_components:
+            break
+        if seed in blacklisted:
             continue
-
-        num_instances = len(scene.instances.instances)
-        if num_instances < limit:
+        subcomp = extractor.grow(
+            seed,
+            limit,
+            used=used_brick,
+            blacklisted=blacklisted,
+            max_size=max_size,
+        )
+        if subcomp is None:
             continue
         
-        components = []
-        for i in range(num_instances):
-            cur_list = []
-            add_brick(limit, [], cur_list, i+1, scene)
-            for subcomp in cur_list:
-                if global_count == num_comp:
-                    break
-                subcomp.sort()
-                if subcomp not in components:
-                    components.append(subcomp)
-                    global_count += 1
-            if global_count == num_comp:
+        subcomp.sort()
+        if tuple(subcomp) in component_set:
+            continue
+        # bricks ahead of the first used brick are marked as used even if
+        # the subcomponent is rejected
+        decider = True
+        for ins in subcomp:
+            if ins in used_brick:
+                decider = False
                 break
+            used_brick.add(ins)
+        if decider:
+            components.append(subcomp)
+            component_set.add(tuple(subcomp))
+    
+    count = 1
+    modelname = mpd.split("/")[-1][:-4]
+    model_paths = []
+    for comp in components:
+        _, ext = os.path.splitext(mpd)
+        model_file_name = '%s_%i_%i%s'%(modelname, limit, count, ext)
+        model_path = os.path.join(folder_name, model_file_name)
+        scene.export_ldraw(model_path, instances=comp)
+        model_paths.append(model_path)
+        count += 1
+    
+    return num_instances, model_paths
 
-        count = 1
-        modelname = mpd.split("/")[-1][:-4]
-        for comp in components:
-            temp_scene = BrickScene()
-            temp_scene.import_ldraw(mpd)
-            instances = copy.deepcopy(temp_scene.instances.instances)
-            for k, v in instances.items():
-                if k not in comp:
-                    temp_scene.remove_instance(v)
-
-            temp_scene.export_ldraw(folder_name + modelname + "_"
-                                                            + str(count) + ".mpd")
-            count += 1
-
-        if global_count == num_comp:
-            break
-
-# The method in use
 def subcomponent_nonoverlap_extraction(src, limit, num_comp, blacklist, min_size=100000, max_size=100000, folder_name = None):
     global_count = 0
     if folder_name is None:
@@ -237,7 +296,6 @@ def subcomponent_nonoverlap_extraction(src, limit, num_comp, blacklist, min_size
     stat = {"error" : [], "blacklist" : blacklist, "total_count" : 0, "models" : {}}
 
     # Iterate through mpd files
-    cnt = 0
     iterate = tqdm.tqdm(mpdlist)
     for mpd in iterate:
         description = os.path.basename(str(mpd))
@@ -246,212 +304,35 @@ def subcomponent_nonoverlap_extraction(src, limit, num_comp, blacklist, min_size
         elif len(description) < 30:
             description = description + ' ' * (30 - len(description))
         iterate.set_description(description)
-        # t_start = time.time()
-        # t_add_total = 0.
-        # t_for_total = 0.
-        # num_adds = 0
-        # cnt += 1
-        # if cnt == 5: break
-        # print(mpd)
         mpd = str(mpd)
-        # if mpd != "/home/nanami/.cache/ltron/collections/omr/ldraw/30190 - Ferrari 150deg Italia.mpd":
-        #     continue
         try:
-            mpdfile = LDrawMPDMainFile(mpd)
-            scene = BrickScene(track_snaps=True)
-            scene.import_ldraw(mpd)
+            num_instances, model_paths = extract_nonoverlap_subcomponents(
+                mpd,
+                limit,
+                blacklist,
+                min_size=min_size,
+                max_size=max_size,
+                folder_name=folder_name,
+                max_components=num_comp - global_count,
+            )
         except:
             stat['error'].append(mpd)
             print("can't load file during extraction {}".format(mpd))
             continue
-
-        num_instances = len(scene.instances.instances)
+        
         if num_instances < limit:
             continue
-        # print(num_instances)
-        components = []
-        used_brick = []
-
-        not_terminate = True
-        sad_instance = []
-    
-        connections = scene.get_all_snap_connections()
-        while not_terminate:
-
-            not_terminate = False
-            for i in range(num_instances):
-                if i in sad_instance:
-                    continue
-                if scene.instances.instances[i+1].brick_shape.reference_name in blacklist:
-                    continue
-                #if i in used_brick:
-                #    print('used, skipping')
-                #    continue
-                cur_list = []
-                debug = False
-                
-                # t_add_start = time.time()
-                status = add_brick_box(limit, [i+1], cur_list, i+1, scene, used_brick,
-                                       min_size=min_size, max_size=max_size, blacklist=blacklist, debug=debug, connections=connections)
-                # t_add_end = time.time()
-                # num_adds += 1
-                # t_add_total += (t_add_end - t_add_start)
-                #print('add elapsed: %f'%(t_add_end-t_add_start))
-                # if not status:
-                #     sad_instance.append(i)
-                # not_terminate = not_terminate or status
-                
-                # t_for_start = time.time()
-                for subcomp in cur_list:
-                    if global_count == num_comp:
-                        break
-                    subcomp.sort()
-                    if subcomp not in components:
-                        decider = True
-                        for ins in subcomp:
-                            if ins in used_brick:
-                                decider = False
-                                break
-                            used_brick.append(ins)
-                        if decider:
-                            components.append(subcomp)
-                            global_count += 1
-
-                if global_count == num_comp:
-                    not_terminate = False
-                    break
-        #         t_for_end = time.time()
-        #         t_for_total += t_for_end - t_for_start
-        #
-        # t_end_start = time.time()
-        count = 1
-        modelname = mpd.split("/")[-1][:-4]
-        for comp in components:
-            #temp_scene = BrickScene()
-            #temp_scene.import_ldraw(mpd)
-            #instances = copy.deepcopy(temp_scene.instances.instances)
-            #for k, v in instances.items():
-            #    if k not in comp:
-            #        temp_scene.remove_instance(v)
-
-            #temp_scene.export_ldraw(folder_name + modelname + "_"
-            #                                                + str(count) + ".mpd")
-            
-            _, ext = os.path.splitext(mpd)
-            model_file_name = '%s_%i_%i%s'%(modelname, limit, count, ext)
-            model_path = os.path.join(folder_name, model_file_name)
-            scene.export_ldraw(model_path, instances=comp)
-            #scene.export_ldraw(folder_name + modelname + "_" + str(limit) + "_" + str(count) + "." + mpd.split(".")[-1], instances=comp)
-            
-            count += 1
-        # t_end_end = time.time()
+        global_count += len(model_paths)
         
-        stat['models'][modelname] = [num_instances, count - 1]
-        # t_end = time.time()
-        # print('elapsed: %f'%(t_end-t_start))
-        # print('add total: %f'%(t_add_total))
-        # print('for total: %f'%(t_for_total))
-        # print('end total: %f'%(t_end_end - t_end_start))
-        # print('num adds: %i'%(num_adds))
-
-        if global_count == num_comp:
-            break
-
-    stat['total_count'] = global_count
-
-    with open(folder_name + "stat_blacklist70_min200_max300_b.json", "w") as f:
-        json.dump(stat, f)
-
-def subcomponent_minmax_extraction(src, limit, min_size, max_size, num_comp, blacklist):
-    global_count = 0
-    folder_name = "subcomponents" + str(limit) + "/"
-    try:
-        os.stat(folder_name)
-    except:
-        os.mkdir(folder_name)
-    path = Path(src).expanduser()
-    mpdlist = path.rglob('*')
-    stat = {"error" : [], "blacklist" : blacklist, "total_count" : 0, "models" : {}}
-
-    # Iterate through mpd files
-    for mpd in mpdlist:
-        print(mpd)
-        mpd = str(mpd)
-        try:
-            mpdfile = LDrawMPDMainFile(mpd)
-            scene = BrickScene(track_snaps=True)
-            scene.import_ldraw(mpd)
-        except:
-            stat['error'].append(mpd)
-            continue
-
-        num_instances = len(scene.instances.instances)
-        # print(num_instances)
-        components = []
-        used_brick = []
-
-        not_terminate = True
-        sad_instance = []
-        while not_terminate:
-            print("l")
-            not_terminate = False
-            for i in range(num_instances):
-                if i in sad_instance:
-                    continue
-                cur_list = []
-                debug = False
-                # if mpd == "/home/nanami/.cache/ltron/collections/omr/ldraw/42038-1 - Arctic Truck.mpd":
-                #     debug = True
-                status = add_brick_box(limit, [], cur_list, i+1, scene, used_brick, blacklist, debug=debug)
-                if not status:
-                    sad_instance.append(i)
-                not_terminate = not_terminate or status
-                # if mpd == "/home/nanami/.cache/ltron/collections/omr/ldraw/42038-1 - Arctic Truck.mpd":
-                #     print(i)
-                #     print(status)
-                for subcomp in cur_list:
-                    if global_count == num_comp:
-                        break
-                    subcomp.sort()
-                    if subcomp not in components:
-                        decider = True
-                        for ins in subcomp:
-                            if ins in used_brick:
-                                decider = False
-                                break
-                            used_brick.append(ins)
-                        if decider:
-                            components.append(subcomp)
-                            global_count += 1
-
-                if global_count == num_comp:
-                    not_terminate = False
-                    break
-
-        # print(global_count)
-
-        count = 1
         modelname = mpd.split("/")[-1][:-4]
-        for comp in components:
-            temp_scene = BrickScene()
-            temp_scene.import_ldraw(mpd)
-            instances = copy.deepcopy(temp_scene.instances.instances)
-            for k, v in instances.items():
-                if k not in comp:
-                    temp_scene.remove_instance(v)
-
-            temp_scene.export_ldraw(folder_name + modelname + "_"
-                                                            + str(count) + ".mpd")
-            count += 1
-
-        stat['models'][modelname] = [num_instances, count - 1]
+        stat['models'][modelname] = [num_instances, len(model_paths)]
 
         if global_count == num_comp:
             break
 
     stat['total_count'] = global_count
 
-    with open(folder_name + "stat_blacklist.json", "w") as f:
+    with open(folder_name + "stat_blacklist70_min200_max300_b.json", "w") as f:
         json.dump(stat, f)
 
 # Render a .mpd file
@@ -1,8 +1,121 @@
 import math
 import os
+import io
 import tarfile
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
-from ltron.rollout import rollout
+import numpy
+
+from ltron.rollout import rollout_sequences
+
+def compress_seq(seq):
+    buf = io.BytesIO()
+    numpy.savez_compressed(buf, seq=seq)
+    return buf.getvalue()
+
+class TarShardWriter:
+    '''
+    Writes sequences to a series of tar shards named
+    '<name>_<shard index>.tar'.  Each sequence is compressed on a thread pool
+    as soon as it is written.  The compressed files are appended to the
+    current shard in the order they were written.  A new shard is started
+    once the current one holds max_shard_episodes sequences or
+    max_shard_bytes bytes.  At most max_pending sequences are held in memory
+    while they wait to be compressed.
+    '''
+    def __init__(
+        self,
+        name,
+        path='.',
+        start_shard=0,
+        max_shard_episodes=None,
+        max_shard_bytes=None,
+        compression_threads=4,
+        max_pending=256,
+    ):
+        self.name = name
+        self.path = os.path.expanduser(path)
+        self.next_shard = start_shard
+        self.max_shard_episodes = max_shard_episodes
+        self.max_shard_bytes = max_shard_bytes
+        self.max_pending = max_pending
+        
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        
+        self.executor = ThreadPoolExecutor(max_workers=compression_threads)
+        self.pending = collections.deque()
+        self.shard_paths = []
+        self.shard_tar = None
+        self.shard_episodes = 0
+        self.shard_bytes = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def open_shard(self):
+        shard_name = '%s_%04i.tar'%(self.name, self.next_shard)
+        shard_path = os.path.join(self.path, shard_name)
+        print('Making Shard %s'%shard_path)
+        self.shard_tar = tarfile.open(shard_path, 'w')
+        self.shard_paths.append(shard_path)
+        self.next_shard += 1
+        self.shard_episodes = 0
+        self.shard_bytes = 0
+    
+    def close_shard(self):
+        if self.shard_tar is not None:
+            self.shard_tar.close()
+            self.shard_tar = None
+    
+    def shard_full(self):
+        if self.shard_tar is None:
+            return True
+        if (self.max_shard_episodes is not None and
+            self.shard_episodes >= self.max_shard_episodes
+        ):
+            return True
+        if (self.max_shard_bytes is not None and
+            self.shard_bytes >= self.max_shard_bytes
+        ):
+            return True
+        return False
+    
+    def add_compressed_seq(self, data):
+        if self.shard_full():
+            self.close_shard()
+            self.open_shard()
+        
+        file_name = 'seq_%08i.npz'%self.shard_episodes
+        info = tarfile.TarInfo(name=file_name)
+        info.size = len(data)
+        self.shard_tar.addfile(tarinfo=info, fileobj=io.BytesIO(data))
+        self.shard_episodes += 1
+        self.shard_bytes += len(data)
+    
+    def drain(self, wait=False):
+        '''
+        Append every compressed sequence at the front of the queue to the
+        current shard.  If wait is True, this blocks until the whole queue
+        has been written.
+        '''
+        while self.pending and (wait or self.pending[0].done()):
+            self.add_compressed_seq(self.pending.popleft().result())
+    
+    def write(self, seq):
+        self.pending.append(self.executor.submit(compress_seq, seq))
+        self.drain()
+        while len(self.pending) > self.max_pending:
+            self.add_compressed_seq(self.pending.popleft().result())
+    
+    def close(self):
+        self.drain(wait=True)
+        self.close_shard()
+        self.executor.shutdown()
 
 def generate_tar_dataset(
     name,
@@ -11,46 +124,32 @@ def generate_tar_dataset(
     start_shard=0,
     save_episode_frequency=256,
     path='.',
+    max_shard_bytes=None,
+    compression_threads=4,
     **kwargs,
 ):
+    '''
+    Roll out total_episodes episodes and stream them into tar shards as
+    they finish.  The episodes are divided evenly between shards, and a
+    shard is also closed early if max_shard_bytes is specified and reached.
+    save_episode_frequency bounds the number of finished episodes waiting
+    to be compressed.
+    '''
     
     episodes_per_shard = math.ceil(total_episodes/shards)
     
-    if not os.path.exists(path):
-        os.makedirs(path)
+    writer = TarShardWriter(
+        name,
+        path=path,
+        start_shard=start_shard,
+        max_shard_episodes=episodes_per_shard,
+        max_shard_bytes=max_shard_bytes,
+        compression_threads=compression_threads,
+        max_pending=save_episode_frequency,
+    )
+    with writer:
+        print('Rolling Out %i Episodes'%total_episodes)
+        for seq in rollout_sequences(total_episodes, **kwargs):
+            writer.write(seq)
     
-    new_shards = []
-    for shard in range(shards):
-        shard_name = '%s_%04i.tar'%(name, shard+start_shard)
-        shard_path = os.path.expanduser(os.path.join(path, shard_name))
-        new_shards.append(shard_path)
-        print('Making Shard %s'%shard_path)
-        shard_tar = tarfile.open(shard_path, 'w')
-        total_shard_episodes = math.ceil(total_episodes / shards)
-        shard_seqs = 0
-        while shard_seqs < total_shard_episodes:
-            pass_episodes = min(
-                total_shard_episodes-shard_seqs, save_episode_frequency)
-                #episodes_per_shard-shard_seqs, save_episode_frequency)
-            pass_name = name + ' (%i-%i/%i)'%(
-                shard_seqs, shard_seqs+pass_episodes, total_episodes)
-            print('Rolling Out %i Episodes'%pass_episodes)
-            episodes = rollout(
-                pass_episodes,
-                **kwargs,
-            )
-            print('Adding Sequences To Shard')
-            save_ids = None
-            if episodes.num_finished_seqs() > pass_episodes:
-                save_ids = list(episodes.finished_seqs)[:pass_episodes]
-            episodes.save(
-                shard_tar,
-                finished_only=True,
-                seq_ids=save_ids,
-                seq_offset=shard_seqs,
-                use_tqdm=True,
-            )
-            #shard_seqs += episodes.num_finished_seqs()
-            shard_seqs += pass_episodes
-    
-    return new_shards
+    return writer.shard_paths
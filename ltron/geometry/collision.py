@@ -4,12 +4,17 @@ import numpy
 
 from scipy.ndimage import binary_erosion
 
-from splendor.frame_buffer import FrameBufferWrapper
-from splendor.camera import orthographic_matrix
-from splendor.image import save_image, save_depth
-from splendor.masks import color_byte_to_index
+try:
+    from splendor.frame_buffer import FrameBufferWrapper
+    from splendor.camera import orthographic_matrix
+    from splendor.image import save_image, save_depth
+    from splendor.masks import color_byte_to_index
+    splendor_available = True
+except ImportError:
+    splendor_available = False
 
 from ltron.geometry.utils import unscale_transform, default_allclose
+from ltron.geometry.rasterize import rasterize_max_depth, DepthSpriteCache
 
 from ltron.exceptions import ThisShouldNeverHappen
 
@@ -30,11 +35,25 @@ class CollisionChecker:
         scene,
         #resolution=(128,128),
         max_intersection=1, #=4
+        backend='opengl',
+        sprite_cache_size=None,
     ):
+        assert backend in ('opengl', 'numpy')
+        if backend == 'opengl':
+            assert splendor_available
         self.scene = scene
         #self.frame_buffer = make_collision_frame_buffer(resolution)
         self.frame_buffers = {}
         self.max_intersection = max_intersection
+        self.backend = backend
+        
+        # depth sprites are composited on the cpu, so they are only used by
+        # the numpy backend
+        if sprite_cache_size is not None:
+            assert backend == 'numpy'
+            self.sprite_cache = DepthSpriteCache(max_size=sprite_cache_size)
+        else:
+            self.sprite_cache = None
     
     def check_collision(
         self,
@@ -50,6 +69,8 @@ class CollisionChecker:
             frame_buffers=self.frame_buffers,
             update_frame_buffers=True,
             max_intersection=self.max_intersection,
+            backend=self.backend,
+            sprite_cache=self.sprite_cache,
             **kwargs,
         )
     
@@ -66,6 +87,8 @@ class CollisionChecker:
             frame_buffers=self.frame_buffers,
             update_frame_buffers=True,
             max_intersection=self.max_intersection,
+            backend=self.backend,
+            sprite_cache=self.sprite_cache,
             **kwargs,
         )
 
@@ -75,9 +98,21 @@ def check_snap_collision(
     snap,
     *args,
     return_colliding_instances=False,
+    scene_offsets=None,
     **kwargs,
 ):
     
+    if scene_offsets is not None:
+        return check_snap_collision_batch(
+            scene,
+            target_instances,
+            snap,
+            scene_offsets,
+            *args,
+            return_colliding_instances=return_colliding_instances,
+            **kwargs,
+        )
+    
     if return_colliding_instances:
         min_num_collisions = float('inf')
         min_collision = None
@@ -135,6 +170,56 @@ def check_snap_collision(
     return collision
     '''
 
+def check_snap_collision_batch(
+    scene,
+    target_instances,
+    snap,
+    scene_offsets,
+    *args,
+    return_colliding_instances=False,
+    **kwargs,
+):
+    '''
+    Runs check_snap_collision once for each of scene_offsets as if the target
+    instances had been moved by it, without modifying the scene.  Each
+    collision direction is checked for all of the offsets that are still
+    blocked in a single batch.  Returns a list with one result per offset.
+    '''
+    num_offsets = len(scene_offsets)
+    if return_colliding_instances:
+        min_num_collisions = [float('inf')] * num_offsets
+        results = [None] * num_offsets
+    else:
+        results = [True] * num_offsets
+    
+    remaining = list(range(num_offsets))
+    for render_transform in snap.collision_direction_transforms:
+        if not remaining:
+            break
+        collisions = check_collision(
+            scene,
+            target_instances,
+            render_transform,
+            *args,
+            return_colliding_instances=return_colliding_instances,
+            scene_offsets=[scene_offsets[i] for i in remaining],
+            **kwargs,
+        )
+        still_remaining = []
+        for i, collision in zip(remaining, collisions):
+            if not collision:
+                results[i] = collision
+                continue
+            still_remaining.append(i)
+            if return_colliding_instances:
+                num_collision = len(collision)
+                if num_collision < min_num_collisions[i]:
+                    min_num_collisions[i] = num_collision
+                    results[i] = collision
+        remaining = still_remaining
+    
+    return results
+
 def check_collision(
     scene,
     target_instances,
@@ -148,34 +233,44 @@ def check_collision(
     tolerance_spacing=8,
     dump_images=None,
     return_colliding_instances=False,
+    backend='opengl',
+    sprite_cache=None,
+    scene_offsets=None,
+    broadphase=True,
 ):
+    '''
+    Checks whether target_instances can be removed from the scene along the
+    z axis of render_transform.
     
-    # setup ====================================================================
-    # make sure the scene is renderable
-    assert scene.renderable
+    If scene_offsets (a sequence of 4x4 transforms) is provided, the check is
+    run once for each offset as if the target instances (and render_transform)
+    had been moved by it, and a list with one result per offset is returned.
+    The scene itself is never modified: moving the targets by an offset is
+    the same as leaving them in place and viewing the rest of the scene from
+    the moved render_transform, so only the scene pass changes between
+    offsets.
+    '''
     
-    # get a list of the names of the target and scene instances
-    target_instance_names = set(
-        str(target_instance) for target_instance in target_instances)
+    # setup ====================================================================
+    # get a list of the target and scene instance ids
+    target_instance_ids = set(
+        int(target_instance) for target_instance in target_instances)
     if scene_instances is None:
-        scene_instance_names = set(
-            scene.get_all_brick_instances()) - target_instance_names
+        scene_instance_ids = set(
+            int(instance) for instance in scene.instances) - target_instance_ids
     else:
-        scene_instance_names = set(
-            str(scene_instance) for scene_instance in scene_instances)
-    
-    # initialize frame_buffers if necessary
-    if frame_buffers is None:
-        frame_buffers = {}
+        scene_instance_ids = set(
+            int(scene_instance) for scene_instance in scene_instances)
     
-    # store the camera info and which bricks are hidden
-    original_view_matrix = scene.get_view_matrix()
-    original_projection = scene.get_projection()
+    if scene_offsets is None:
+        batched = False
+        scene_offsets = [numpy.eye(4)]
+    else:
+        batched = True
+        assert dump_images is None
     
-    # render the scene depth map ===============================================
     # setup the camera
     camera_transform = unscale_transform(render_transform)
-    render_axis = camera_transform[:3,2]
     
     # compute the extents of the tarrget instance in camera space
     local_target_vertices = []
@@ -201,6 +296,288 @@ def check_collision(
     required_resolution = max_dim * PIXELS_PER_LDU
     required_power = math.ceil(math.log(required_resolution, 2))
     resolution = 2**required_power
+    
+    scene_render_transforms = [
+        offset @ render_transform for offset in scene_offsets]
+    
+    # broadphase ===============================================================
+    # Only scene instances whose bounding boxes reach into the volume above
+    # the target can produce a collision, so everything else can be skipped
+    # when rendering, and if nothing is left there is nothing to render.
+    if broadphase:
+        z_near = camera_distance - near_clip
+        z_far = camera_distance - far_clip
+        volume_min = box_min.copy()
+        volume_max = box_max.copy()
+        volume_min[2] = max(box_min[2] + max_intersection, z_far)
+        volume_max[2] = z_near
+        scene_pass_instance_ids = broadphase_scene_instances(
+            scene,
+            scene_instance_ids,
+            scene_render_transforms,
+            volume_min,
+            volume_max,
+        )
+    else:
+        scene_pass_instance_ids = [
+            sorted(scene_instance_ids) for _ in scene_render_transforms]
+    
+    if return_colliding_instances:
+        results = [
+            numpy.zeros(0, dtype=numpy.int64) for _ in scene_offsets]
+    else:
+        results = [False for _ in scene_offsets]
+    active_passes = [
+        i for i, instance_ids in enumerate(scene_pass_instance_ids)
+        if instance_ids or dump_images is not None
+    ]
+    if not active_passes:
+        if batched:
+            return results
+        else:
+            return results[0]
+    scene_render_transforms = [
+        scene_render_transforms[i] for i in active_passes]
+    scene_pass_instance_ids = [
+        scene_pass_instance_ids[i] for i in active_passes]
+    
+    # render the scene and target depth maps ===================================
+    # Both backends return depth maps in the (unscaled) render_transform frame.
+    # scene_depth_maps are the highest scene surfaces seen looking down the
+    # render axis (one for each offset) and target_depth_map is the lowest
+    # target surface seen looking up it.
+    if backend == 'opengl':
+        maps = render_collision_maps_opengl(
+            scene,
+            target_instance_ids,
+            scene_pass_instance_ids,
+            render_transform,
+            scene_render_transforms,
+            box_min,
+            box_max,
+            width,
+            height,
+            resolution,
+            camera_distance,
+            near_clip,
+            far_clip,
+            frame_buffers=frame_buffers,
+            update_frame_buffers=update_frame_buffers,
+            read_scene_mask=bool(dump_images or return_colliding_instances),
+        )
+    elif backend == 'numpy':
+        maps = render_collision_maps_numpy(
+            scene,
+            target_instance_ids,
+            scene_pass_instance_ids,
+            render_transform,
+            scene_render_transforms,
+            box_min,
+            resolution,
+            camera_distance,
+            near_clip,
+            far_clip,
+            sprite_cache=sprite_cache,
+        )
+    else:
+        raise ValueError('Unknown collision backend: %s'%backend)
+    
+    target_depth_map = maps['target_depth']
+    valid_pixels = maps['valid']
+    
+    for i, scene_depth_map in enumerate(maps['scene_depth']):
+        
+        # check collision ======================================================
+        offset = (scene_depth_map - target_depth_map).reshape(
+            valid_pixels.shape)
+        offset *= valid_pixels
+        
+        # dump images ==========================================================
+        if dump_images is not None:
+            dump_collision_images(
+                dump_images,
+                scene,
+                maps['scene_mask'][i],
+                maps['target_mask'],
+                scene_depth_map,
+                target_depth_map,
+                valid_pixels,
+                offset,
+                max_intersection,
+            )
+        
+        if erosion or return_colliding_instances:
+            collision = offset > max_intersection
+            if erosion:
+                collision = binary_erosion(collision, iterations=erosion)
+        
+        if return_colliding_instances:
+            colliding_y, colliding_x = numpy.where(collision)
+            if maps['scene_ids'][i] is not None:
+                colliding_ids = maps['scene_ids'][i][colliding_y, colliding_x]
+            else:
+                colliding_colors = maps['scene_mask'][i][
+                    colliding_y, colliding_x]
+                colliding_ids = color_byte_to_index(colliding_colors)
+            colliding_bricks = numpy.unique(colliding_ids)
+            results[active_passes[i]] = colliding_bricks
+        
+        else:
+            if erosion:
+                collision = numpy.any(collision)
+            else:
+                collision = numpy.max(offset) > max_intersection
+            
+            results[active_passes[i]] = collision
+    
+    if batched:
+        return results
+    else:
+        return results[0]
+
+def broadphase_scene_instances(
+    scene,
+    scene_instance_ids,
+    render_transforms,
+    volume_min,
+    volume_max,
+):
+    '''
+    For each render transform, returns the sorted list of scene instances
+    whose bounding boxes overlap the axis-aligned box
+    [volume_min, volume_max] in that transform's (unscaled) frame.  The
+    test is conservative: an instance is only dropped if none of its
+    geometry can reach the box.
+    
+    The world-space bounds of every instance come from the scene's cached
+    instance boxes, so they are only recomputed after the scene changes.
+    Each pass first keeps the instances whose world bounds overlap the world
+    bounds of the box, then tests only those instances' corners in the
+    transform's frame.
+    '''
+    # the box may be given in homogeneous coordinates
+    volume_min = numpy.asarray(volume_min)[:3]
+    volume_max = numpy.asarray(volume_max)[:3]
+    
+    all_ids, world_min, world_max = scene.get_instance_boxes()
+    in_scene = numpy.isin(
+        all_ids, numpy.array(list(scene_instance_ids), dtype=numpy.int64))
+    instance_ids = all_ids[in_scene]
+    if not instance_ids.shape[0]:
+        return [[] for _ in render_transforms]
+    world_min = world_min[in_scene]
+    world_max = world_max[in_scene]
+    
+    # the corners of the box in its own frame
+    volume_corners = numpy.ones((4, 8))
+    for i in range(8):
+        for j in range(3):
+            if (i >> j) & 1:
+                volume_corners[j,i] = volume_max[j]
+            else:
+                volume_corners[j,i] = volume_min[j]
+    
+    pass_instance_ids = []
+    for render_transform in render_transforms:
+        camera_transform = unscale_transform(render_transform)
+        world_corners = (camera_transform @ volume_corners)[:3]
+        candidates = numpy.nonzero(
+            numpy.all(world_max >= numpy.min(world_corners, axis=1), axis=1) &
+            numpy.all(world_min <= numpy.max(world_corners, axis=1), axis=1)
+        )[0]
+        if not candidates.shape[0]:
+            pass_instance_ids.append([])
+            continue
+        
+        candidate_ids = instance_ids[candidates]
+        instance_corners = scene.instances.get_bbox_vertices(candidate_ids)
+        inv_camera_transform = numpy.linalg.inv(camera_transform)
+        local_corners = (inv_camera_transform @ instance_corners)[:,:3]
+        corner_min = numpy.min(local_corners, axis=2)
+        corner_max = numpy.max(local_corners, axis=2)
+        overlap = (
+            numpy.all(corner_max >= volume_min, axis=1) &
+            numpy.all(corner_min <= volume_max, axis=1)
+        )
+        pass_instance_ids.append(candidate_ids[overlap].tolist())
+    
+    return pass_instance_ids
+
+def dump_collision_images(
+    dump_images,
+    scene,
+    scene_mask,
+    target_mask,
+    scene_depth_map,
+    target_depth_map,
+    valid_pixels,
+    offset,
+    max_intersection,
+):
+    assert splendor_available
+    if scene_mask is not None:
+        save_image(scene_mask, './%s_scene_mask.png'%dump_images)
+    if target_mask is not None:
+        save_image(target_mask, './%s_target_mask.png'%dump_images)
+    save_depth(scene_depth_map, './%s_scene_depth.npy'%dump_images)
+    save_depth(target_depth_map, './%s_target_depth.npy'%dump_images)
+    
+    min_scene_depth = numpy.min(scene_depth_map)
+    max_scene_depth = numpy.max(scene_depth_map)
+    scene_range = max_scene_depth - min_scene_depth
+    scene_depth_image = (
+        (scene_depth_map - min_scene_depth) / scene_range) * 255
+    scene_depth_image = scene_depth_image.astype(numpy.uint8).reshape(
+        valid_pixels.shape)
+    save_image(scene_depth_image, './%s_scene_depth_image.png'%dump_images)
+    
+    min_target_depth = numpy.min(target_depth_map)
+    max_target_depth = numpy.max(target_depth_map)
+    target_range = max_target_depth - min_target_depth
+    target_depth_image = (
+        (target_depth_map - min_target_depth) / target_range) * 255
+    target_depth_image = target_depth_image.astype(numpy.uint8).reshape(
+        valid_pixels.shape)
+    save_image(
+        target_depth_image, './%s_target_depth_image.png'%dump_images)
+    
+    collision_pixels = (offset > max_intersection).astype(numpy.uint8)
+    collision_pixels = collision_pixels * 255
+    save_image(collision_pixels, './%s_collision.png'%dump_images)
+    
+    scene.export_ldraw('./%s_scene.ldr'%dump_images)
+
+def render_collision_maps_opengl(
+    scene,
+    target_instance_ids,
+    scene_pass_instance_ids,
+    render_transform,
+    scene_render_transforms,
+    box_min,
+    box_max,
+    width,
+    height,
+    resolution,
+    camera_distance,
+    near_clip,
+    far_clip,
+    frame_buffers=None,
+    update_frame_buffers=False,
+    read_scene_mask=False,
+):
+    # make sure the scene is renderable
+    assert scene.renderable
+    
+    target_instance_names = set(str(i) for i in target_instance_ids)
+    
+    # initialize frame_buffers if necessary
+    if frame_buffers is None:
+        frame_buffers = {}
+    
+    # store the camera info and which bricks are hidden
+    original_view_matrix = scene.get_view_matrix()
+    original_projection = scene.get_projection()
+    
     if resolution in frame_buffers:
         frame_buffer = frame_buffers[resolution]
     else:
@@ -213,25 +590,40 @@ def check_collision(
     r = box_min[0]
     b = -(box_max[1] + extra_height)
     t = - box_min[1]
-    
-    # build the camera transform and orthographic projection
-    camera_transform[:3,3] += render_axis * camera_distance
-    scene.set_view_matrix(numpy.linalg.inv(camera_transform))
     orthographic_projection = orthographic_matrix(
         l=l, r=r, b=b, t=t, n=near_clip, f=far_clip)
     scene.set_projection(orthographic_projection)
-    
-    # render
     frame_buffer.enable()
-    scene.mask_render(instances=scene_instance_names, ignore_hidden=True)
-    if dump_images or return_colliding_instances:
-        scene_mask = frame_buffer.read_pixels()
-    scene_depth_map = frame_buffer.read_pixels(
-            read_depth=True, projection=orthographic_projection)
+    
+    # render the scene depth maps ==============================================
+    scene_masks = []
+    scene_depth_maps = []
+    for scene_render_transform, scene_instance_ids in zip(
+        scene_render_transforms, scene_pass_instance_ids
+    ):
+        # setup the camera
+        camera_transform = unscale_transform(scene_render_transform)
+        render_axis = camera_transform[:3,2]
+        camera_transform[:3,3] += render_axis * camera_distance
+        scene.set_view_matrix(numpy.linalg.inv(camera_transform))
+        
+        # render
+        scene_instance_names = set(str(i) for i in scene_instance_ids)
+        scene.mask_render(instances=scene_instance_names, ignore_hidden=True)
+        if read_scene_mask:
+            scene_masks.append(frame_buffer.read_pixels())
+        else:
+            scene_masks.append(None)
+        scene_depth_map = frame_buffer.read_pixels(
+                read_depth=True, projection=orthographic_projection)
+        scene_depth_map -= camera_distance
+        scene_depth_map *= -1.
+        scene_depth_maps.append(scene_depth_map)
     
     # render the target depth map ==============================================
     # setup the camera
     camera_transform = unscale_transform(render_transform)
+    render_axis = camera_transform[:3,2]
     camera_transform[:3,3] -= render_axis * camera_distance
     axis_flip = numpy.array([
         [ 1, 0, 0, 0],
@@ -241,10 +633,8 @@ def check_collision(
     ])
     camera_transform = numpy.dot(camera_transform, axis_flip)
     scene.set_view_matrix(numpy.linalg.inv(camera_transform))
-    scene.set_projection(orthographic_projection)
     
     # render -------------------------------------------------------------------
-    frame_buffer.enable()
     scene.mask_render(instances=target_instance_names, ignore_hidden=True)
     target_mask = frame_buffer.read_pixels()
     target_depth_map = frame_buffer.read_pixels(
@@ -254,63 +644,126 @@ def check_collision(
     scene.set_view_matrix(original_view_matrix)
     scene.set_projection(original_projection)
     
-    # check collision ==========================================================
+    # convert to render_transform space ========================================
     valid_pixels = numpy.sum(target_mask != 0, axis=-1) != 0
-    
-    scene_depth_map -= camera_distance
-    scene_depth_map *= -1.
     target_depth_map -= camera_distance
-    offset = (scene_depth_map - target_depth_map).reshape(valid_pixels.shape)
-    offset *= valid_pixels
     
-    # dump images ==============================================================
-    if dump_images is not None:
-        save_image(scene_mask, './%s_scene_mask.png'%dump_images)
-        save_image(target_mask, './%s_target_mask.png'%dump_images)
-        save_depth(scene_depth_map, './%s_scene_depth.npy'%dump_images)
-        save_depth(target_depth_map, './%s_target_depth.npy'%dump_images)
-        
-        min_scene_depth = numpy.min(scene_depth_map)
-        max_scene_depth = numpy.max(scene_depth_map)
-        scene_range = max_scene_depth - min_scene_depth
-        scene_depth_image = (
-            (scene_depth_map - min_scene_depth) / scene_range) * 255
-        scene_depth_image = scene_depth_image.astype(numpy.uint8).squeeze(-1)
-        save_image(scene_depth_image, './%s_scene_depth_image.png'%dump_images)
-        
-        min_target_depth = numpy.min(target_depth_map)
-        max_target_depth = numpy.max(target_depth_map)
-        target_range = max_target_depth - min_target_depth
-        target_depth_image = (
-            (target_depth_map - min_target_depth) / target_range) * 255
-        target_depth_image = target_depth_image.astype(numpy.uint8).squeeze(-1)
-        save_image(
-            target_depth_image, './%s_target_depth_image.png'%dump_images)
-        
-        collision_pixels = (offset > max_intersection).astype(numpy.uint8)
-        collision_pixels = collision_pixels * 255
-        save_image(collision_pixels, './%s_collision.png'%dump_images)
-        
-        scene.export_ldraw('./%s_scene.ldr'%dump_images)
+    return {
+        'scene_depth' : scene_depth_maps,
+        'target_depth' : target_depth_map,
+        'valid' : valid_pixels,
+        'scene_mask' : scene_masks,
+        'target_mask' : target_mask,
+        'scene_ids' : [None for _ in scene_depth_maps],
+    }
+
+def render_collision_maps_numpy(
+    scene,
+    target_instance_ids,
+    scene_pass_instance_ids,
+    render_transform,
+    scene_render_transforms,
+    box_min,
+    resolution,
+    camera_distance,
+    near_clip,
+    far_clip,
+    sprite_cache=None,
+):
+    '''
+    Software equivalent of render_collision_maps_opengl that rasterizes the
+    BrickShape triangles directly.  All passes are drawn in one batch: the
+    scene passes go into the first len(scene_render_transforms) images and
+    the target pass, which looks up the render axis instead of down it, is
+    flipped in z and drawn into the last image with the same clip range.  If
+    a DepthSpriteCache is provided, instances that can be drawn from it are
+    composited instead of rasterized.
+    '''
+    z_near = camera_distance - near_clip
+    z_far = camera_distance - far_clip
     
-    if erosion or return_colliding_instances:
-        collision = offset > max_intersection
-        if erosion:
-            collision = binary_erosion(collision, iterations=erosion)
+    num_scene_images = len(scene_render_transforms)
+    num_images = num_scene_images + 1
+    depth = numpy.full((num_images, resolution, resolution), -numpy.inf)
+    ids = numpy.zeros((num_images, resolution, resolution), dtype=numpy.int64)
     
-    if return_colliding_instances:
-        colliding_y, colliding_x = numpy.where(collision)
-        colliding_colors = scene_mask[colliding_y, colliding_x]
-        colliding_bricks = numpy.unique(color_byte_to_index(colliding_colors))
-        return colliding_bricks
+    flip_transform = numpy.diag([1., 1., -1., 1.])
+    passes = [
+        (i, instance_ids, numpy.linalg.inv(unscale_transform(t)))
+        for i, (t, instance_ids) in enumerate(
+            zip(scene_render_transforms, scene_pass_instance_ids))
+    ]
+    passes.append((
+        num_scene_images,
+        target_instance_ids,
+        flip_transform @ numpy.linalg.inv(unscale_transform(render_transform)),
+    ))
     
-    else:
-        if erosion:
-            collision = numpy.any(collision)
-        else:
-            collision = numpy.max(offset) > max_intersection
-        
-        return collision
+    triangles = []
+    triangle_images = []
+    triangle_ids = []
+    for image, instance_ids, inv_camera_transform in passes:
+        for instance_id in instance_ids:
+            instance = scene.instances[instance_id]
+            triangle_vertices = instance.brick_shape.triangle_vertices
+            if not triangle_vertices.shape[1]:
+                continue
+            transform = inv_camera_transform @ instance.transform
+            if sprite_cache is not None and sprite_cache.composite(
+                depth,
+                ids,
+                image,
+                instance.brick_shape,
+                instance_id,
+                transform,
+                box_min,
+                PIXELS_PER_LDU,
+                z_far,
+                z_near,
+            ):
+                continue
+            local_vertices = (transform @ triangle_vertices)[:3].T
+            local_vertices = local_vertices.reshape(-1, 3, 3)
+            triangles.append(local_vertices)
+            num_triangles = local_vertices.shape[0]
+            triangle_images.append(numpy.full(num_triangles, image))
+            triangle_ids.append(numpy.full(num_triangles, instance_id))
+    
+    if triangles:
+        triangles = numpy.concatenate(triangles)
+        triangle_images = numpy.concatenate(triangle_images)
+        triangle_ids = numpy.concatenate(triangle_ids)
+        triangle_depth, triangle_ids = rasterize_max_depth(
+            triangles,
+            triangle_images,
+            triangle_ids,
+            num_images,
+            resolution,
+            box_min,
+            PIXELS_PER_LDU,
+            numpy.full(num_images, z_far),
+            numpy.full(num_images, z_near),
+        )
+        closer = triangle_depth > depth
+        depth[closer] = triangle_depth[closer]
+        ids[closer] = triangle_ids[closer]
+    
+    # empty scene pixels read back as the far clip plane, just like the
+    # cleared depth buffer in the opengl backend
+    scene_depth_maps = depth[:num_scene_images]
+    scene_depth_maps[scene_depth_maps == -numpy.inf] = z_far
+    
+    valid_pixels = depth[-1] != -numpy.inf
+    target_depth_map = numpy.where(valid_pixels, -depth[-1], 0.)
+    
+    return {
+        'scene_depth' : list(scene_depth_maps),
+        'target_depth' : target_depth_map,
+        'valid' : valid_pixels,
+        'scene_mask' : [None for _ in range(num_scene_images)],
+        'target_mask' : None,
+        'scene_ids' : list(ids[:num_scene_images]),
+    }
 
 def build_collision_map(
     scene,
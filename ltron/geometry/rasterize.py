@@ -0,0 +1,289 @@
+import collections
+
+import numpy
+
+# maximum number of (triangle, pixel) candidates evaluated at once
+RASTERIZE_CHUNK_SIZE = 2**22
+
+def rasterize_max_depth(
+    triangles,
+    triangle_images,
+    triangle_ids,
+    num_images,
+    resolution,
+    origin,
+    pixels_per_unit,
+    z_min,
+    z_max,
+):
+    '''
+    A pure numpy orthographic depth rasterizer.
+
+    triangles is a (T,3,3) array of triangle vertices where the x and y
+    coordinates are projected straight onto the image plane and z is depth.
+    Each triangle is drawn into image triangle_images[t] and tagged with
+    triangle_ids[t].  Pixels are sampled at their centers, pixel (0,0) covers
+    [origin, origin + 1/pixels_per_unit) and only surfaces with
+    z_min[image] <= z <= z_max[image] are kept, which matches near/far
+    clipping in an orthographic camera.  Each pixel stores the largest z of
+    any surface that covers it.
+
+    Returns a (num_images, resolution, resolution) depth array (-inf where
+    nothing was drawn) and an id array of the same shape (0 where nothing was
+    drawn).  Images are indexed as [image, y, x].
+    '''
+    depth = numpy.full(num_images * resolution * resolution, -numpy.inf)
+    ids = numpy.zeros(num_images * resolution * resolution, dtype=numpy.int64)
+    if triangles.shape[0] == 0:
+        return (
+            depth.reshape(num_images, resolution, resolution),
+            ids.reshape(num_images, resolution, resolution),
+        )
+
+    # convert to pixel coordinates so that pixel centers are at integers
+    xy = (triangles[:,:,:2] - origin[:2]) * pixels_per_unit - 0.5
+    x = xy[:,:,0]
+    y = xy[:,:,1]
+    z = triangles[:,:,2]
+
+    # discard degenerate triangles, which GL does not draw either
+    area = (
+        (x[:,1] - x[:,0]) * (y[:,2] - y[:,0]) -
+        (x[:,2] - x[:,0]) * (y[:,1] - y[:,0])
+    )
+
+    # pixel bounding box of each triangle, clipped to the image
+    x_start = numpy.maximum(numpy.ceil(numpy.min(x, axis=1)), 0)
+    x_end = numpy.minimum(numpy.floor(numpy.max(x, axis=1)), resolution-1)
+    y_start = numpy.maximum(numpy.ceil(numpy.min(y, axis=1)), 0)
+    y_end = numpy.minimum(numpy.floor(numpy.max(y, axis=1)), resolution-1)
+    widths = (x_end - x_start + 1).astype(numpy.int64)
+    heights = (y_end - y_start + 1).astype(numpy.int64)
+
+    keep = (
+        (area != 0) &
+        (widths > 0) &
+        (heights > 0) &
+        (numpy.max(z, axis=1) >= z_min[triangle_images]) &
+        (numpy.min(z, axis=1) <= z_max[triangle_images])
+    )
+    keep = numpy.nonzero(keep)[0]
+    counts = widths[keep] * heights[keep]
+
+    # rasterize in chunks of triangles so that the expanded candidate arrays
+    # stay bounded
+    chunk_ends = numpy.cumsum(counts)
+    start = 0
+    while start < keep.shape[0]:
+        offset = chunk_ends[start-1] if start else 0
+        end = numpy.searchsorted(
+            chunk_ends, offset + RASTERIZE_CHUNK_SIZE, side='right')
+        end = max(end, start+1)
+        t = keep[start:end]
+        c = counts[start:end]
+        start = end
+
+        # expand every triangle into the pixels of its bounding box
+        tt = numpy.repeat(t, c)
+        local = numpy.arange(tt.shape[0]) - numpy.repeat(numpy.cumsum(c)-c, c)
+        px = x_start[tt] + local % widths[tt]
+        py = y_start[tt] + local // widths[tt]
+
+        # barycentric coordinates of the pixel centers
+        x0, x1, x2 = x[tt,0], x[tt,1], x[tt,2]
+        y0, y1, y2 = y[tt,0], y[tt,1], y[tt,2]
+        a = area[tt]
+        l0 = ((x1 - px) * (y2 - py) - (x2 - px) * (y1 - py)) / a
+        l1 = ((x2 - px) * (y0 - py) - (x0 - px) * (y2 - py)) / a
+        l2 = 1. - l0 - l1
+        pz = l0 * z[tt,0] + l1 * z[tt,1] + l2 * z[tt,2]
+        images = triangle_images[tt]
+        inside = (
+            (l0 >= 0) & (l1 >= 0) & (l2 >= 0) &
+            (pz >= z_min[images]) & (pz <= z_max[images])
+        )
+
+        pixel = (
+            (images[inside] * resolution + py[inside].astype(numpy.int64)) *
+            resolution + px[inside].astype(numpy.int64)
+        )
+        pz = pz[inside]
+        pid = triangle_ids[tt[inside]]
+        if not pixel.shape[0]:
+            continue
+
+        # keep the largest z per pixel
+        order = numpy.lexsort((pz, pixel))
+        pixel = pixel[order]
+        pz = pz[order]
+        pid = pid[order]
+        last = numpy.ones(pixel.shape[0], dtype=bool)
+        last[:-1] = pixel[1:] != pixel[:-1]
+        pixel = pixel[last]
+        pz = pz[last]
+        pid = pid[last]
+        closer = pz > depth[pixel]
+        depth[pixel[closer]] = pz[closer]
+        ids[pixel[closer]] = pid[closer]
+
+    return (
+        depth.reshape(num_images, resolution, resolution),
+        ids.reshape(num_images, resolution, resolution),
+    )
+
+def get_axis_aligned_rotation(matrix, tolerance=1e-5):
+    '''
+    Returns matrix as an integer array if it is a signed permutation matrix
+    (a rotation by multiples of 90 degrees, possibly with a mirror), otherwise
+    None.
+    '''
+    rounded = numpy.round(matrix)
+    if not numpy.allclose(matrix, rounded, atol=tolerance):
+        return None
+    rounded = rounded.astype(numpy.int64)
+    if numpy.any(numpy.sum(numpy.abs(rounded), axis=0) != 1):
+        return None
+    if numpy.any(numpy.sum(numpy.abs(rounded), axis=1) != 1):
+        return None
+    return rounded
+
+class DepthSpriteCache:
+    '''
+    An LRU cache of precomputed orthographic depth images ("sprites") of
+    BrickShapes in axis-aligned orientations.
+
+    When an instance is axis-aligned with the camera, lands on whole pixels
+    and is not cut by the near or far clipping planes, its depth image is just
+    a shifted copy of its sprite offset in z, so it can be composited into the
+    depth map instead of being rasterized.  Instances that do not meet these
+    conditions are left to the caller to rasterize.
+    '''
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.sprites = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.sprites)
+    
+    def clear(self):
+        self.sprites.clear()
+        self.hits = 0
+        self.misses = 0
+    
+    def get_sprite(self, brick_shape, rotation, pixels_per_unit):
+        key = (str(brick_shape), tuple(rotation.ravel().tolist()),
+            pixels_per_unit)
+        if key in self.sprites:
+            self.hits += 1
+            self.sprites.move_to_end(key)
+            return self.sprites[key]
+        
+        self.misses += 1
+        sprite = make_depth_sprite(brick_shape, rotation, pixels_per_unit)
+        self.sprites[key] = sprite
+        while len(self.sprites) > self.max_size:
+            self.sprites.popitem(last=False)
+        
+        return sprite
+    
+    def composite(
+        self,
+        depth,
+        ids,
+        image,
+        brick_shape,
+        instance_id,
+        transform,
+        origin,
+        pixels_per_unit,
+        z_min,
+        z_max,
+        tolerance=1e-5,
+    ):
+        '''
+        Draw brick_shape (placed at transform) into depth[image] and
+        ids[image] using a cached sprite.  Returns False if the instance
+        cannot be drawn from a sprite and must be rasterized instead.
+        '''
+        rotation = get_axis_aligned_rotation(transform[:3,:3], tolerance)
+        if rotation is None:
+            return False
+        
+        translation = transform[:3,3]
+        sprite = self.get_sprite(brick_shape, rotation, pixels_per_unit)
+        if sprite is None:
+            return True
+        sprite_z_min = sprite['z_range'][0] + translation[2]
+        sprite_z_max = sprite['z_range'][1] + translation[2]
+        if sprite_z_max < z_min or sprite_z_min > z_max:
+            return True
+        if sprite_z_min < z_min or sprite_z_max > z_max:
+            return False
+        
+        pixel_offset = (
+            (sprite['origin'] + translation[:2] - origin[:2]) *
+            pixels_per_unit
+        )
+        rounded_offset = numpy.round(pixel_offset)
+        if not numpy.allclose(pixel_offset, rounded_offset, atol=tolerance):
+            return False
+        x0, y0 = rounded_offset.astype(numpy.int64).tolist()
+        
+        sprite_height, sprite_width = sprite['depth'].shape
+        image_height, image_width = depth.shape[-2:]
+        x_start = max(x0, 0)
+        x_end = min(x0 + sprite_width, image_width)
+        y_start = max(y0, 0)
+        y_end = min(y0 + sprite_height, image_height)
+        if x_start >= x_end or y_start >= y_end:
+            return True
+        
+        sprite_depth = sprite['depth'][
+            y_start-y0:y_end-y0, x_start-x0:x_end-x0] + translation[2]
+        depth_window = depth[image, y_start:y_end, x_start:x_end]
+        ids_window = ids[image, y_start:y_end, x_start:x_end]
+        closer = sprite_depth > depth_window
+        depth_window[closer] = sprite_depth[closer]
+        ids_window[closer] = instance_id
+        
+        return True
+
+def make_depth_sprite(brick_shape, rotation, pixels_per_unit):
+    '''
+    Rasterize brick_shape rotated by rotation (with no translation) into a
+    depth image just large enough to hold it, with an origin on the pixel
+    grid.  Returns None for shapes with no triangles.
+    '''
+    triangle_vertices = brick_shape.triangle_vertices
+    if not triangle_vertices.shape[1]:
+        return None
+    
+    vertices = rotation @ triangle_vertices[:3]
+    vertex_min = numpy.min(vertices, axis=1)
+    vertex_max = numpy.max(vertices, axis=1)
+    origin = numpy.floor(vertex_min[:2] * pixels_per_unit) / pixels_per_unit
+    width, height = (
+        numpy.ceil((vertex_max[:2] - origin) * pixels_per_unit).astype(
+            numpy.int64) + 1).tolist()
+    
+    triangles = vertices.T.reshape(-1, 3, 3)
+    num_triangles = triangles.shape[0]
+    depth, _ = rasterize_max_depth(
+        triangles,
+        numpy.zeros(num_triangles, dtype=numpy.int64),
+        numpy.zeros(num_triangles, dtype=numpy.int64),
+        1,
+        max(width, height),
+        origin,
+        pixels_per_unit,
+        numpy.array([-numpy.inf]),
+        numpy.array([numpy.inf]),
+    )
+    
+    return {
+        'depth' : depth[0, :height, :width].copy(),
+        'origin' : origin,
+        'z_range' : (vertex_min[2], vertex_max[2]),
+    }
@@ -357,6 +357,45 @@ def build_symmetry_table(
     with open(symmetry_table_path, 'w') as f:
         json.dump(symmetry_table, f, indent=2)
 
+symmetry_rotation_tables = {}
+
+def get_symmetry_rotations(symmetries):
+    '''
+    Expands a list of symmetry names (see symmetry_tests) into the (K,3,3)
+    array of every rotation in the group they generate, including the
+    identity.  Tables are cached, since only a handful of distinct symmetry
+    lists exist.
+    '''
+    key = tuple(sorted(symmetries))
+    if key not in symmetry_rotation_tables:
+        generators = [
+            offset[:3,:3] for symmetry in key
+            for offset in symmetry_offsets[symmetry]
+        ]
+        rotations = [numpy.eye(3)]
+        frontier = [numpy.eye(3)]
+        while frontier:
+            new_frontier = []
+            for rotation in frontier:
+                for generator in generators:
+                    candidate = generator @ rotation
+                    if not any(
+                        numpy.allclose(candidate, r, atol=1e-6)
+                        for r in rotations
+                    ):
+                        rotations.append(candidate)
+                        new_frontier.append(candidate)
+            frontier = new_frontier
+        symmetry_rotation_tables[key] = numpy.stack(rotations)
+    
+    return symmetry_rotation_tables[key]
+
+def unscale_rotations(rotations):
+    rotations = rotations / numpy.linalg.norm(rotations, axis=-2, keepdims=True)
+    flip = numpy.linalg.det(rotations) < 0.
+    rotations[flip,:,0] *= -1
+    return rotations
+
 def pose_match_under_symmetries(
     symmetries,
     pose_a,
@@ -364,54 +403,46 @@ def pose_match_under_symmetries(
     metric_tolerance=1.,
     angular_tolerance=0.08,
 ):
-    if not metric_close_enough(pose_a[:3,3], pose_b[:3,3], metric_tolerance):
-        return False
+    '''
+    Returns True if pose_a and pose_b are within metric_tolerance of each
+    other and the rotation between them is within angular_tolerance of a
+    rotation in the symmetry group generated by symmetries.  pose_a and
+    pose_b may also be (N,4,4) arrays of pose pairs, in which case a boolean
+    array of length N is returned.
     
-    r_a = unscale_transform(pose_a[:3,:3])
-    r_b = unscale_transform(pose_b[:3,:3])
-    #if matrix_angle_close_enough(r_a, r_b, angular_tolerance):
-    #    return True
-    #r_ab = r_a.T @ r_b
-    #q = Quaternion(matrix=r_ab)
-    #if abs(q.angle) < angular_tolerance:
-    #    return True
-    r_ab = r_a.T @ r_b
-    t = (numpy.trace(r_ab) - 1)/2.
-    if t < -1.:
-        t = -1
-    if t > 1.:
-        t = 1
-    angle = math.acos(t)
-    if abs(angle) < angular_tolerance:
-        return True
+    angular_tolerance bounds the geodesic angle between the relative
+    rotation and the nearest rotation in the group.  This differs from the
+    earlier test, which split the relative rotation into an axis and an
+    angle and checked each against every symmetry separately:
+    - That test fell back to the y axis for half turns, so exact 180 degree
+      rotations about x or z (rx180, rz180, or two steps of rx90 or rz90)
+      were rejected.  They are accepted now.
+    - Its separate axis and angle checks let through rotations that were
+      0.1-0.3 radians away from any symmetry.  These are rejected now.
+    '''
+    single = pose_a.ndim == 2
+    if single:
+        pose_a = pose_a[None]
+        pose_b = pose_b[None]
     
-    s = (
-        (r_ab[2,1] - r_ab[1,2])**2 +
-        (r_ab[0,2] - r_ab[2,0])**2 +
-        (r_ab[1,0] - r_ab[0,1])**2
-    )**0.5
-    if s < 0.000001:
-        axis = numpy.array([0,1,0])
-    else:
-        axis = numpy.array([
-            (r_ab[2,1] - r_ab[1,2])/s,
-            (r_ab[0,2] - r_ab[2,0])/s,
-            (r_ab[1,0] - r_ab[0,1])/s
-        ])
+    offsets = pose_a[:,:3,3] - pose_b[:,:3,3]
+    close = numpy.sum(offsets**2, axis=-1) <= metric_tolerance**2
     
-    for symmetry in symmetries:
-        symmetry_axis, symmetry_angle = symmetry_tests[symmetry]
-        if vector_angle_close_enough(
-            #symmetry_axis, q.axis, angular_tolerance, allow_negative=True
-            symmetry_axis, axis, angular_tolerance, allow_negative=True
-        ):
-            angle_offset = abs(
-            #    round(q.angle / symmetry_angle) * symmetry_angle - q.angle)
-                round(angle / symmetry_angle) * symmetry_angle - angle)
-            if angle_offset < angular_tolerance:
-                return True
+    # The angle between two rotations is below angular_tolerance exactly when
+    # the trace of their relative rotation is above 1 + 2 cos(tolerance), and
+    # the trace of G^T R is the elementwise product sum of G and R.
+    r_a = unscale_rotations(pose_a[:,:3,:3])
+    r_b = unscale_rotations(pose_b[:,:3,:3])
+    r_ab = numpy.swapaxes(r_a, -1, -2) @ r_b
+    group = get_symmetry_rotations(symmetries)
+    traces = numpy.einsum('kij,nij->nk', group, r_ab)
+    trace_threshold = 1. + 2. * math.cos(angular_tolerance)
+    match = close & numpy.any(traces > trace_threshold, axis=-1)
     
-    return False
+    if single:
+        return bool(match[0])
+    else:
+        return match
 
 def brick_pose_match_under_symmetry(
     part_name,
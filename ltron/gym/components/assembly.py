@@ -11,6 +11,7 @@ class AssemblyComponent(SensorComponent):
         max_edges,
         update_frequency,
         observable,
+        reuse_buffers=False,
     ):
         super().__init__(
             update_frequency=update_frequency,
@@ -23,6 +24,15 @@ class AssemblyComponent(SensorComponent):
         self.max_instances = max_instances
         self.max_edges = max_edges
         
+        # when reuse_buffers is set, every observation is written into the
+        # same arrays, so consumers must copy anything they want to keep
+        # past the next step
+        if reuse_buffers:
+            self.assembly_buffers = make_empty_assembly(
+                self.max_instances, self.max_edges)
+        else:
+            self.assembly_buffers = None
+        
         if self.observable:
             self.observation_space = AssemblySpace(
                 self.shape_ids,
@@ -37,7 +47,27 @@ class AssemblyComponent(SensorComponent):
             self.color_ids,
             self.max_instances,
             self.max_edges,
+            out=self.assembly_buffers,
         )
+    
+    def get_state(self):
+        # the reused buffers are overwritten on the next step, so the saved
+        # state needs its own copy
+        observation, stale = super().get_state()
+        if self.assembly_buffers is not None and observation is not None:
+            observation = {
+                key:value.copy() for key, value in observation.items()}
+        return observation, stale
+    
+    def set_state(self, state):
+        # copy the saved arrays back into the reused buffers so the restored
+        # observation never aliases the saved state
+        observation, stale = state
+        if self.assembly_buffers is not None and observation is not None:
+            for key, value in observation.items():
+                self.assembly_buffers[key][:] = value
+            observation = self.assembly_buffers
+        return super().set_state((observation, stale))
 
 class DeduplicateAssemblyComponent(SensorComponent):
     def __init__(self,
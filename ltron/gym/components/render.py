@@ -4,6 +4,9 @@ from splendor.frame_buffer import FrameBufferWrapper
 import splendor.masks as masks
 
 from ltron.gym.spaces import ImageSpace, InstanceMaskSpace, SnapMaskSpace
+from ltron.render.damage import DamageTracker
+from ltron.render.batch import BatchRenderEnvironment
+from ltron.render.environment import unpack_snap_ids
 from ltron.gym.components.sensor_component import SensorComponent
 
 class ColorRenderComponent(SensorComponent):
@@ -14,7 +17,15 @@ class ColorRenderComponent(SensorComponent):
         anti_alias=True,
         update_frequency='step',
         observable=True,
+        track_damage=False,
     ):
+        '''
+        If track_damage is True, each render also records in self.damage
+        the pixel rectangles that can have changed since the previous render
+        (see ltron.render.damage.DamageTracker), or None if the whole image
+        may have changed.  self.frame_index counts the renders so that
+        consumers can tell which frame the damage is relative to.
+        '''
         super().__init__(
             update_frequency=update_frequency,
             observable=observable,
@@ -28,8 +39,18 @@ class ColorRenderComponent(SensorComponent):
         self.scene_component.brick_scene.make_renderable()
         self.anti_alias = anti_alias
         
-        self.frame_buffer = FrameBufferWrapper(
-                self.width, self.height, self.anti_alias)
+        if track_damage:
+            self.damage_tracker = DamageTracker(scene, width, height)
+        else:
+            self.damage_tracker = None
+        self.damage = None
+        self.frame_index = 0
+        
+        self.batch_render = isinstance(
+            scene.render_environment, BatchRenderEnvironment)
+        if not self.batch_render:
+            self.frame_buffer = FrameBufferWrapper(
+                    self.width, self.height, self.anti_alias)
         
         if observable:
             self.observation_space = ImageSpace(self.width, self.height)
@@ -39,10 +60,17 @@ class ColorRenderComponent(SensorComponent):
     
     def update_observation(self):
         scene = self.scene_component.brick_scene
-        self.frame_buffer.enable()
-        scene.viewport_scissor(0, 0, self.width, self.height)
-        scene.color_render()
-        self.observation = self.frame_buffer.read_pixels()
+        if self.batch_render:
+            self.observation = scene.render_environment.render_image(
+                'color', self.width, self.height)
+        else:
+            self.frame_buffer.enable()
+            scene.viewport_scissor(0, 0, self.width, self.height)
+            scene.color_render()
+            self.observation = self.frame_buffer.read_pixels()
+        if self.damage_tracker is not None:
+            self.damage = self.damage_tracker.update()
+        self.frame_index += 1
 
 class InstanceRenderComponent(SensorComponent):
     def __init__(self,
@@ -61,10 +89,14 @@ class InstanceRenderComponent(SensorComponent):
         self.width = width
         self.height = height
         self.scene_component = scene_component
-        self.scene_component.brick_scene.make_renderable()
+        scene = self.scene_component.brick_scene
+        scene.make_renderable()
         
-        self.frame_buffer = FrameBufferWrapper(
-                self.width, self.height, anti_alias=False)
+        self.batch_render = isinstance(
+            scene.render_environment, BatchRenderEnvironment)
+        if not self.batch_render:
+            self.frame_buffer = FrameBufferWrapper(
+                    self.width, self.height, anti_alias=False)
         
         if observable:
             self.observation_space = InstanceMaskSpace(
@@ -75,6 +107,11 @@ class InstanceRenderComponent(SensorComponent):
     
     def update_observation(self):
         scene = self.scene_component.brick_scene
+        if self.batch_render:
+            self.observation = scene.render_environment.render_image(
+                'mask', self.width, self.height)
+            return
+        
         self.frame_buffer.enable()
         # it seems like this should be done at a lower level than this
         scene.viewport_scissor(0,0,self.width,self.height)
@@ -124,6 +161,14 @@ class SnapRenderComponent(SensorComponent):
         snaps = scene.get_matching_snaps(
             polarity=self.polarity, style=self.style)
         
+        # render instance and snap ids together when they can be packed into
+        # one mask color
+        if scene.snap_render_packed_id(snaps):
+            packed_mask = self.frame_buffer.read_pixels()
+            packed_ids = masks.color_byte_to_index(packed_mask)
+            self.observation = unpack_snap_ids(packed_ids)
+            return
+        
         # render instance ids
         scene.snap_render_instance_id(snaps)
         instance_id_mask = self.frame_buffer.read_pixels()
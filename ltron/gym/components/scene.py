@@ -47,7 +47,6 @@ class EmptySceneComponent(LtronGymComponent):
         return None, 0., False, None
     
     def set_state(self, state):
-        self.brick_scene.clear_instances()
         self.brick_scene.set_assembly(
             state, self.shape_ids, self.color_ids)
         
@@ -107,7 +106,6 @@ class EmptySceneComponentOld(LtronGymComponent):
         return self.observation, 0., False, None
     
     def set_state(self, state):
-        self.brick_scene.clear_instances()
         self.brick_scene.set_assembly(
             state, self.shape_ids, self.color_ids)
         
@@ -41,7 +41,7 @@ class SensorComponent(LtronGymComponent):
     def get_state(self):
         return self.observation, self.stale
     
-    def get_state(self, state):
+    def set_state(self, state):
         self.observation, self.stale = state
         return self.observation
     
@@ -1,3 +1,5 @@
+import warnings
+
 import numpy
 
 from ltron.gym.components.ltron_gym_component import LtronGymComponent
@@ -72,10 +74,26 @@ class DeduplicateTileMaskComponent(LtronGymComponent):
         tile_height,
         render_component,
         background=102,
+        use_damage=True,
+        verify_damage=False,
     ):
+        '''
+        Marks the tiles of each frame that differ from the previous frame.
+        
+        If the render component tracks damage (see ColorRenderComponent), only
+        the tiles that overlap its damage rectangles are compared, otherwise
+        (or when the camera moved) the whole frame is compared.  If
+        verify_damage is True the whole frame is always compared as well,
+        and the full comparison is used if it finds changes outside the
+        damage rectangles.  The number of frames where that happened is
+        kept in damage_mismatches.
+        '''
         self.tile_width = tile_width
         self.tile_height = tile_height
         self.render_component = render_component
+        self.use_damage = use_damage
+        self.verify_damage = verify_damage
+        self.damage_mismatches = 0
         
         assert self.render_component.width % self.tile_width == 0
         assert self.render_component.height % self.tile_height == 0
@@ -91,29 +109,81 @@ class DeduplicateTileMaskComponent(LtronGymComponent):
         )
         self.background = background
     
+    def get_damage(self):
+        '''
+        Returns the render component's damage rectangles if they describe
+        the change from self.previous_frame to the current frame, otherwise
+        None.
+        '''
+        if not self.use_damage:
+            return None
+        frame_index = getattr(self.render_component, 'frame_index', None)
+        if frame_index is None or self.previous_frame_index is None:
+            return None
+        if frame_index == self.previous_frame_index:
+            return []
+        if frame_index == self.previous_frame_index + 1:
+            return self.render_component.damage
+        return None
+    
+    def modified_tiles(self, frame, ty0=0, tx0=0, ty1=None, tx1=None):
+        '''
+        Compares the tiles in rows ty0:ty1 and columns tx0:tx1 of frame with
+        self.previous_frame.
+        '''
+        if ty1 is None:
+            ty1 = self.height
+        if tx1 is None:
+            tx1 = self.width
+        y0, y1 = ty0 * self.tile_height, ty1 * self.tile_height
+        x0, x1 = tx0 * self.tile_width, tx1 * self.tile_width
+        previous_frame = self.previous_frame
+        if numpy.ndim(previous_frame) == 3:
+            previous_frame = previous_frame[y0:y1, x0:x1]
+        modified_channels = frame[y0:y1, x0:x1] != previous_frame
+        modified_channels = modified_channels.reshape(
+            ty1-ty0, self.tile_height, tx1-tx0, self.tile_width, -1)
+        return numpy.any(modified_channels, axis=(1,3,4))
+    
     def observe(self):
         frame = self.render_component.observation
         h, w, c = frame.shape
-        modified_channels = frame != self.previous_frame
-        modified_tiles = modified_channels.reshape(
-            self.height, self.tile_height, self.width, self.tile_width, c)
-        modified_tiles = numpy.moveaxis(modified_tiles, 2, 1)
-        modified_tiles = modified_tiles.reshape(self.height, self.width, -1)
         
         # NOTE TO SELF: At one point this was cast to longs for a reason I
         # haven't figured out.  I changed it to bool to agree with the action
         # space type, but it's possible that this could cause issues later.
-        tile_mask = numpy.any(modified_tiles, axis=-1).reshape(
-            self.height, self.width).astype(numpy.bool)
+        damage = self.get_damage()
+        if damage is None:
+            tile_mask = self.modified_tiles(frame)
+        else:
+            tile_mask = numpy.zeros((self.height, self.width), dtype=bool)
+            for y0, x0, y1, x1 in damage:
+                ty0 = y0 // self.tile_height
+                tx0 = x0 // self.tile_width
+                ty1 = -(-y1 // self.tile_height)
+                tx1 = -(-x1 // self.tile_width)
+                tile_mask[ty0:ty1, tx0:tx1] |= self.modified_tiles(
+                    frame, ty0, tx0, ty1, tx1)
+            
+            if self.verify_damage:
+                full_tile_mask = self.modified_tiles(frame)
+                if numpy.any(full_tile_mask & ~tile_mask):
+                    self.damage_mismatches += 1
+                    warnings.warn('tiles changed outside the damage region')
+                    tile_mask = full_tile_mask
+        
         self.observation = {
             'image' : self.render_component.observation,
             'tile_mask' : tile_mask,
         }
         
         self.previous_frame = frame
+        self.previous_frame_index = getattr(
+            self.render_component, 'frame_index', None)
     
     def reset(self):
         self.previous_frame = self.background
+        self.previous_frame_index = None
         self.observe()
         return self.observation
     
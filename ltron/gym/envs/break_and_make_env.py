@@ -51,6 +51,7 @@ class BreakAndMakeEnvConfig(Config):
     tile_color_render = True
     tile_width = 16
     tile_height = 16
+    track_render_damage = False
     
     check_collision = True
     
@@ -207,6 +208,7 @@ class BreakAndMakeEnv(LtronEnv):
             components['table_scene'],
             anti_alias=True,
             observable=False,
+            track_damage=config.track_render_damage,
         )
         components['hand_color_render'] = ColorRenderComponent(
             config.hand_image_width,
@@ -214,6 +216,7 @@ class BreakAndMakeEnv(LtronEnv):
             components['hand_scene'],
             anti_alias=True,
             observable=False,
+            track_damage=config.track_render_damage,
         )
         
         if config.tile_color_render:
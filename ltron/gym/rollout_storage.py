@@ -3,6 +3,7 @@ import math
 import io
 import copy
 import os
+import json
 import tarfile
 
 import numpy
@@ -12,21 +13,22 @@ import tqdm
 import gym.spaces as spaces
 
 from ltron.hierarchy import (
-    map_hierarchies,
-    index_hierarchy,
-    len_hierarchy,
     concatenate_numpy_hierarchies,
-    stack_numpy_hierarchies,
-    pad_numpy_hierarchy,
     hierarchy_branch,
-    increase_capacity,
-    set_index_hierarchy,
+    HierarchySpec,
+    index_leaves,
+    set_index_leaves,
+    stack_numpy_leaves,
+    pad_numpy_leaves,
+    increase_capacity_leaves,
 )
 
 class RolloutStorage:
     def __init__(self, batch_size):
         self.batch_size = batch_size
         self.gym_data = None
+        self.gym_spec = None
+        self.gym_leaves = None
         
         self.seq_locations = {}
         self.finished_seqs = set()
@@ -102,22 +104,39 @@ class RolloutStorage:
         
         return sub_storage
     
-    def append_batch(self, valid=None, **kwargs):
-        
-        if valid is None:
-            valid = [True for _ in range(self.batch_size)]
-        
+    def get_gym_leaves(self):
+        '''
+        Returns the HierarchySpec of gym_data and its flat list of leaves.
+        These are computed once and reused, so that storing and indexing
+        batches does not need to walk the hierarchy every step.
+        '''
+        if self.gym_spec is None:
+            self.gym_spec = HierarchySpec(self.gym_data)
+            self.gym_leaves = self.gym_spec.flatten(self.gym_data)
+        return self.gym_spec, self.gym_leaves
+    
+    def store_batch(self, batch):
         if self.gym_data is None:
-            self.gym_data = kwargs
+            self.gym_data = batch
             self.batch_index += self.batch_size
         else:
-            if self.batch_index >= len_hierarchy(self.gym_data):
-                self.gym_data = increase_capacity(self.gym_data, factor=2)
-            set_index_hierarchy(
-                self.gym_data, kwargs,
+            spec, leaves = self.get_gym_leaves()
+            if self.batch_index >= len(leaves[0]):
+                self.gym_leaves = increase_capacity_leaves(leaves, factor=2)
+                self.gym_data = spec.unflatten(self.gym_leaves)
+            set_index_leaves(
+                self.gym_leaves,
+                spec.flatten(batch),
                 range(self.batch_index, self.batch_index+self.batch_size),
             )
             self.batch_index += self.batch_size
+    
+    def append_batch(self, valid=None, **kwargs):
+        
+        if valid is None:
+            valid = [True for _ in range(self.batch_size)]
+        
+        self.store_batch(kwargs)
         
         for i, v in enumerate(valid):
             step_index = self.total_steps + i
@@ -156,16 +175,13 @@ class RolloutStorage:
     def get_storage_index(self, seq, step):
         return self.seq_locations[seq][step]
     
+    def get_leaves_from_storage_ids(self, storage_ids):
+        spec, leaves = self.get_gym_leaves()
+        return index_leaves(leaves, storage_ids)
+    
     def get_batch_from_storage_ids(self, storage_ids):
-        # WHY IS THIS IF/ELSE NECESSARY?  Can't index_hierarchy handle this?
-        if isinstance(self.gym_data, dict):
-            gym_data = {}
-            for key, value in self.gym_data.items():
-                gym_data[key] = index_hierarchy(value, storage_ids)
-        else:
-            gym_data = index_hierarchy(self.gym_data, storage_ids)
-        
-        return gym_data
+        spec, leaves = self.get_gym_leaves()
+        return spec.unflatten(index_leaves(leaves, storage_ids))
     
     def get_batch(self, seq_step_ids):
         storage_ids = [
@@ -195,18 +211,25 @@ class RolloutStorage:
     
     def pad_stack_seqs(self, seq_ids, axis=1, start=None, stop=None):
         if isinstance(seq_ids[0], int):
-            gym_data = [
-                self.get_seq(seq, start=start, stop=stop) for seq in seq_ids]
+            seq_storage_ids = [
+                self.seq_locations[seq][start:stop] for seq in seq_ids]
         else:
-            gym_data = [
-                self.get_seq(seq, start, stop)
+            seq_storage_ids = [
+                self.seq_locations[seq][start:stop]
                 for seq, start, stop in seq_ids
             ]
         seq_lens = numpy.array(
-            [len_hierarchy(d) for d in gym_data], dtype=numpy.long)
+            [len(storage_ids) for storage_ids in seq_storage_ids],
+            dtype=numpy.long,
+        )
         max_seq_len = max(seq_lens)
-        gym_data = [pad_numpy_hierarchy(d, max_seq_len) for d in gym_data]
-        gym_data = stack_numpy_hierarchies(*gym_data, axis=axis)
+        seq_leaves = [
+            pad_numpy_leaves(
+                self.get_leaves_from_storage_ids(storage_ids), max_seq_len)
+            for storage_ids in seq_storage_ids
+        ]
+        spec, _ = self.get_gym_leaves()
+        gym_data = spec.unflatten(stack_numpy_leaves(seq_leaves, axis=axis))
         return gym_data, seq_lens
     
     def get_current_seqs(self, stack_axis=1, start=None, stop=None):
@@ -232,6 +255,217 @@ class RolloutStorage:
         
         return seq_id_start_stops
 
+class ChunkedMemmap:
+    '''
+    An array of per-step items stored in a list of preallocated
+    memory-mapped .npy files of chunk_size items each.  Growing the array
+    only creates a new chunk file, so nothing that has already been written
+    is ever copied.  Supports the integer, list, range and slice indexing
+    used by the hierarchy utilities.  Reads return ordinary numpy arrays.
+    '''
+    def __init__(
+        self, path, dtype, item_shape, chunk_size, num_chunks=0, mode='w+'
+    ):
+        self.path = path
+        self.dtype = numpy.dtype(dtype)
+        self.item_shape = tuple(item_shape)
+        self.chunk_size = chunk_size
+        self.mode = mode
+        self.chunks = []
+        for i in range(num_chunks):
+            self.chunks.append(
+                numpy.load(self.chunk_path(i), mmap_mode=mode))
+    
+    def chunk_path(self, i):
+        return '%s_%06i.npy'%(self.path, i)
+    
+    def __len__(self):
+        return len(self.chunks) * self.chunk_size
+    
+    def ensure_capacity(self, n):
+        while len(self) < n:
+            self.chunks.append(numpy.lib.format.open_memmap(
+                self.chunk_path(len(self.chunks)),
+                mode='w+',
+                dtype=self.dtype,
+                shape=(self.chunk_size, *self.item_shape),
+            ))
+    
+    def locate(self, index):
+        if isinstance(index, slice):
+            index = range(*index.indices(len(self)))
+        index = numpy.asarray(index, dtype=numpy.int64)
+        return index, index // self.chunk_size, index % self.chunk_size
+    
+    def __getitem__(self, index):
+        if isinstance(index, (int, numpy.integer)):
+            chunk, offset = divmod(int(index), self.chunk_size)
+            return numpy.array(self.chunks[chunk][offset])
+        
+        index, chunk_ids, offsets = self.locate(index)
+        result = numpy.zeros((len(index), *self.item_shape), dtype=self.dtype)
+        for chunk in numpy.unique(chunk_ids).tolist():
+            in_chunk = chunk_ids == chunk
+            result[in_chunk] = self.chunks[chunk][offsets[in_chunk]]
+        
+        return result
+    
+    def __setitem__(self, index, value):
+        index, chunk_ids, offsets = self.locate(index)
+        value = numpy.broadcast_to(
+            numpy.asarray(value), (len(index), *self.item_shape))
+        for chunk in numpy.unique(chunk_ids).tolist():
+            in_chunk = chunk_ids == chunk
+            self.chunks[chunk][offsets[in_chunk]] = value[in_chunk]
+    
+    def flush(self):
+        for chunk in self.chunks:
+            if isinstance(chunk, numpy.memmap):
+                chunk.flush()
+
+class MemmapRolloutStorage(RolloutStorage):
+    '''
+    A RolloutStorage that writes each leaf of the gym data hierarchy to
+    memory-mapped chunk files in directory instead of holding it in memory.
+    Storage grows by chunk_size steps at a time without copying.  save()
+    with no destination is a flush: the chunks are flushed and the
+    sequence index and leaf layout are written next to them, so the
+    storage can be reopened later with MemmapRolloutStorage.load.
+    '''
+    def __init__(self, batch_size, directory, chunk_size=4096):
+        super().__init__(batch_size)
+        self.directory = os.path.expanduser(directory)
+        self.chunk_size = chunk_size
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+    
+    def make_leaves(self, batch, name):
+        if isinstance(batch, dict):
+            return {
+                key : self.make_leaves(value, '%s.%s'%(name, key))
+                for key, value in batch.items()
+            }
+        elif isinstance(batch, (tuple, list)):
+            return [
+                self.make_leaves(value, '%s.%i'%(name, i))
+                for i, value in enumerate(batch)
+            ]
+        else:
+            batch = numpy.asarray(batch)
+            return ChunkedMemmap(
+                os.path.join(self.directory, name),
+                batch.dtype,
+                batch.shape[1:],
+                self.chunk_size,
+            )
+    
+    def leaves(self):
+        if self.gym_data is None:
+            return []
+        spec, leaves = self.get_gym_leaves()
+        return leaves
+    
+    def store_batch(self, batch):
+        if self.gym_data is None:
+            self.gym_data = self.make_leaves(batch, 'data')
+        
+        spec, leaves = self.get_gym_leaves()
+        end = self.batch_index + self.batch_size
+        for leaf in leaves:
+            leaf.ensure_capacity(end)
+        set_index_leaves(
+            leaves, spec.flatten(batch), range(self.batch_index, end))
+        self.batch_index = end
+    
+    def flush(self):
+        for leaf in self.leaves():
+            leaf.flush()
+        
+        seq_ids = sorted(self.seq_locations.keys())
+        seq_lens = [len(self.seq_locations[seq]) for seq in seq_ids]
+        steps = [step for seq in seq_ids for step in self.seq_locations[seq]]
+        numpy.savez(
+            os.path.join(self.directory, 'seq_index.npz'),
+            seq_ids=numpy.array(seq_ids, dtype=numpy.int64),
+            seq_offsets=numpy.cumsum([0] + seq_lens, dtype=numpy.int64),
+            steps=numpy.array(steps, dtype=numpy.int64),
+            finished=numpy.array(sorted(self.finished_seqs), dtype=numpy.int64),
+        )
+        
+        def leaf_layout(leaf):
+            return {
+                'path' : os.path.relpath(leaf.path, self.directory),
+                'dtype' : leaf.dtype.str,
+                'item_shape' : list(leaf.item_shape),
+                'num_chunks' : len(leaf.chunks),
+            }
+        layout = {
+            'batch_size' : self.batch_size,
+            'chunk_size' : self.chunk_size,
+            'batch_index' : self.batch_index,
+            'total_steps' : self.total_steps,
+            'next_seq_index' : self.next_seq_index,
+            'structure' : None,
+            'leaves' : [],
+        }
+        if self.gym_data is not None:
+            # the structure is stored with each leaf replaced by its index
+            # into the list of leaf layouts
+            spec, leaves = self.get_gym_leaves()
+            layout['structure'] = spec.unflatten(list(range(len(leaves))))
+            layout['leaves'] = [leaf_layout(leaf) for leaf in leaves]
+        with open(os.path.join(self.directory, 'layout.json'), 'w') as f:
+            json.dump(layout, f)
+    
+    def save(self, destination=None, **kwargs):
+        if destination is None:
+            self.flush()
+        else:
+            super().save(destination, **kwargs)
+    
+    @staticmethod
+    def load(directory, mode='r'):
+        '''
+        Reopen a storage written by flush.  The returned storage is
+        read-only unless mode is 'r+'.
+        '''
+        directory = os.path.expanduser(directory)
+        with open(os.path.join(directory, 'layout.json')) as f:
+            layout = json.load(f)
+        
+        if mode == 'r+':
+            storage = MemmapRolloutStorage(
+                layout['batch_size'], directory, layout['chunk_size'])
+        else:
+            storage = ReadOnlyMemmapRolloutStorage(
+                layout['batch_size'], directory, layout['chunk_size'])
+        
+        def open_leaf(leaf_layout):
+            return ChunkedMemmap(
+                os.path.join(directory, leaf_layout['path']),
+                leaf_layout['dtype'],
+                leaf_layout['item_shape'],
+                layout['chunk_size'],
+                num_chunks=leaf_layout['num_chunks'],
+                mode=mode,
+            )
+        if layout['structure'] is not None:
+            spec = HierarchySpec(layout['structure'])
+            storage.gym_data = spec.unflatten(
+                [open_leaf(leaf_layout) for leaf_layout in layout['leaves']])
+        storage.batch_index = layout['batch_index']
+        storage.total_steps = layout['total_steps']
+        storage.next_seq_index = layout['next_seq_index']
+        
+        with numpy.load(os.path.join(directory, 'seq_index.npz')) as index:
+            offsets = index['seq_offsets'].tolist()
+            steps = index['steps'].tolist()
+            for i, seq in enumerate(index['seq_ids'].tolist()):
+                storage.seq_locations[seq] = steps[offsets[i]:offsets[i+1]]
+            storage.finished_seqs = set(index['finished'].tolist())
+        
+        return storage
+
 class ReadOnlyRolloutStorage(RolloutStorage):
     def append_batch(self, *args, **kwargs):
         raise Exception('Attempted to append batch to read only storage')
@@ -239,6 +473,13 @@ class ReadOnlyRolloutStorage(RolloutStorage):
     def start_new_seqs(self, *args, **kwargs):
         raise Exception('Attempted to start new seqs on read only storage')
 
+class ReadOnlyMemmapRolloutStorage(
+    ReadOnlyRolloutStorage, MemmapRolloutStorage
+):
+    def save(self, destination=None, **kwargs):
+        if destination is not None:
+            RolloutStorage.save(self, destination, **kwargs)
+
 class BatchSeqIterator:
     def __init__(
         self,
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+import tempfile
+
+import numpy
+
+from ltron.rollout import rollout, load_rollout
+
+class CountingEnv:
+    # each env counts its steps and terminates every episode_len steps
+    def __init__(self, num_envs, episode_len):
+        self.num_envs = num_envs
+        self.episode_len = episode_len
+    
+    def make_observation(self):
+        image = numpy.ones((self.num_envs, 2, 3)) * self.counts[:,None,None]
+        return {'count' : self.counts.copy(), 'image' : image}
+    
+    def reset(self):
+        self.counts = numpy.arange(self.num_envs) * 10
+        self.steps = numpy.zeros(self.num_envs, dtype=numpy.int64)
+        return self.make_observation()
+    
+    def step(self, actions):
+        self.counts += numpy.array(actions) + 1
+        self.steps += 1
+        terminal = self.steps % self.episode_len == 0
+        reward = terminal.astype(numpy.float64)
+        return self.make_observation(), reward, terminal, {}
+
+def actor_fn(observation, terminal, memory):
+    distribution = numpy.ones((len(terminal), 3)) / 3.
+    return distribution, memory
+
+def run(storage_directory=None):
+    numpy.random.seed(1234)
+    return rollout(
+        5, CountingEnv(2, 3), actor_fn, storage_directory=storage_directory)
+
+def assert_equal(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert_equal(a[key], b[key])
+    else:
+        assert numpy.all(numpy.asarray(a) == numpy.asarray(b))
+
+memory_storage = run()
+with tempfile.TemporaryDirectory() as storage_directory:
+    memmap_storage = run(storage_directory)
+    loaded_storage = load_rollout(storage_directory)
+    
+    assert loaded_storage.seq_locations == memory_storage.seq_locations
+    assert loaded_storage.finished_seqs == memory_storage.finished_seqs
+    assert loaded_storage.num_finished_seqs() >= 5
+    for seq in memory_storage.seq_locations:
+        expected = memory_storage.get_seq(seq)
+        assert_equal(memmap_storage.get_seq(seq), expected)
+        assert_equal(loaded_storage.get_seq(seq), expected)
+    
+    # reading the whole rollout back in batches
+    for batch, seq_lens in loaded_storage.batch_seq_iterator(2):
+        assert batch['observation']['image'].shape[1] == len(seq_lens)
+
+print('rollout ok')
@@ -96,18 +96,30 @@ def hierarchy_branch(a, branch_keys):
         a = a[key]
     return a
 
-def len_hierarchy(a):
-    class HierarchyLenException(Exception):
-        def __init__(self, length):
-            self.length = length
-    def fn(a):
-        raise HierarchyLenException(len(a))
-
-    try:
-        map_hierarchies(fn, a)
-    except HierarchyLenException as e:
-        return e.length
+def first_leaf(a):
+    '''
+    Returns (True, leaf) for the first leaf of a in depth-first order, or
+    (False, None) if a has no leaves.
+    '''
+    if isinstance(a, dict):
+        children = a.values()
+    elif isinstance(a, (tuple, list)):
+        children = a
+    else:
+        return True, a
+    
+    for child in children:
+        found, leaf = first_leaf(child)
+        if found:
+            return True, leaf
+    
+    return False, None
 
+def len_hierarchy(a):
+    found, leaf = first_leaf(a)
+    if found:
+        return len(leaf)
+    
     return 0
 
 def x_like_hierarchy(a, value):
@@ -187,6 +199,114 @@ def increase_capacity(a, factor=2):
     
     return map_hierarchies(fn, a)
 
+# flat leaves ==================================================================
+class HierarchySpec:
+    '''
+    The structure (treedef) of a nested hierarchy of dicts, lists and tuples,
+    computed once so that hierarchies with the same structure can be
+    flattened into a list of leaves and rebuilt without inspecting the types
+    of every node again.  Operations that apply to every leaf can then run
+    over the flat lists (see the *_leaves functions below) and the result is
+    only unflattened at the end.
+    
+    flatten does not check that its argument has the same structure as the
+    hierarchy the spec was built from.
+    '''
+    def __init__(self, a):
+        self.treedef = self.build_treedef(a)
+        self.num_leaves = self.count_leaves(self.treedef)
+    
+    @classmethod
+    def build_treedef(cls, a):
+        if isinstance(a, dict):
+            return (dict, tuple(a.keys()), tuple(
+                cls.build_treedef(value) for value in a.values()))
+        elif isinstance(a, (tuple, list)):
+            return (type(a), len(a), tuple(
+                cls.build_treedef(value) for value in a))
+        else:
+            return None
+    
+    @classmethod
+    def count_leaves(cls, treedef):
+        if treedef is None:
+            return 1
+        return sum(cls.count_leaves(child) for child in treedef[2])
+    
+    def flatten(self, a):
+        leaves = []
+        self.flatten_into(self.treedef, a, leaves)
+        return leaves
+    
+    def flatten_into(self, treedef, a, leaves):
+        if treedef is None:
+            leaves.append(a)
+        elif treedef[0] is dict:
+            for key, child in zip(treedef[1], treedef[2]):
+                self.flatten_into(child, a[key], leaves)
+        else:
+            for value, child in zip(a, treedef[2]):
+                self.flatten_into(child, value, leaves)
+    
+    def unflatten(self, leaves):
+        a, _ = self.unflatten_from(self.treedef, leaves, 0)
+        return a
+    
+    def unflatten_from(self, treedef, leaves, i):
+        if treedef is None:
+            return leaves[i], i+1
+        
+        values = []
+        for child in treedef[2]:
+            value, i = self.unflatten_from(child, leaves, i)
+            values.append(value)
+        if treedef[0] is dict:
+            return dict(zip(treedef[1], values)), i
+        elif treedef[0] is tuple:
+            return tuple(values), i
+        else:
+            return values, i
+
+def flatten_hierarchy(a):
+    spec = HierarchySpec(a)
+    return spec.flatten(a), spec
+
+def index_leaves(leaves, index):
+    return [leaf[index] for leaf in leaves]
+
+def set_index_leaves(leaves, values, index):
+    for leaf, value in zip(leaves, values):
+        leaf[index] = value
+
+def stack_numpy_leaves(leaf_lists, axis=0):
+    return [numpy.stack(leaves, axis=axis) for leaves in zip(*leaf_lists)]
+
+def concatenate_numpy_leaves(leaf_lists, axis=0):
+    return [
+        numpy.concatenate(leaves, axis=axis) for leaves in zip(*leaf_lists)]
+
+def pad_numpy_leaves(leaves, pad, axis=0):
+    padded = []
+    for leaf in leaves:
+        if leaf.shape[axis] < pad:
+            pad_shape = list(leaf.shape)
+            pad_shape[axis] = pad - leaf.shape[axis]
+            z = numpy.zeros(pad_shape, dtype=leaf.dtype)
+            leaf = numpy.concatenate((leaf, z), axis=axis)
+        padded.append(leaf)
+    
+    return padded
+
+def increase_capacity_leaves(leaves, factor=2):
+    new_leaves = []
+    for leaf in leaves:
+        new_shape = (int(leaf.shape[0] * factor), *leaf.shape[1:])
+        new_leaf = numpy.zeros(new_shape, dtype=leaf.dtype)
+        new_leaf[:leaf.shape[0]] = leaf
+        new_leaves.append(new_leaf)
+    
+    return new_leaves
+
 # conversion ===================================================================
 def deep_list_to_tuple(a):
     return map_hierarchies(lambda aa : aa, a, OutListClass=tuple)
@@ -119,6 +119,15 @@ def install_ldcad(overwrite=True):
         with zipfile.ZipFile(ldcad_offlibshadow_csl_path, 'r') as z:
             z.extractall(ldcad_offlibshadow_path)
 
+def install_ldraw_index():
+    print('='*80)
+    print('Indexing LDraw and LDCad Shadow Libraries')
+    print('-'*80)
+    # imported here because ltron.ldraw.parts needs settings.cfg to exist
+    import ltron.ldraw.parts as ldraw_parts
+    ldraw_parts.build_indices()
+    print('Wrote index to: %s'%os.path.join(ltron_home, 'ldraw_index'))
+
 def install_collection(name, overwrite=False):
     print('='*80)
     print('Installing %s Data Collection'%name)
@@ -1,15 +1,12 @@
-import io
 import os
-import zipfile
 
-from ltron.home import get_ltron_home
-import ltron.settings as settings
 from ltron.ldraw.parts import (
     LDRAW_PARTS,
     LDRAW_PATHS,
     SHADOW_PATHS,
     get_reference_name,
     get_reference_path,
+    read_archive_lines,
     LtronReferenceException,
 )
 from ltron.ldraw.commands import (
@@ -22,15 +19,6 @@ from ltron.ldraw.commands import (
 )
 from ltron.ldraw.exceptions import LDrawException
 
-ldraw_zip_path = os.path.join(get_ltron_home(), 'complete.zip')
-ldraw_zip = zipfile.ZipFile(ldraw_zip_path, 'r')
-
-shadow_zip_path = os.path.join(settings.paths['ldcad'], 'seeds', 'shadow.sf')
-shadow_zip = zipfile.ZipFile(shadow_zip_path, 'r')
-offlib_csl_path = 'offLib/offLibShadow.csl'
-offlib_csl = zipfile.ZipFile(
-    io.BytesIO(shadow_zip.open(offlib_csl_path).read()))
-
 #dat_cache = {}
 shared_reference_table = {'ldraw':{}, 'shadow':{}}
 
@@ -48,12 +36,10 @@ class LDrawDocument:
         
         if shadow:
             zipped = reference_name in SHADOW_PATHS
-            z = offlib_csl
         else:
             zipped = reference_name in LDRAW_PATHS
-            z = ldraw_zip
         if zipped:
-            lines = z.open(resolved_file_path).readlines()
+            lines = read_archive_lines(resolved_file_path, shadow)
             lines = [line.decode('latin-1') for line in lines]
         else:
             lines = open(
@@ -2,70 +2,233 @@ import io
 import os
 import zipfile
 import json
+import collections
 
 from ltron.exceptions import LtronException
 from ltron.home import get_ltron_home
 import ltron.settings as settings
 from ltron.ldraw.exceptions import LtronException
+from ltron.ldraw.zip_index import write_zip_index, load_zip_index
 
 def get_reference_name(path):
     reference_name = path.lower().replace('\\', '/')
     return reference_name
 
+# Nothing in this module touches the disk at import time.  The tables below
+# are filled in the first time they are accessed, either from the prebuilt
+# index written by ltron_asset_installer, or (if that is missing or stale)
+# by scanning the archives directly.
+
+class LazySet(collections.abc.Set):
+    def __init__(self, load):
+        self.load = load
+    
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+    
+    def __contains__(self, item):
+        return item in self.load()
+    
+    def __iter__(self):
+        return iter(self.load())
+    
+    def __len__(self):
+        return len(self.load())
+
+class LazyDict(collections.abc.Mapping):
+    def __init__(self, load):
+        self.load = load
+    
+    def __getitem__(self, key):
+        return self.load()[key]
+    
+    def __contains__(self, key):
+        return key in self.load()
+    
+    def __iter__(self):
+        return iter(self.load())
+    
+    def __len__(self):
+        return len(self.load())
+
+# blacklist --------------------------------------------------------------------
+
 blacklist_path = os.path.join(get_ltron_home(), 'blacklist.json')
-with open(blacklist_path, 'r') as f:
-    blacklist_data = json.load(f)
+blacklist = set()
+blacklist_loaded = False
 
-LDRAW_BLACKLIST_ALL = set(blacklist_data['all'])
+def load_blacklist():
+    global blacklist_loaded
+    if not blacklist_loaded:
+        with open(blacklist_path, 'r') as f:
+            blacklist_data = json.load(f)
+        blacklist.update(blacklist_data['all'])
+        blacklist_loaded = True
+    return blacklist
+
+LDRAW_BLACKLIST_ALL = LazySet(load_blacklist)
+
+# ldraw ------------------------------------------------------------------------
 
 ldraw_zip_path = os.path.join(get_ltron_home(), 'complete.zip')
-ldraw_zip = zipfile.ZipFile(ldraw_zip_path, 'r')
-
-LDRAW_PARTS = set()
-LDRAW_PARTS_S = set()
-LDRAW_P = set()
-LDRAW_MODELS = set()
-LDRAW_PATHS = {}
-for info in ldraw_zip.infolist():
-    zip_path = info.filename
+
+PARTS_PARTITION = 0
+PARTS_S_PARTITION = 1
+P_PARTITION = 2
+MODELS_PARTITION = 3
+
+def classify_ldraw_path(zip_path):
     zip_folder, zip_filename = os.path.split(zip_path)
     extension = os.path.splitext(zip_filename)[1].lower()
-    if extension == '.dat' or extension == '.ldr':
-        # only files that are directly in the ldraw/parts directory
-        # (not including subfolders) belong in LDRAW_PARTS
-        if zip_folder == 'ldraw/parts':
-            relpath = zip_path.replace('ldraw/parts/', '', 1)
-            partition = LDRAW_PARTS
-        elif zip_path.startswith('ldraw/parts/'):
-            relpath = zip_path.replace('ldraw/parts/', '', 1)
-            partition = LDRAW_PARTS_S
-        elif zip_path.startswith('ldraw/p/'):
-            relpath = zip_path.replace('ldraw/p/', '', 1)
-            partition = LDRAW_P
-        elif zip_path.startswith('ldraw/models/'):
-            relpath = zip_path.replace('ldraw/models/', '', 1)
-            partition = LDRAW_MODELS
-        reference_name = get_reference_name(relpath)
-        partition.add(reference_name)
-        LDRAW_PATHS[reference_name] = zip_path
+    if extension != '.dat' and extension != '.ldr':
+        return None
+    # only files that are directly in the ldraw/parts directory
+    # (not including subfolders) belong in LDRAW_PARTS
+    if zip_folder == 'ldraw/parts':
+        relpath = zip_path.replace('ldraw/parts/', '', 1)
+        partition = PARTS_PARTITION
+    elif zip_path.startswith('ldraw/parts/'):
+        relpath = zip_path.replace('ldraw/parts/', '', 1)
+        partition = PARTS_S_PARTITION
+    elif zip_path.startswith('ldraw/p/'):
+        relpath = zip_path.replace('ldraw/p/', '', 1)
+        partition = P_PARTITION
+    elif zip_path.startswith('ldraw/models/'):
+        relpath = zip_path.replace('ldraw/models/', '', 1)
+        partition = MODELS_PARTITION
+    else:
+        return None
+    return get_reference_name(relpath), partition
+
+ldraw_tables = {}
+
+def load_ldraw_tables():
+    if not ldraw_tables:
+        partitions = {
+            PARTS_PARTITION : set(),
+            PARTS_S_PARTITION : set(),
+            P_PARTITION : set(),
+            MODELS_PARTITION : set(),
+        }
+        paths = {}
+        archive = load_zip_index('complete', ldraw_zip_path)
+        if archive is not None:
+            entries = archive.entries
+            reference_names = entries['reference_name'].tolist()
+            zip_paths = entries['zip_path'].tolist()
+            for partition, partition_set in partitions.items():
+                mask = entries['partition'] == partition
+                partition_set.update(
+                    entries['reference_name'][mask].tolist())
+            paths.update(zip(reference_names, zip_paths))
+        else:
+            archive = zipfile.ZipFile(ldraw_zip_path, 'r')
+            for info in archive.infolist():
+                classification = classify_ldraw_path(info.filename)
+                if classification is None:
+                    continue
+                reference_name, partition = classification
+                partitions[partition].add(reference_name)
+                paths[reference_name] = info.filename
+        
+        ldraw_tables['archive'] = archive
+        ldraw_tables['parts'] = partitions[PARTS_PARTITION]
+        ldraw_tables['parts_s'] = partitions[PARTS_S_PARTITION]
+        ldraw_tables['p'] = partitions[P_PARTITION]
+        ldraw_tables['models'] = partitions[MODELS_PARTITION]
+        ldraw_tables['paths'] = paths
+    
+    return ldraw_tables
+
+LDRAW_PARTS = LazySet(lambda : load_ldraw_tables()['parts'])
+LDRAW_PARTS_S = LazySet(lambda : load_ldraw_tables()['parts_s'])
+LDRAW_P = LazySet(lambda : load_ldraw_tables()['p'])
+LDRAW_MODELS = LazySet(lambda : load_ldraw_tables()['models'])
+LDRAW_PATHS = LazyDict(lambda : load_ldraw_tables()['paths'])
+
+# shadow -----------------------------------------------------------------------
 
 shadow_zip_path = os.path.join(settings.paths['ldcad'], 'seeds', 'shadow.sf')
-shadow_zip = zipfile.ZipFile(shadow_zip_path, 'r')
 offlib_csl_path = 'offLib/offLibShadow.csl'
-offlib_csl = zipfile.ZipFile(
-    io.BytesIO(shadow_zip.open(offlib_csl_path).read()))
-SHADOW_PATHS = {}
-for info in offlib_csl.infolist():
-    zip_path = info.filename
+
+def get_extracted_offlib_csl_path():
+    # ltron_asset_installer extracts shadow.sf, which leaves the csl archive
+    # on disk where it can be memory-mapped instead of held in memory
+    return os.path.join(
+        settings.paths['shadow'], 'offLib', 'offLibShadow.csl')
+
+def classify_shadow_path(zip_path):
     zip_folder, zip_filename = os.path.split(zip_path)
     extension = os.path.splitext(zip_filename)[1].lower()
-    if extension == '.dat':
-        if zip_path.startswith('parts/'):
-            relpath = zip_path.replace('parts/', '', 1)
-        elif zip_path.startswith('p/'):
-            relpath = zip_path.replace('p/', '', 1)
-        reference_name = get_reference_name(relpath)
-        SHADOW_PATHS[reference_name] = zip_path
+    if extension != '.dat':
+        return None
+    if zip_path.startswith('parts/'):
+        relpath = zip_path.replace('parts/', '', 1)
+    elif zip_path.startswith('p/'):
+        relpath = zip_path.replace('p/', '', 1)
+    else:
+        return None
+    return get_reference_name(relpath), 0
+
+shadow_tables = {}
+
+def load_shadow_tables():
+    if not shadow_tables:
+        paths = {}
+        archive = load_zip_index(
+            'offlib_shadow', get_extracted_offlib_csl_path())
+        if archive is not None:
+            paths.update(zip(
+                archive.entries['reference_name'].tolist(),
+                archive.entries['zip_path'].tolist(),
+            ))
+        else:
+            shadow_zip = zipfile.ZipFile(shadow_zip_path, 'r')
+            archive = zipfile.ZipFile(
+                io.BytesIO(shadow_zip.open(offlib_csl_path).read()))
+            for info in archive.infolist():
+                classification = classify_shadow_path(info.filename)
+                if classification is None:
+                    continue
+                reference_name, partition = classification
+                paths[reference_name] = info.filename
+        
+        shadow_tables['archive'] = archive
+        shadow_tables['paths'] = paths
+    
+    return shadow_tables
+
+SHADOW_PATHS = LazyDict(lambda : load_shadow_tables()['paths'])
+
+# archive access ---------------------------------------------------------------
+
+def read_archive_lines(zip_path, shadow):
+    '''
+    Read the raw lines of a file from either complete.zip or the LDCad shadow
+    library using whichever archive reader was set up on first access.
+    '''
+    if shadow:
+        archive = load_shadow_tables()['archive']
+    else:
+        archive = load_ldraw_tables()['archive']
+    if isinstance(archive, zipfile.ZipFile):
+        return archive.open(zip_path).readlines()
+    else:
+        return archive.readlines(zip_path)
+
+def build_indices():
+    '''
+    Write the memory-mapped indices for complete.zip and the LDCad shadow
+    library.  This is called by ltron_asset_installer after both libraries
+    have been installed.
+    '''
+    write_zip_index('complete', ldraw_zip_path, classify_ldraw_path)
+    write_zip_index(
+        'offlib_shadow',
+        get_extracted_offlib_csl_path(),
+        classify_shadow_path,
+    )
 
 class LtronReferenceException(LtronException):
     pass
@@ -87,4 +250,3 @@ def get_reference_path(path, shadow):
             #    return path
             #else:
             #    raise LtronReferenceException('Ldraw path not found: %s'%path)
-
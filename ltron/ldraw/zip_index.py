@@ -0,0 +1,171 @@
+import os
+import io
+import json
+import mmap
+import zlib
+import struct
+import zipfile
+
+import numpy
+
+from ltron.home import get_ltron_home
+from ltron.ldraw.exceptions import LDrawException
+
+ZIP_INDEX_VERSION = 1
+
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+LOCAL_HEADER_SIZE = 30
+
+class LDrawZipIndexException(LDrawException):
+    pass
+
+def get_zip_index_directory():
+    return os.path.join(get_ltron_home(), 'ldraw_index')
+
+def get_zip_index_paths(name):
+    directory = get_zip_index_directory()
+    return (
+        os.path.join(directory, '%s.npy'%name),
+        os.path.join(directory, '%s.json'%name),
+    )
+
+def archive_signature(archive_path):
+    stat = os.stat(archive_path)
+    return {
+        'version' : ZIP_INDEX_VERSION,
+        'archive_path' : os.path.abspath(archive_path),
+        'size' : stat.st_size,
+        'mtime_ns' : stat.st_mtime_ns,
+    }
+
+def write_zip_index(name, archive_path, classify):
+    '''
+    Scan a zip archive once and write a sorted table of
+    (zip_path, reference_name, partition, offset, compressed_size, method)
+    for every entry that classify(zip_path) does not reject.  classify should
+    return a (reference_name, partition) tuple or None.
+    '''
+    rows = []
+    with zipfile.ZipFile(archive_path, 'r') as z:
+        for info in z.infolist():
+            classification = classify(info.filename)
+            if classification is None:
+                continue
+            reference_name, partition = classification
+            rows.append((
+                info.filename,
+                reference_name,
+                partition,
+                info.header_offset,
+                info.compress_size,
+                info.compress_type,
+            ))
+    
+    rows.sort()
+    max_path = max([len(row[0]) for row in rows], default=1)
+    max_reference = max([len(row[1]) for row in rows], default=1)
+    dtype = numpy.dtype([
+        ('zip_path', 'U%i'%max_path),
+        ('reference_name', 'U%i'%max_reference),
+        ('partition', numpy.int8),
+        ('offset', numpy.int64),
+        ('compressed_size', numpy.int64),
+        ('method', numpy.int16),
+    ])
+    entries = numpy.array(rows, dtype=dtype)
+    
+    index_path, signature_path = get_zip_index_paths(name)
+    directory = os.path.dirname(index_path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    numpy.save(index_path, entries)
+    with open(signature_path, 'w') as f:
+        json.dump(archive_signature(archive_path), f)
+    
+    return index_path
+
+def load_zip_index(name, archive_path):
+    '''
+    Returns a ZipIndex for the named archive if a prebuilt index exists and
+    still matches the archive on disk, otherwise None.
+    '''
+    index_path, signature_path = get_zip_index_paths(name)
+    if not os.path.exists(index_path) or not os.path.exists(signature_path):
+        return None
+    if not os.path.exists(archive_path):
+        return None
+    
+    with open(signature_path, 'r') as f:
+        signature = json.load(f)
+    if signature != archive_signature(archive_path):
+        return None
+    
+    entries = numpy.load(index_path, mmap_mode='r')
+    return ZipIndex(archive_path, entries)
+
+class ZipIndex:
+    '''
+    Reads members of a zip archive directly from a memory-mapped copy of the
+    file using precomputed local header offsets, so the central directory
+    never needs to be parsed.
+    '''
+    def __init__(self, archive_path, entries):
+        self.archive_path = archive_path
+        self.entries = entries
+        self.archive_file = None
+        self.archive_map = None
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def open_archive(self):
+        if self.archive_map is None:
+            self.archive_file = open(self.archive_path, 'rb')
+            self.archive_map = mmap.mmap(
+                self.archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.archive_map
+    
+    def find(self, zip_path):
+        zip_paths = self.entries['zip_path']
+        i = numpy.searchsorted(zip_paths, zip_path)
+        if i < len(zip_paths) and zip_paths[i] == zip_path:
+            return self.entries[i]
+        raise KeyError(zip_path)
+    
+    def __contains__(self, zip_path):
+        try:
+            self.find(zip_path)
+            return True
+        except KeyError:
+            return False
+    
+    def read(self, zip_path):
+        entry = self.find(zip_path)
+        archive_map = self.open_archive()
+        offset = int(entry['offset'])
+        header = archive_map[offset:offset+LOCAL_HEADER_SIZE]
+        if header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise LDrawZipIndexException(
+                'Bad local header for %s in %s'%(zip_path, self.archive_path))
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        start = offset + LOCAL_HEADER_SIZE + name_length + extra_length
+        end = start + int(entry['compressed_size'])
+        data = archive_map[start:end]
+        method = int(entry['method'])
+        if method == zipfile.ZIP_STORED:
+            return data
+        elif method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -15)
+        else:
+            with zipfile.ZipFile(self.archive_path, 'r') as z:
+                return z.read(zip_path)
+    
+    def readlines(self, zip_path):
+        return io.BytesIO(self.read(zip_path)).readlines()
+    
+    def close(self):
+        if self.archive_map is not None:
+            self.archive_map.close()
+            self.archive_file.close()
+            self.archive_map = None
+            self.archive_file = None
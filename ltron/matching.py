@@ -158,62 +158,88 @@ def find_matches_under_transform(
     radius=0.01,
     min_matches=-1,
 ):
-    transformed_a = numpy.matmul(a_to_b, assembly_a['pose'])
-    
-    # Compute the closeset points.
-    pos_a = transformed_a[:,:3,3]
+    # Compute the closeset points, only moving the positions of the bricks
+    # that exist.
+    instances_a = numpy.nonzero(assembly_a['shape'])[0]
+    pos_a = (
+        assembly_a['pose'][instances_a,:3,3] @ a_to_b[:3,:3].T +
+        a_to_b[:3,3]
+    )
     matches = kdtree.query_ball_point(pos_a, radius)
     
     # If the number of matches is less than the current best
     # skip the validation step.
-    potential_matches = sum(
-        1 for s, m in zip(assembly_a['shape'], matches)
-        if len(m) and s != 0
-    )
+    potential_matches = sum(1 for m in matches if len(m))
     if potential_matches <= min_matches:
         return []
     
     # Validate the matches.
     valid_matches = validate_matches(
-        assembly_a, assembly_b, matches, a_to_b, part_names)
+        assembly_a,
+        assembly_b,
+        matches,
+        a_to_b,
+        part_names,
+        instances_a=instances_a,
+    )
     
     return valid_matches
 
-def validate_matches(assembly_a, assembly_b, matches, a_to_b, part_names):
+def validate_matches(
+    assembly_a,
+    assembly_b,
+    matches,
+    a_to_b,
+    part_names,
+    instances_a=None,
+):
     # Ensure that shapes match, colors match, poses match and that each brick
-    # is only matched to one other.
+    # is only matched to one other.  matches[i] lists the candidates for
+    # brick instances_a[i] (or brick i if instances_a is not specified).
+    # The shape, color and pose tests are run on all of the candidate pairs
+    # at once, then the pairs that pass are accepted in the same order as
+    # looping over each brick and its candidates.
+    if instances_a is None:
+        instances_a = numpy.arange(len(matches), dtype=numpy.int64)
+    counts = numpy.array([len(m) for m in matches], dtype=numpy.int64)
+    a = numpy.repeat(instances_a, counts)
+    b = numpy.concatenate(
+        [numpy.zeros(0, dtype=numpy.int64)] +
+        [numpy.array(m, dtype=numpy.int64) for m in matches]
+    )
+    
+    shape_a = assembly_a['shape'][a]
+    shape_b = assembly_b['shape'][b]
+    color_a = assembly_a['color'][a]
+    color_b = assembly_b['color'][b]
+    valid = (
+        (shape_a == shape_b) & (shape_a != 0) &
+        (color_a == color_b) & (color_a != 0)
+    )
+    a = a[valid]
+    b = b[valid]
+    shape_a = shape_a[valid]
+    
+    transformed_poses_a = numpy.matmul(a_to_b, assembly_a['pose'][a])
+    poses_b = assembly_b['pose'][b]
+    pose_match = numpy.zeros(a.shape[0], dtype=bool)
+    for s in numpy.unique(shape_a).tolist():
+        same_shape = shape_a == s
+        pose_match[same_shape] = brick_pose_match_under_symmetry(
+            part_names[s],
+            transformed_poses_a[same_shape],
+            poses_b[same_shape],
+        )
+    
     valid_matches = set()
     matched_a = set()
     matched_b = set()
-    for a, a_matches in enumerate(matches):
-        if a in matched_a:
+    for aa, bb in zip(a[pose_match].tolist(), b[pose_match].tolist()):
+        if aa in matched_a or bb in matched_b:
             continue
-        
-        for b in a_matches:
-            if b in matched_b:
-                continue
-            
-            shape_a = assembly_a['shape'][a]
-            shape_b = assembly_b['shape'][b]
-            if shape_a != shape_b or shape_a == 0 or shape_b == 0:
-                continue
-            
-            color_a = assembly_a['color'][a]
-            color_b = assembly_b['color'][b]
-            if color_a != color_b or color_a == 0 or color_b == 0:
-                continue
-            
-            transformed_pose_a = a_to_b @ assembly_a['pose'][a]
-            pose_b = assembly_b['pose'][b]
-            if not brick_pose_match_under_symmetry(
-                part_names[shape_a], transformed_pose_a, pose_b
-            ):
-                continue
-            
-            valid_matches.add((a,b))
-            matched_a.add(a)
-            matched_b.add(b)
-            break
+        valid_matches.add((aa,bb))
+        matched_a.add(aa)
+        matched_b.add(bb)
     
     return valid_matches
 
@@ -1,6 +1,9 @@
 import random
 import math
 import copy
+import hashlib
+import weakref
+import collections
 from bisect import insort
 
 import numpy
@@ -75,8 +78,156 @@ def modular_distance(a,b,m):
     d2 = abs(b+m-a)
     return min(d0, d1, d2)
 
-def search_camera_space(env, component_name, state, condition, max_steps):
+class CameraVisibilityOracle:
+    '''
+    Renders a set of sensor components (usually the snap and mask renders)
+    from candidate positions of a ControlledAzimuthalViewpointComponent.
+    Only the viewpoint and the requested components are touched, and they
+    are restored afterward, so no env.get_state/set_state round trip is
+    needed.
+
+    Renders are cached by (scene signature, viewpoint, components, camera
+    position, camera center).  The signature hashes the instances, poses,
+    colors and visibility of the rendered scenes, so entries stay valid
+    until the scenes change and repeated queries across planner edges reuse
+    them.
+    '''
+    def __init__(self, env, max_size=256):
+        self.env = env
+        self.max_size = max_size
+        self.renders = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def scene_signature(self, render_components):
+        scenes = []
+        for name in render_components:
+            scene = self.env.components[name].scene_component.brick_scene
+            if all(scene is not s for s in scenes):
+                scenes.append(scene)
+        
+        h = hashlib.sha1()
+        for scene in scenes:
+            instance_ids = scene.instances.get_instance_ids()
+            h.update(instance_ids.tobytes())
+            h.update(scene.instances.get_poses(instance_ids).tobytes())
+            for i in instance_ids.tolist():
+                instance = scene.instances[i]
+                h.update(('%s,%s,%i;'%(
+                    instance.brick_shape,
+                    instance.color,
+                    scene.instance_hidden(instance),
+                )).encode('utf-8'))
+            h.update(b'|')
         
+        return h.hexdigest()
+    
+    def observe(
+        self,
+        viewpoint_name,
+        position,
+        render_components,
+        signature=None,
+    ):
+        '''
+        Returns a dictionary mapping each of render_components to its
+        render from position, an (azimuth, elevation, distance, frame)
+        tuple as used by search_camera_space.
+        '''
+        render_components = tuple(render_components)
+        if signature is None:
+            signature = self.scene_signature(render_components)
+        
+        # the render also depends on the center the camera orbits, which is
+        # the live center unless the frame flag is set
+        viewpoint = self.env.components[viewpoint_name]
+        if position[-1]:
+            center = viewpoint.compute_center()
+        else:
+            center = viewpoint.center
+        key = (
+            signature,
+            viewpoint_name,
+            render_components,
+            tuple(position[:3]),
+            tuple(float(c) for c in center),
+        )
+        if key in self.renders:
+            self.hits += 1
+            self.renders.move_to_end(key)
+            return self.renders[key]
+        
+        self.misses += 1
+        old_position = viewpoint.position
+        old_center = viewpoint.center
+        old_observations = {
+            name:self.env.components[name].observation
+            for name in render_components
+        }
+        
+        viewpoint.position = list(position[:3])
+        viewpoint.center = center
+        viewpoint.set_camera()
+        observation = {}
+        for name in render_components:
+            component = self.env.components[name]
+            component.update_observation()
+            observation[name] = component.observation
+        
+        viewpoint.position = old_position
+        viewpoint.center = old_center
+        viewpoint.set_camera()
+        for name, component_observation in old_observations.items():
+            self.env.components[name].observation = component_observation
+        
+        self.renders[key] = observation
+        while len(self.renders) > self.max_size:
+            self.renders.popitem(last=False)
+        
+        return observation
+
+visibility_oracles = weakref.WeakKeyDictionary()
+
+def get_visibility_oracle(env):
+    if env not in visibility_oracles:
+        visibility_oracles[env] = CameraVisibilityOracle(env)
+    return visibility_oracles[env]
+
+def search_camera_space(
+    env,
+    component_name,
+    state,
+    condition,
+    max_steps,
+    render_components=None,
+):
+    '''
+    Breadth-first search over camera positions for one where condition is
+    met.  If render_components is given, condition only looks at those
+    components, and candidate positions are rendered with the env's
+    CameraVisibilityOracle, which assumes the env is currently in state.
+    Otherwise every candidate is tested by setting the full env state.
+    '''
+    if render_components is not None:
+        oracle = get_visibility_oracle(env)
+        signature = oracle.scene_signature(render_components)
+        def test_position(position):
+            observation = oracle.observe(
+                component_name,
+                position,
+                render_components,
+                signature=signature,
+            )
+            return condition(observation)
+        def reset_state():
+            pass
+    else:
+        def test_position(position):
+            return test_camera_position(
+                env, position, component_name, state, condition)
+        def reset_state():
+            env.set_state(state)
+    
     # BFS
     component = env.components[component_name]
     current_position = tuple(component.position) + (0,)
@@ -96,12 +247,10 @@ def search_camera_space(env, component_name, state, condition, max_steps):
         distance, *position = frontier.pop(0)
         position = tuple(position)
         
-        test_result, test_info = test_camera_position(
-            env, position, component_name, state, condition
-        )
+        test_result, test_info = test_position(position)
         if test_result:
             # reset state
-            env.set_state(state)
+            reset_state()
             return position, test_info
         
         for i in range(4):
@@ -131,7 +280,7 @@ def search_camera_space(env, component_name, state, condition, max_steps):
                     insort(frontier, new_distance_position)
     
     # reset state
-    env.set_state(state)
+    reset_state()
     return None, None
 
 def test_camera_position(env, position, component_name, state, condition):
@@ -166,8 +315,17 @@ def plan_camera_to_see_snaps(
     )
     start_camera_position = (
         tuple(state[viewpoint_component]['position']) + (0,))
+    render_components = [pos_snap_component, neg_snap_component]
+    if mask_component is not None:
+        render_components.append(mask_component)
     end_camera_position, visible_snaps = search_camera_space(
-        env, viewpoint_component, state, condition, float('inf'))
+        env,
+        viewpoint_component,
+        state,
+        condition,
+        float('inf'),
+        render_components=render_components,
+    )
     if end_camera_position is None or visible_snaps is None:
         return None, None, None
     
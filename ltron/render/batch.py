@@ -0,0 +1,487 @@
+import math
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+
+import numpy
+
+from ltron.render.damage import project_bbox_rects
+
+# Rendering many scenes through one process:
+#
+# A BatchRenderServer runs in its own process and owns a single render
+# backend (one OpenGL context with one copy of every mesh and material).
+# Environment workers replace their RenderEnvironment with a
+# BatchRenderEnvironment, which keeps the instance and camera state locally
+# and sends it to the server through a BatchRenderClient whenever an image is
+# needed.  The server collects the requests that arrive together from all of
+# its clients, renders them into one tiled frame buffer and reads it back
+# once.
+#
+# The 'stub' backend needs no OpenGL at all.  It draws the screen-space
+# bounding rectangle of each instance, which makes it possible to test
+# everything except the actual rasterization on a CPU.
+
+def perspective_projection(field_of_view, aspect_ratio, near_clip, far_clip):
+    '''
+    The standard OpenGL perspective matrix, the same as
+    splendor.camera.projection_matrix.
+    '''
+    f = 1. / math.tan(field_of_view / 2.)
+    return numpy.array([
+        [f / aspect_ratio, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0,
+            (far_clip + near_clip) / (near_clip - far_clip),
+            2 * far_clip * near_clip / (near_clip - far_clip)],
+        [0, 0, -1, 0],
+    ])
+
+default_projection = perspective_projection(math.radians(60.), 1., 10, 50000)
+
+# render jobs ==================================================================
+
+def make_render_job(
+    instances,
+    view_matrix,
+    projection,
+    width,
+    height,
+    mode='color',
+):
+    '''
+    A render job describes one image: the visible instances as a list of
+    (instance_id, mesh_name, color_index, transform, bbox_vertices) tuples,
+    the camera and the image size.  mode is 'color' for an RGB uint8 image
+    or 'mask' for an integer image of instance ids.
+    '''
+    assert mode in ('color', 'mask')
+    return {
+        'instances' : instances,
+        'view_matrix' : view_matrix,
+        'projection' : projection,
+        'width' : width,
+        'height' : height,
+        'mode' : mode,
+    }
+
+# backends =====================================================================
+
+class StubRenderBackend:
+    '''
+    A CPU backend that draws the projected bounding rectangle of each
+    instance, far to near, with its color (or its instance id in mask mode).
+    '''
+    def __init__(self, background_color=(102,102,102), **kwargs):
+        self.background_color = numpy.array(background_color, dtype=numpy.uint8)
+        self.num_batches = 0
+    
+    def render_batch(self, slots, jobs):
+        self.num_batches += 1
+        return [self.render_job(job) for job in jobs]
+    
+    def render_job(self, job):
+        height, width = job['height'], job['width']
+        if job['mode'] == 'color':
+            image = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+            image[:] = self.background_color
+        else:
+            image = numpy.zeros((height, width), dtype=numpy.int64)
+        
+        if not job['instances']:
+            return image
+        
+        instance_ids, mesh_names, colors, transforms, bboxes = zip(
+            *job['instances'])
+        bboxes = numpy.stack(bboxes)
+        rects = project_bbox_rects(
+            bboxes, job['view_matrix'], job['projection'], width, height)
+        depth = (job['view_matrix'] @ bboxes)[:,2].max(axis=-1)
+        for i in numpy.argsort(depth).tolist():
+            y0, x0, y1, x1 = rects[i]
+            y0, y1 = (int(numpy.clip(y, 0, height)) for y in (y0, y1))
+            x0, x1 = (int(numpy.clip(x, 0, width)) for x in (x0, x1))
+            if job['mode'] == 'color':
+                image[y0:y1, x0:x1] = self.color_byte(colors[i])
+            else:
+                image[y0:y1, x0:x1] = instance_ids[i]
+        
+        return image
+    
+    def color_byte(self, color_index):
+        # a deterministic stand-in for the LDraw color table
+        return (
+            (color_index * 67) % 256,
+            (color_index * 131) % 256,
+            (color_index * 197) % 256,
+        )
+
+class SplendorRenderBackend:
+    '''
+    Renders a batch of jobs with one SplendorRender.  Each job is drawn into
+    its own cell of a grid in a single frame buffer using a viewport and
+    scissor, and the whole frame buffer is read back once per batch.  The
+    instances of every slot (client scene) are kept in the renderer between
+    batches and only updated when they change.
+    '''
+    def __init__(
+        self,
+        asset_paths=None,
+        opengl_mode='egl',
+        egl_device=None,
+        load_scene='front_light',
+        cell_width=256,
+        cell_height=256,
+        grid_width=4,
+        grid_height=4,
+    ):
+        import splendor.contexts.egl as egl
+        from splendor.core import SplendorRender
+        from splendor.frame_buffer import FrameBufferWrapper
+        import splendor.masks as masks
+        from ltron.bricks.brick_color import BrickColor
+        from ltron.render.environment import default_asset_paths
+        self.masks = masks
+        self.BrickColor = BrickColor
+        
+        if asset_paths is None:
+            asset_paths = default_asset_paths
+        assert opengl_mode == 'egl'
+        egl.initialize_plugin()
+        egl.initialize_device(device=egl_device)
+        self.renderer = SplendorRender(asset_paths)
+        if load_scene is not None:
+            self.renderer.load_scene(load_scene)
+        
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.frame_buffer = FrameBufferWrapper(
+            cell_width * grid_width, cell_height * grid_height, True)
+        self.mask_frame_buffer = FrameBufferWrapper(
+            cell_width * grid_width, cell_height * grid_height, False)
+        self.slot_instances = {}
+    
+    def sync_slot(self, slot, instances):
+        '''
+        Make the renderer's instances for slot match instances and return
+        their names.
+        '''
+        old_instances = self.slot_instances.setdefault(slot, {})
+        new_instances = {}
+        for instance_id, mesh_name, color_index, transform, _ in instances:
+            name = '%s:%i'%(slot, instance_id)
+            color_name = str(color_index)
+            if not self.renderer.mesh_exists(mesh_name):
+                self.renderer.load_mesh(
+                    mesh_name,
+                    mesh_asset=mesh_name,
+                    scale=1.0,
+                    color_mode='flat_color',
+                )
+            if not self.renderer.material_exists(color_name):
+                self.renderer.load_material(
+                    color_name,
+                    **self.BrickColor(color_index).splendor_material_args(),
+                )
+            
+            if name not in old_instances:
+                self.renderer.add_instance(
+                    name,
+                    mesh_name=mesh_name,
+                    material_name=color_name,
+                    transform=transform,
+                    mask_color=self.masks.color_index_to_byte(
+                        instance_id)/255.,
+                )
+            else:
+                old_mesh, old_color, old_transform = old_instances[name]
+                if old_mesh != mesh_name:
+                    self.renderer.set_instance_mesh(name, mesh_name)
+                if old_color != color_name:
+                    self.renderer.set_instance_material(name, color_name)
+                if not numpy.array_equal(old_transform, transform):
+                    self.renderer.set_instance_transform(name, transform)
+            new_instances[name] = (mesh_name, color_name, transform)
+        
+        for name in old_instances.keys() - new_instances.keys():
+            self.renderer.remove_instance(name)
+        self.slot_instances[slot] = new_instances
+        
+        return list(new_instances.keys())
+    
+    def render_batch(self, slots, jobs):
+        results = [None for _ in jobs]
+        cells = self.grid_width * self.grid_height
+        for mode, frame_buffer in (
+            ('color', self.frame_buffer),
+            ('mask', self.mask_frame_buffer),
+        ):
+            mode_jobs = [i for i, job in enumerate(jobs) if job['mode'] == mode]
+            for start in range(0, len(mode_jobs), cells):
+                self.render_cells(
+                    frame_buffer, slots, jobs, mode_jobs[start:start+cells],
+                    results)
+        
+        return results
+    
+    def render_cells(self, frame_buffer, slots, jobs, job_indices, results):
+        frame_buffer.enable()
+        full_height = self.cell_height * self.grid_height
+        regions = []
+        for cell, i in enumerate(job_indices):
+            job = jobs[i]
+            assert job['width'] <= self.cell_width
+            assert job['height'] <= self.cell_height
+            names = self.sync_slot(slots[i], job['instances'])
+            x = (cell % self.grid_width) * self.cell_width
+            y = (cell // self.grid_width) * self.cell_height
+            self.renderer.viewport_scissor(x, y, job['width'], job['height'])
+            self.renderer.set_view_matrix(job['view_matrix'])
+            self.renderer.set_projection(job['projection'])
+            if job['mode'] == 'color':
+                self.renderer.color_render(instances=names)
+            else:
+                background_color = self.renderer.get_background_color()
+                self.renderer.set_background_color((0,0,0))
+                self.renderer.mask_render(instances=names)
+                self.renderer.set_background_color(background_color)
+            # OpenGL rows start at the bottom, image rows at the top
+            top = full_height - y - job['height']
+            regions.append((i, top, x, job['height'], job['width']))
+        
+        pixels = frame_buffer.read_pixels()
+        for i, top, x, height, width in regions:
+            image = pixels[top:top+height, x:x+width]
+            if jobs[i]['mode'] == 'mask':
+                image = self.masks.color_byte_to_index(image)
+            else:
+                image = image.copy()
+            results[i] = image
+
+render_backends = {
+    'stub' : StubRenderBackend,
+    'splendor' : SplendorRenderBackend,
+}
+
+# server =======================================================================
+
+class BatchRenderServer:
+    '''
+    Serves render requests from a set of client connections with one
+    backend.  After the first request of a round arrives, the server waits
+    up to batch_timeout seconds for every other client to send one too, then
+    renders them all in one batch.
+    '''
+    def __init__(
+        self, connections, backend='stub', batch_timeout=0.005, **backend_args
+    ):
+        self.connections = list(connections)
+        self.backend = render_backends[backend](**backend_args)
+        self.batch_timeout = batch_timeout
+    
+    def collect_requests(self):
+        requests = {}
+        open_connections = list(self.connections)
+        deadline = None
+        while open_connections:
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(deadline - time.time(), 0.)
+            ready = wait(open_connections, timeout=timeout)
+            if not ready:
+                break
+            for connection in ready:
+                open_connections.remove(connection)
+                try:
+                    requests[connection] = connection.recv()
+                except EOFError:
+                    self.connections.remove(connection)
+            if requests and deadline is None:
+                deadline = time.time() + self.batch_timeout
+        
+        return requests
+    
+    def serve_forever(self):
+        while self.connections:
+            requests = self.collect_requests()
+            if not requests:
+                continue
+            connections = []
+            slots = []
+            jobs = []
+            for connection, (slot, job) in requests.items():
+                connections.append(connection)
+                slots.append(slot)
+                jobs.append(job)
+            images = self.backend.render_batch(slots, jobs)
+            for connection, image in zip(connections, images):
+                connection.send(image)
+
+def run_batch_render_server(connections, backend, backend_args):
+    server = BatchRenderServer(connections, backend=backend, **backend_args)
+    server.serve_forever()
+
+def start_batch_render_server(num_clients, backend='stub', **backend_args):
+    '''
+    Start a BatchRenderServer in a new process and return the process and a
+    list of num_clients BatchRenderClients.  The clients can be passed to
+    worker processes (for example through the env constructors given to
+    async_ltron).
+    '''
+    context = multiprocessing.get_context('spawn')
+    server_connections = []
+    clients = []
+    for i in range(num_clients):
+        server_connection, client_connection = context.Pipe()
+        server_connections.append(server_connection)
+        clients.append(BatchRenderClient(client_connection, client_id=i))
+    
+    process = context.Process(
+        target=run_batch_render_server,
+        args=(server_connections, backend, backend_args),
+        daemon=True,
+    )
+    process.start()
+    
+    return process, clients
+
+class BatchRenderClient:
+    def __init__(self, connection, client_id=0):
+        self.connection = connection
+        self.client_id = client_id
+        self.num_scenes = 0
+    
+    def new_slot(self):
+        slot = '%i.%i'%(self.client_id, self.num_scenes)
+        self.num_scenes += 1
+        return slot
+    
+    def render(self, slot, job):
+        self.connection.send((slot, job))
+        return self.connection.recv()
+
+# client side render environment ===============================================
+
+class BatchRenderEnvironment:
+    '''
+    Stands in for RenderEnvironment in a BrickScene whose images are
+    rendered by a BatchRenderServer.  It keeps track of the camera and of
+    which instances are hidden, and builds render jobs from the scene's
+    instances when render_image is called.  It does not need OpenGL.
+    
+    Use it with BrickScene(renderable=True, render_args={
+    'opengl_mode':'batch', 'render_client':client}).
+    '''
+    def __init__(self, render_client, **kwargs):
+        self.render_client = render_client
+        self.slot = render_client.new_slot()
+        self.window = None
+        self.renderer = self
+        self.brick_instances = {}
+        self.hidden_instances = set()
+        self.view_matrix = numpy.eye(4)
+        self.projection = default_projection
+    
+    # assets
+    def load_brick_mesh(self, brick_shape):
+        pass
+    
+    def load_color_material(self, color):
+        pass
+    
+    def clear_meshes(self):
+        pass
+    
+    def clear_materials(self):
+        pass
+    
+    def clear_image_lights(self):
+        pass
+    
+    # instances
+    def add_instance(self, brick_instance):
+        self.brick_instances[str(brick_instance)] = brick_instance
+    
+    def update_instance(self, brick_instance):
+        self.brick_instances[str(brick_instance)] = brick_instance
+    
+    def remove_instance(self, brick_instance):
+        self.brick_instances.pop(str(brick_instance), None)
+        self.hidden_instances.discard(str(brick_instance))
+    
+    def clear_instances(self):
+        self.brick_instances.clear()
+        self.hidden_instances.clear()
+    
+    def hide_instance(self, instance_name):
+        self.hidden_instances.add(str(instance_name))
+    
+    def show_instance(self, instance_name):
+        self.hidden_instances.discard(str(instance_name))
+    
+    def instance_hidden(self, brick_instance):
+        return str(brick_instance) in self.hidden_instances
+    
+    def get_all_brick_instances(self):
+        return list(self.brick_instances.keys())
+    
+    # camera
+    def get_view_matrix(self):
+        return self.view_matrix
+    
+    def set_view_matrix(self, view_matrix):
+        self.view_matrix = numpy.array(view_matrix)
+    
+    def get_projection(self):
+        return self.projection
+    
+    def set_projection(self, projection):
+        self.projection = numpy.array(projection)
+    
+    def viewport_scissor(self, *args, **kwargs):
+        pass
+    
+    # rendering
+    def make_job(self, mode, width, height, instances=None):
+        if instances is None:
+            instances = self.brick_instances.keys()
+        job_instances = []
+        for name in instances:
+            name = str(name)
+            if name in self.hidden_instances:
+                continue
+            brick_instance = self.brick_instances[name]
+            job_instances.append((
+                int(brick_instance),
+                brick_instance.brick_shape.mesh_name,
+                int(brick_instance.color),
+                brick_instance.transform,
+                brick_instance.bbox_vertices(),
+            ))
+        return make_render_job(
+            job_instances,
+            self.view_matrix,
+            self.projection,
+            width,
+            height,
+            mode=mode,
+        )
+    
+    def render_image(self, mode, width, height, instances=None):
+        '''
+        Render the scene on the server and return an RGB uint8 image
+        (mode='color') or an image of instance ids (mode='mask').
+        '''
+        job = self.make_job(mode, width, height, instances=instances)
+        return self.render_client.render(self.slot, job)
+    
+    def color_render(self, *args, **kwargs):
+        raise NotImplementedError(
+            'Batch rendered scenes must use render_image')
+    
+    def mask_render(self, *args, **kwargs):
+        raise NotImplementedError(
+            'Batch rendered scenes must use render_image')
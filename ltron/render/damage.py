@@ -0,0 +1,113 @@
+import numpy
+
+def project_bbox_rects(bbox_vertices, view_matrix, projection, width, height):
+    '''
+    Projects (N,4,8) world-space bounding box corners through the camera and
+    returns an (N,4) array of (y0, x0, y1, x1) pixel rectangles covering
+    them, in image coordinates with row 0 at the top.  Boxes that cross
+    behind the camera cover the whole image.  Rectangles are not clipped.
+    '''
+    clip = projection @ view_matrix @ bbox_vertices
+    w = clip[:,3]
+    behind = numpy.any(w <= 1e-6, axis=-1)
+    w = numpy.where(w <= 1e-6, 1., w)
+    x = (clip[:,0] / w + 1.) * 0.5 * width
+    y = (1. - clip[:,1] / w) * 0.5 * height
+    rects = numpy.stack((
+        numpy.floor(numpy.min(y, axis=-1)),
+        numpy.floor(numpy.min(x, axis=-1)),
+        numpy.ceil(numpy.max(y, axis=-1)),
+        numpy.ceil(numpy.max(x, axis=-1)),
+    ), axis=-1)
+    rects[behind] = (0, 0, height, width)
+    
+    return rects
+
+class DamageTracker:
+    '''
+    Tracks which parts of an image rendered from a BrickScene can have
+    changed since the previous frame.  Each call to update compares the
+    camera and the pose, visibility, color and shape of every instance with
+    the previous call.  If the camera moved it returns None, meaning that
+    the whole image may have changed.  Otherwise it returns a list of
+    (y0, x0, y1, x1) pixel rectangles.  These cover the old and new
+    positions of every instance that changed, padded by margin pixels to
+    allow for anti-aliasing, and clipped to the image.
+    '''
+    def __init__(self, scene, width, height, margin=2):
+        self.scene = scene
+        self.width = width
+        self.height = height
+        self.margin = margin
+        self.reset()
+    
+    def reset(self):
+        self.previous_camera = None
+        self.previous_instances = {}
+    
+    def get_instance_states(self):
+        scene = self.scene
+        instance_ids = scene.instances.get_instance_ids()
+        poses = scene.instances.get_poses(instance_ids)
+        states = {}
+        for i, pose in zip(instance_ids.tolist(), poses):
+            instance = scene.instances[i]
+            states[i] = (
+                pose,
+                scene.instance_hidden(instance),
+                str(instance.color),
+                instance.brick_shape,
+            )
+        
+        return states
+    
+    def update(self):
+        view_matrix = numpy.array(self.scene.get_view_matrix())
+        projection = numpy.array(self.scene.get_projection())
+        camera = (view_matrix, projection)
+        instances = self.get_instance_states()
+        
+        previous_camera = self.previous_camera
+        previous_instances = self.previous_instances
+        self.previous_camera = camera
+        self.previous_instances = instances
+        
+        if previous_camera is None or not (
+            numpy.array_equal(previous_camera[0], view_matrix) and
+            numpy.array_equal(previous_camera[1], projection)
+        ):
+            return None
+        
+        # collect the old and new bounding boxes of everything that changed
+        # and is visible before or after the change
+        bboxes = []
+        for i in set(previous_instances) | set(instances):
+            old = previous_instances.get(i, None)
+            new = instances.get(i, None)
+            if old is not None and new is not None and (
+                old[1:] == new[1:] and numpy.array_equal(old[0], new[0])
+            ):
+                continue
+            for state in old, new:
+                if state is not None and not state[1]:
+                    pose, hidden, color, brick_shape = state
+                    bboxes.append(pose @ brick_shape.bbox_vertices)
+        
+        if not bboxes:
+            return []
+        
+        rects = project_bbox_rects(
+            numpy.stack(bboxes),
+            view_matrix,
+            projection,
+            self.width,
+            self.height,
+        )
+        rects[:,:2] -= self.margin
+        rects[:,2:] += self.margin
+        rects[:,[0,2]] = numpy.clip(rects[:,[0,2]], 0, self.height)
+        rects[:,[1,3]] = numpy.clip(rects[:,[1,3]], 0, self.width)
+        rects = rects.astype(numpy.int64)
+        visible = (rects[:,2] > rects[:,0]) & (rects[:,3] > rects[:,1])
+        
+        return [tuple(rect) for rect in rects[visible].tolist()]
@@ -1,5 +1,7 @@
 import math
 
+import numpy
+
 import splendor.contexts.egl as egl
 import splendor.contexts.glut as glut
 from splendor.core import SplendorRender
@@ -17,6 +19,25 @@ default_projection = camera.projection_matrix(
 
 default_asset_paths = 'ltron_assets,default_assets'
 
+# snap renders can pack the instance id and snap id of each pixel into the
+# 24 bit mask color, with the snap id in the low SNAP_ID_BITS bits
+SNAP_ID_BITS = 12
+MAX_PACKED_SNAP_ID = 2**SNAP_ID_BITS - 1
+MAX_PACKED_INSTANCE_ID = 2**(24 - SNAP_ID_BITS) - 1
+
+def pack_snap_id(instance_id, snap_id):
+    return (instance_id << SNAP_ID_BITS) | snap_id
+
+def unpack_snap_ids(packed_ids):
+    '''
+    Converts an integer image of packed ids into an (...,2) array of
+    (instance id, snap id).
+    '''
+    return numpy.stack(
+        (packed_ids >> SNAP_ID_BITS, packed_ids & MAX_PACKED_SNAP_ID),
+        axis=-1,
+    )
+
 class RenderEnvironment:
     
     # initialization ===========================================================
@@ -250,6 +271,28 @@ class RenderEnvironment:
         self.renderer.mask_render(instances=snap_names, **kwargs)
         self.renderer.set_background_color(background_color)
     
+    def snap_render_packed_id(self, snaps=None, **kwargs):
+        '''
+        Renders the instance id and snap id of every snap in a single pass,
+        packed with pack_snap_id.  Returns False without rendering anything
+        if an id is too large to pack, in which case the caller should use
+        snap_render_instance_id and snap_render_snap_id instead.
+        '''
+        if snaps is None:
+            snaps = self.get_all_snap_instances()
+        
+        if not self.set_snap_masks_to_packed_id(snaps):
+            return False
+        
+        snap_names = [str(snap) for snap in snaps]
+        
+        background_color = self.renderer.get_background_color()
+        self.renderer.set_background_color((0,0,0))
+        self.renderer.mask_render(instances=snap_names, **kwargs)
+        self.renderer.set_background_color(background_color)
+        
+        return True
+    
     def set_snap_masks_to_instance_id(self, snaps):
         if snaps is None:
             snaps = self.get_all_snap_instances()
@@ -264,6 +307,22 @@ class RenderEnvironment:
             str(snap):int(snap.snap_style) for snap in snaps}
         self.renderer.set_instance_masks_to_instance_indices(mask_lookup)
     
+    def set_snap_masks_to_packed_id(self, snaps):
+        if snaps is None:
+            snaps = self.get_all_snap_instances()
+        mask_lookup = {}
+        for snap in snaps:
+            instance_id = int(snap.brick_instance)
+            snap_id = int(snap.snap_style)
+            if (instance_id > MAX_PACKED_INSTANCE_ID or
+                snap_id > MAX_PACKED_SNAP_ID
+            ):
+                return False
+            mask_lookup[str(snap)] = pack_snap_id(instance_id, snap_id)
+        self.renderer.set_instance_masks_to_instance_indices(mask_lookup)
+        
+        return True
+    
     def __getattr__(self, attr):
         try:
             return getattr(self.renderer, attr)
@@ -1,9 +1,11 @@
+import os
+
 import numpy
 
 import tqdm
 
-from ltron.hierarchy import stack_numpy_hierarchies
-from ltron.gym.rollout_storage import RolloutStorage
+from ltron.hierarchy import stack_numpy_hierarchies, index_hierarchy
+from ltron.gym.rollout_storage import RolloutStorage, MemmapRolloutStorage
 
 '''
 def default_sampler_fn(distribution, rollout_mode='sample'):
@@ -41,23 +43,33 @@ def rollout(
     store_actions=True,
     store_distributions=True,
     store_rewards=True,
+    storage_directory=None,
     #rollout_mode='sample',
 ):
     
     # initialize storage for observations, actions, rewards and distributions
+    # if storage_directory is specified, the data is written to memory-mapped
+    # files there instead of being held in memory
     b = env.num_envs
+    def make_storage(key):
+        if storage_directory is None:
+            return RolloutStorage(b)
+        else:
+            return MemmapRolloutStorage(
+                b, os.path.join(storage_directory, key))
+    
     storage = {}
     if store_observations:
-        storage['observation'] = RolloutStorage(b)
+        storage['observation'] = make_storage('observation')
     if store_actions:
-        storage['action'] = RolloutStorage(b)
+        storage['action'] = make_storage('action')
     if store_distributions:
-        storage['distribution'] = RolloutStorage(b)
+        storage['distribution'] = make_storage('distribution')
     if store_rewards:
-        storage['reward'] = RolloutStorage(b)
+        storage['reward'] = make_storage('reward')
     
     assert len(storage)
-    first_key, first_storage = next(iter(storage.items()))
+    first_storage = next(iter(storage.values()))
     
     # reset
     observation = env.reset()
@@ -116,11 +128,115 @@ def rollout(
         progress.n = episodes
         progress.refresh()
     
-    combined_storage = first_storage
-    for key, s in storage.items():
-        if key == first_key:
-            continue
-        
+    # Combining the storages produces a plain RolloutStorage that reads from
+    # the same memory-mapped files but cannot flush them, so each storage is
+    # flushed first.  Use load_rollout to reopen the result later.
+    if storage_directory is not None:
+        for s in storage.values():
+            s.flush()
+    
+    return combine_storage(storage)
+
+def combine_storage(storage):
+    storage = list(storage.values())
+    combined_storage = storage[0]
+    for s in storage[1:]:
         combined_storage = combined_storage | s
     
     return combined_storage
+
+def load_rollout(storage_directory, mode='r'):
+    '''
+    Reopen the storage written by rollout(..., storage_directory=...).
+    Each stored key is loaded with MemmapRolloutStorage.load and the keys
+    are combined as rollout does.
+    '''
+    storage_directory = os.path.expanduser(storage_directory)
+    storage = {}
+    for key in 'observation', 'action', 'distribution', 'reward':
+        directory = os.path.join(storage_directory, key)
+        if os.path.exists(os.path.join(directory, 'layout.json')):
+            storage[key] = MemmapRolloutStorage.load(directory, mode=mode)
+    
+    assert len(storage)
+    return combine_storage(storage)
+
+def rollout_sequences(
+    episodes,
+    env,
+    actor_fn,
+    sampler_fn=default_categorical_sampler_fn,
+    initial_memory=None,
+    store_observations=True,
+    store_actions=True,
+    store_distributions=True,
+    store_rewards=True,
+):
+    '''
+    A streaming version of rollout.  Instead of collecting everything in a
+    RolloutStorage, this is a generator that yields each sequence as soon as
+    it terminates, in the same format as RolloutStorage.get_seq.  Only the
+    steps of the sequences that are still running are kept in memory.
+    '''
+    b = env.num_envs
+    assert (
+        store_observations or
+        store_actions or
+        store_distributions or
+        store_rewards
+    )
+    
+    # reset
+    observation = env.reset()
+    
+    terminal = numpy.ones(b, dtype=numpy.bool)
+    reward = numpy.zeros(env.num_envs)
+    
+    memory = initial_memory
+    
+    seq_steps = [None for _ in range(b)]
+    finished_seqs = 0
+    
+    progress = tqdm.tqdm(total=episodes)
+    with progress:
+        while finished_seqs < episodes:
+            # emit finished sequences and start new ones
+            for i in range(b):
+                if terminal[i]:
+                    if seq_steps[i] and finished_seqs < episodes:
+                        yield stack_numpy_hierarchies(*seq_steps[i])
+                        finished_seqs += 1
+                        progress.update(1)
+                    seq_steps[i] = []
+            
+            if finished_seqs >= episodes:
+                break
+            
+            steps = [{} for _ in range(b)]
+            if store_observations:
+                for i in range(b):
+                    steps[i]['observation'] = index_hierarchy(observation, i)
+            
+            # compute actions
+            observation = stack_numpy_hierarchies(observation)
+            
+            distribution, memory = actor_fn(
+                observation, terminal, memory)
+            actions = sampler_fn(distribution)
+            
+            # step
+            observation, reward, terminal, info = env.step(actions)
+            
+            # storage
+            if store_actions:
+                a = stack_numpy_hierarchies(*actions)
+            if store_distributions:
+                distribution = numpy.array(distribution)
+            for i in range(b):
+                if store_actions:
+                    steps[i]['action'] = index_hierarchy(a, i)
+                if store_distributions:
+                    steps[i]['distribution'] = distribution[i]
+                if store_rewards:
+                    steps[i]['reward'] = numpy.asarray(reward[i])
+                seq_steps[i].append(steps[i])
@@ -1,4 +1,6 @@
-import copy
+import numpy
+
+from scipy.spatial import cKDTree
 
 from ltron.matching import match_assemblies, match_lookup
 
@@ -20,46 +22,54 @@ def edit_distance(
     miss_a_penalty=1,
     miss_b_penalty=1,
     pose_penalty=1,
+    kdtree=None,
 ):
+    '''
+    Repeatedly matches the largest rigidly aligned group of bricks between
+    assembly_a and assembly_b and removes it from both, until nothing else
+    can be matched.  The first group is free, each additional group costs
+    pose_penalty and every brick left over costs miss_a_penalty or
+    miss_b_penalty.  Returns the distance and the combined a_to_b lookup.
     
-    running_a_to_b = {}
-    
-    first_a = assembly_a
-    first_b = assembly_b
-    
-    def remove_and_match(a, b, remove):
-        a = copy.deepcopy(a)
-        b = copy.deepcopy(b)
-        for aa, bb in remove.items():
-            a['shape'][aa] = 0
-            a['color'][aa] = 0
-            b['shape'][bb] = 0
-            b['color'][bb] = 0
-        
-        match, offset = match_assemblies(a, b, shape_names, radius=radius)
-        a_to_b, b_to_a, miss_a, miss_b = match_lookup(match, a, b)
-        
-        return a, b, a_to_b, miss_a, miss_b
+    Matched bricks are removed by zeroing their shape and color in a single
+    working copy of those arrays, so the poses are never copied, the KD-tree
+    over assembly_b (which may be passed in as kdtree) is built only once,
+    and each round only forms hypotheses from the bricks that are left.
+    '''
+    if kdtree is None:
+        kdtree = cKDTree(assembly_b['pose'][:,:3,3])
     
-    first_match, _ = match_assemblies(
-        assembly_a, assembly_b, shape_names, radius=radius)
-    a_to_b, b_to_a, miss_a, miss_b = match_lookup(
-        first_match, assembly_a, assembly_b)
-    running_a_to_b.update(a_to_b)
+    remaining_a = {
+        'shape' : assembly_a['shape'].copy(),
+        'color' : assembly_a['color'].copy(),
+        'pose' : assembly_a['pose'],
+    }
+    remaining_b = {
+        'shape' : assembly_b['shape'].copy(),
+        'color' : assembly_b['color'].copy(),
+        'pose' : assembly_b['pose'],
+    }
     
-    assembly_a, assembly_b, a_to_b, miss_a, miss_b = remove_and_match(
-        assembly_a, assembly_b, a_to_b)
-    running_a_to_b.update(a_to_b)
-    
-    d = 0
-    while len(a_to_b):
-        assembly_a, assembly_b, a_to_b, miss_a, miss_b = remove_and_match(
-            assembly_a, assembly_b, a_to_b)
-        running_a_to_b.update(a_to_b)
+    running_a_to_b = {}
+    num_groups = 0
+    while True:
+        match, offset = match_assemblies(
+            remaining_a, remaining_b, shape_names, kdtree=kdtree, radius=radius)
+        if not len(match):
+            break
         
-        d += pose_penalty
+        running_a_to_b.update(match)
+        num_groups += 1
+        matched_a, matched_b = zip(*match)
+        matched_a = list(matched_a)
+        matched_b = list(matched_b)
+        remaining_a['shape'][matched_a] = 0
+        remaining_a['color'][matched_a] = 0
+        remaining_b['shape'][matched_b] = 0
+        remaining_b['color'][matched_b] = 0
     
-    d += len(miss_a) * miss_a_penalty
-    d += len(miss_b) * miss_b_penalty
+    d = max(num_groups - 1, 0) * pose_penalty
+    d += numpy.count_nonzero(remaining_a['shape']) * miss_a_penalty
+    d += numpy.count_nonzero(remaining_b['shape']) * miss_b_penalty
     
     return d, running_a_to_b
@@ -30,5 +30,6 @@ def main():
     installation.install_ldraw(overwrite=args.overwrite)
     installation.install_splendor_meshes(args.resolution)
     installation.install_ldcad(overwrite=args.overwrite)
+    installation.install_ldraw_index()
     installation.install_collection('omr', overwrite=args.overwrite)
     installation.install_collection('random_six', overwrite=args.overwrite)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+import os
+
+import numpy
+
+from ltron.bricks.brick_scene import BrickScene
+from ltron.render.batch import start_batch_render_server, StubRenderBackend
+
+logo_path = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'assets', 'ltron_logo.mpd')
+
+if __name__ == '__main__':
+    process, clients = start_batch_render_server(2, backend='stub')
+    
+    scenes = []
+    for client in clients:
+        scene = BrickScene(
+            renderable=True,
+            render_args={'opengl_mode':'batch', 'render_client':client},
+        )
+        scene.import_ldraw(logo_path)
+        view_matrix = numpy.eye(4)
+        view_matrix[2,3] = -500
+        scene.set_view_matrix(view_matrix)
+        scenes.append(scene)
+    
+    # hiding an instance in one scene should not affect the other
+    scenes[1].hide_instance(1)
+    
+    backend = StubRenderBackend()
+    for i, scene in enumerate(scenes):
+        color = scene.render_environment.render_image('color', 64, 64)
+        mask = scene.render_environment.render_image('mask', 64, 64)
+        assert color.shape == (64, 64, 3)
+        assert mask.shape == (64, 64)
+        
+        visible = set(numpy.unique(mask).tolist()) - {0}
+        assert visible
+        if i == 1:
+            assert 1 not in visible
+        
+        job = scene.render_environment.make_job('mask', 64, 64)
+        assert numpy.all(backend.render_job(job) == mask)
+    
+    for client in clients:
+        client.connection.close()
+    process.join(timeout=5)
+    print('batch render ok')
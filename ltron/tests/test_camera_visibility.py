@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+import numpy
+
+from ltron.bricks.brick_scene import BrickScene
+from ltron.plan.edge_planner import (
+    CameraVisibilityOracle, test_camera_position)
+
+# minimal stand-ins for the scene, viewpoint and render components, where the
+# "render" is just the camera position and center it was taken from
+class SceneComponent:
+    def __init__(self):
+        self.brick_scene = BrickScene()
+        self.camera = None
+    
+    def get_state(self):
+        return None
+    
+    def set_state(self, state):
+        return None
+
+class ViewpointComponent:
+    def __init__(self, scene_component):
+        self.scene_component = scene_component
+        self.position = [0, 0, 0]
+        self.center = [0., 0., 0.]
+        self.set_camera()
+    
+    def compute_center(self):
+        return [1., 2., 3.]
+    
+    def set_camera(self):
+        self.scene_component.camera = (
+            tuple(self.position), tuple(self.center))
+    
+    def get_state(self):
+        return {'position':self.position, 'center':self.center}
+    
+    def set_state(self, state):
+        self.position = list(state['position'])
+        self.center = list(state['center'])
+        self.set_camera()
+        return None
+
+class RenderComponent:
+    def __init__(self, scene_component):
+        self.scene_component = scene_component
+        self.update_observation()
+    
+    def update_observation(self):
+        position, center = self.scene_component.camera
+        self.observation = numpy.array(position + center)
+    
+    def get_state(self):
+        return None
+    
+    def set_state(self, state):
+        self.update_observation()
+        return self.observation
+
+class Env:
+    def __init__(self):
+        scene = SceneComponent()
+        self.components = {
+            'scene' : scene,
+            'viewpoint' : ViewpointComponent(scene),
+            'render' : RenderComponent(scene),
+        }
+    
+    def get_state(self):
+        return {
+            name:component.get_state()
+            for name, component in self.components.items()
+        }
+    
+    def set_state(self, state):
+        return {
+            name:self.components[name].set_state(component_state)
+            for name, component_state in state.items()
+        }
+
+def condition(observation):
+    return True, observation['render']
+
+env = Env()
+oracle = CameraVisibilityOracle(env)
+positions = [(1, 0, 0, 0), (2, 1, 0, 0), (1, 0, 0, 1)]
+
+def check_against_round_trip():
+    state = env.get_state()
+    for position in positions:
+        oracle_render = oracle.observe('viewpoint', position, ['render'])
+        _, expected = test_camera_position(
+            env, position, 'viewpoint', state, condition)
+        env.set_state(state)
+        assert numpy.all(oracle_render['render'] == expected), position
+
+check_against_round_trip()
+
+# moving the center (as a frame action would) must not reuse old renders
+viewpoint = env.components['viewpoint']
+viewpoint.center = [5., 5., 5.]
+viewpoint.set_camera()
+check_against_round_trip()
+assert oracle.hits == 1
+
+print('camera visibility ok')
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import os
+import time
+
+import numpy
+
+from ltron.bricks.brick_scene import BrickScene
+from ltron.geometry.collision import splendor_available
+
+logo_path = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'assets', 'ltron_logo.mpd')
+
+scene = BrickScene(
+    track_snaps=True,
+    collision_checker=True,
+    collision_checker_args={'backend':'numpy'},
+)
+scene.import_ldraw(logo_path)
+
+# a copy of an existing brick placed exactly on top of it must collide
+instance = scene.instances[1]
+duplicate = scene.add_instance(
+    str(instance.brick_shape), instance.color, instance.transform)
+render_transform = instance.transform
+assert scene.check_collision([duplicate], render_transform)
+colliding = scene.collision_checker.check_collision(
+    [duplicate], render_transform, return_colliding_instances=True)
+assert int(instance) in colliding.tolist()
+scene.remove_instance(duplicate)
+
+# compare against the opengl backend when it is available
+numpy_results = []
+t0 = time.time()
+for i, instance in scene.instances.items():
+    for snap in instance.snaps:
+        numpy_results.append(scene.check_snap_collision([instance], snap))
+t1 = time.time()
+print('numpy backend: %.04fs'%(t1-t0))
+
+# the broadphase must never change the answer
+full_results = []
+t0 = time.time()
+for i, instance in scene.instances.items():
+    for snap in instance.snaps:
+        full_results.append(scene.collision_checker.check_snap_collision(
+            [instance], snap, broadphase=False))
+t1 = time.time()
+print('numpy backend without broadphase: %.04fs'%(t1-t0))
+assert full_results == numpy_results
+
+# the cached instance boxes must follow the scene as it changes
+instance_ids, box_min, box_max = scene.get_instance_boxes()
+assert scene.get_instance_boxes()[1] is box_min
+instance = scene.instances[instance_ids[0]]
+original_transform = instance.transform.copy()
+transform = original_transform.copy()
+transform[0,3] += 100
+scene.move_instance(instance, transform)
+moved_ids, moved_min, moved_max = scene.get_instance_boxes()
+assert numpy.allclose(moved_min[0], box_min[0] + [100, 0, 0])
+for i, instance_id in enumerate(moved_ids.tolist()):
+    corners = scene.instances[instance_id].bbox_vertices()[:3]
+    assert numpy.allclose(moved_min[i], numpy.min(corners, axis=1))
+    assert numpy.allclose(moved_max[i], numpy.max(corners, axis=1))
+scene.move_instance(instance, original_transform)
+
+# depth sprites must give the same answers as rasterizing every brick
+sprite_scene = BrickScene(
+    track_snaps=True,
+    collision_checker=True,
+    collision_checker_args={'backend':'numpy', 'sprite_cache_size':256},
+)
+sprite_scene.import_ldraw(logo_path)
+sprite_results = []
+t0 = time.time()
+for i, instance in sprite_scene.instances.items():
+    for snap in instance.snaps:
+        sprite_results.append(
+            sprite_scene.check_snap_collision([instance], snap))
+t1 = time.time()
+sprite_cache = sprite_scene.collision_checker.sprite_cache
+print('numpy backend with sprites: %.04fs (%i hits, %i misses)'%(
+    t1-t0, sprite_cache.hits, sprite_cache.misses))
+assert sprite_results == numpy_results
+
+if splendor_available:
+    gl_scene = BrickScene(
+        renderable=True, track_snaps=True, collision_checker=True)
+    gl_scene.import_ldraw(logo_path)
+    gl_results = []
+    t0 = time.time()
+    for i, instance in gl_scene.instances.items():
+        for snap in instance.snaps:
+            gl_results.append(gl_scene.check_snap_collision([instance], snap))
+    t1 = time.time()
+    print('opengl backend: %.04fs'%(t1-t0))
+    agreement = numpy.mean(
+        numpy.array(numpy_results) == numpy.array(gl_results))
+    print('agreement: %.04f'%agreement)
+    
+    # both backends must give exactly the same answers
+    mismatches = [
+        i for i, (n, g) in enumerate(zip(numpy_results, gl_results))
+        if n != g
+    ]
+    assert len(gl_results) == len(numpy_results)
+    assert agreement == 1., 'backends disagree on snap checks %s'%mismatches
+
+# batched candidates must match moving the brick and checking one at a time
+for i, instance in list(scene.instances.items())[:4]:
+    original_transform = instance.transform.copy()
+    candidate_transforms = []
+    for dy in (-24, -8, 0, 8, 24):
+        transform = original_transform.copy()
+        transform[1,3] += dy
+        candidate_transforms.append(transform)
+    for snap in instance.snaps[:2]:
+        batch_results = scene.check_pick_and_place_collisions(
+            snap, candidate_transforms)
+        assert numpy.all(instance.transform == original_transform)
+        for transform, batch_result in zip(
+            candidate_transforms, batch_results):
+            scene.move_instance(instance, transform)
+            collision = scene.check_snap_collision([instance], snap)
+            assert collision == batch_result
+            scene.move_instance(instance, original_transform)
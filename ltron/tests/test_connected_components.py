@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+import numpy
+
+from ltron.dataset.datastructure.connected_components import (
+    component_labels, assembly_component_labels, partition_assembly)
+
+# non-contiguous ids, an edge to a missing id and zero padding
+instance_ids = numpy.array([7, 2, 9, 4, 12])
+edges = numpy.array([
+    [2, 9, 4, 0, 5],
+    [9, 2, 12, 0, 7],
+    [0, 0, 1, 0, 0],
+    [1, 1, 0, 0, 0],
+])
+labels = component_labels(instance_ids, edges)
+assert labels.tolist() == [3, 1, 1, 2, 2]
+
+shape = numpy.zeros(13, dtype=numpy.int64)
+shape[instance_ids] = 1
+assembly = {'shape':shape, 'edges':edges}
+labels = assembly_component_labels(assembly)
+assert labels[0] == 0
+assert labels[instance_ids].tolist() == [3, 1, 1, 2, 2]
+assert partition_assembly(assembly) == {1:[2, 9], 2:[4, 12], 3:[7]}
+
+print('connected components ok')
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+import numpy
+
+from ltron.geometry.symmetry import LDRAW_SYMMETRY
+from ltron.score import edit_distance
+
+shape_names = {1:'test_brick_a.dat', 2:'test_brick_b.dat'}
+LDRAW_SYMMETRY['test_brick_a.dat'] = []
+LDRAW_SYMMETRY['test_brick_b.dat'] = []
+
+def make_assembly(bricks):
+    assembly = {
+        'shape' : numpy.zeros(len(bricks)+1, dtype=numpy.int64),
+        'color' : numpy.zeros(len(bricks)+1, dtype=numpy.int64),
+        'pose' : numpy.zeros((len(bricks)+1, 4, 4)),
+    }
+    assembly['pose'][0] = numpy.eye(4)
+    for i, (shape, color, position) in enumerate(bricks, start=1):
+        assembly['shape'][i] = shape
+        assembly['color'][i] = color
+        assembly['pose'][i] = numpy.eye(4)
+        assembly['pose'][i,:3,3] = position
+    
+    return assembly
+
+# bricks 1 and 2 move together, brick 3 moves on its own, brick 4 is missing
+# from b and b has one extra brick
+assembly_a = make_assembly([
+    (1, 1, (0, 0, 0)),
+    (1, 1, (20, 0, 0)),
+    (1, 1, (0, 0, 40)),
+    (1, 2, (60, 0, 0)),
+])
+assembly_b = make_assembly([
+    (1, 1, (100, 0, 0)),
+    (1, 1, (120, 0, 0)),
+    (1, 1, (0, 50, 40)),
+    (2, 2, (500, 500, 500)),
+])
+
+# one extra group, one brick missing from each side
+d, a_to_b = edit_distance(assembly_a, assembly_b, shape_names)
+assert d == 3, d
+assert a_to_b == {1:1, 2:2, 3:3}, a_to_b
+
+d, a_to_b = edit_distance(
+    assembly_a,
+    assembly_b,
+    shape_names,
+    miss_a_penalty=2,
+    miss_b_penalty=3,
+    pose_penalty=5,
+)
+assert d == 10, d
+
+# identical assemblies are free
+d, a_to_b = edit_distance(assembly_a, assembly_a, shape_names)
+assert d == 0, d
+assert a_to_b == {1:1, 2:2, 3:3, 4:4}, a_to_b
+
+print('edit distance ok')
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+import os
+
+import numpy
+
+from ltron.bricks.brick_scene import BrickScene, make_empty_assembly
+from ltron.gym.components.assembly import AssemblyComponent
+
+logo_path = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'assets', 'ltron_logo.mpd')
+
+dict_scene = BrickScene(track_snaps=True)
+dict_scene.import_ldraw(logo_path)
+
+array_scene = BrickScene(track_snaps=True, array_instances=True)
+array_scene.import_ldraw(logo_path)
+
+# move and remove a few bricks so the array table has gaps
+for scene in dict_scene, array_scene:
+    transform = scene.instances[2].transform
+    transform[0,3] += 20
+    scene.move_instance(2, transform)
+    scene.remove_instance(3)
+
+shape_ids = dict_scene.make_shape_ids()
+color_ids = dict_scene.make_color_ids()
+dict_assembly = dict_scene.get_assembly(shape_ids, color_ids)
+array_assembly = array_scene.get_assembly(shape_ids, color_ids)
+for key in dict_assembly:
+    assert numpy.all(dict_assembly[key] == array_assembly[key]), key
+
+# writing into preallocated buffers must match and reuse the same memory
+buffers = make_empty_assembly(64, 256)
+buffers['pose'][:] = 1
+buffer_assembly = array_scene.get_assembly(
+    shape_ids, color_ids, 64, 256, out=buffers)
+assert buffer_assembly is buffers
+padded_assembly = dict_scene.get_assembly(shape_ids, color_ids, 64, 256)
+for key in padded_assembly:
+    assert numpy.all(padded_assembly[key] == buffers[key]), key
+
+for a, b in zip(dict_scene.get_scene_bbox(), array_scene.get_scene_bbox()):
+    assert numpy.allclose(a, b)
+
+# batched snap transforms must match the per-snap SnapInstance transforms
+snap_instances, snap_ids, transforms = array_scene.get_all_snap_transforms()
+for i, s, transform in zip(snap_instances, snap_ids, transforms):
+    snap = dict_scene.instances[i].snaps[s]
+    assert numpy.allclose(snap.transform, transform)
+assert len(snap_ids) == len(dict_scene.get_all_snaps())
+
+# holding on to a transform must not see later moves
+instance = array_scene.instances[1]
+original_transform = instance.transform
+moved_transform = original_transform.copy()
+moved_transform[1,3] -= 8
+array_scene.move_instance(instance, moved_transform)
+assert not numpy.allclose(original_transform, instance.transform)
+
+# set_assembly only applies the differences but must rebuild the same scene
+target_assembly = dict_scene.get_assembly(shape_ids, color_ids)
+diff_scene = BrickScene(track_snaps=True)
+diff_scene.import_ldraw(logo_path)
+transform = diff_scene.instances[4].transform
+transform[2,3] += 40
+diff_scene.move_instance(4, transform)
+diff_scene.remove_instance(5)
+diff_scene.set_assembly(target_assembly, shape_ids, color_ids)
+diff_assembly = diff_scene.get_assembly(shape_ids, color_ids)
+for key in 'shape', 'color', 'pose':
+    assert numpy.all(target_assembly[key] == diff_assembly[key]), key
+# edges can be listed in a different order after instances are re-added
+assert (
+    set(map(tuple, target_assembly['edges'].T.tolist())) ==
+    set(map(tuple, diff_assembly['edges'].T.tolist()))
+)
+
+# a saved assembly state must survive later steps when buffers are reused
+class SceneComponent:
+    def __init__(self, brick_scene):
+        self.brick_scene = brick_scene
+
+state_scene = BrickScene(track_snaps=True)
+state_scene.import_ldraw(logo_path)
+assembly_component = AssemblyComponent(
+    SceneComponent(state_scene),
+    shape_ids,
+    color_ids,
+    64,
+    256,
+    update_frequency='step',
+    observable=True,
+    reuse_buffers=True,
+)
+assembly_component.reset()
+state = assembly_component.get_state()
+snapshot = {key:value.copy() for key, value in state[0].items()}
+transform = state_scene.instances[1].transform
+transform[0,3] += 60
+state_scene.move_instance(1, transform)
+state_scene.remove_instance(2)
+stepped, _, _, _ = assembly_component.step(None)
+assert not numpy.all(stepped['pose'] == snapshot['pose'])
+for key in snapshot:
+    assert numpy.all(state[0][key] == snapshot[key]), key
+restored = assembly_component.set_state(state)
+assert restored is assembly_component.assembly_buffers
+for key in snapshot:
+    assert numpy.all(restored[key] == snapshot[key]), key
+assembly_component.step(None)
+for key in snapshot:
+    assert numpy.all(state[0][key] == snapshot[key]), key
+
+# restoring a state resets the id counter, so repeatedly trying an addition
+# and restoring does not keep raising it
+id_scene = BrickScene(track_snaps=True)
+id_scene.import_ldraw(logo_path)
+id_assembly = id_scene.get_assembly(shape_ids, color_ids)
+next_id = int(numpy.nonzero(id_assembly['shape'])[0][-1]) + 1
+first_instance = id_scene.instances[1]
+shape_name = first_instance.brick_shape.reference_name
+color_name = first_instance.color.color_name
+for i in range(3):
+    id_scene.set_assembly(id_assembly, shape_ids, color_ids)
+    assert id_scene.instances.next_instance_id == next_id
+    added = id_scene.add_instance(shape_name, color_name, numpy.eye(4))
+    assert int(added) == next_id
+id_scene.set_assembly(id_assembly, shape_ids, color_ids)
+assert id_scene.instances.next_instance_id == next_id
+
+empty_assembly = {key:value * 0 for key, value in id_assembly.items()}
+id_scene.set_assembly(empty_assembly, shape_ids, color_ids)
+assert id_scene.instances.next_instance_id == 1
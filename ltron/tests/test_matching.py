@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import numpy
+
+from ltron.geometry.symmetry import (
+    LDRAW_SYMMETRY, symmetry_offsets, pose_match_under_symmetries)
+from ltron.matching import match_assemblies, validate_matches
+
+# two made up shapes, one without symmetries and one symmetric about y
+part_names = {1:'test_plain.dat', 2:'test_round.dat'}
+LDRAW_SYMMETRY['test_plain.dat'] = []
+LDRAW_SYMMETRY['test_round.dat'] = ['ry90']
+rotations = symmetry_offsets['ry90'] + [numpy.eye(4)]
+
+def random_assembly(random, num_instances):
+    # bricks sit on distinct cells of a coarse grid, so each brick has at
+    # most one neighbor under any offset
+    cells = random.choice(10**3, size=num_instances, replace=False)
+    assembly = {
+        'shape' : numpy.zeros(num_instances+1, dtype=numpy.int64),
+        'color' : numpy.zeros(num_instances+1, dtype=numpy.int64),
+        'pose' : numpy.zeros((num_instances+1, 4, 4)),
+    }
+    assembly['pose'][0] = numpy.eye(4)
+    for i, cell in enumerate(cells, start=1):
+        assembly['shape'][i] = random.randint(1, 3)
+        assembly['color'][i] = random.randint(1, 3)
+        pose = rotations[random.randint(len(rotations))].copy()
+        pose[:3,3] = numpy.unravel_index(cell, (10, 10, 10))
+        pose[:3,3] *= 20
+        assembly['pose'][i] = pose
+    
+    return assembly
+
+def moved_copy(random, assembly, num_kept, num_extra):
+    offset = rotations[random.randint(len(rotations))].copy()
+    offset[:3,3] = random.randint(-5, 5, size=3) * 20
+    copy = {key:value[:num_kept+1].copy() for key, value in assembly.items()}
+    copy['pose'][1:] = offset @ copy['pose'][1:]
+    extra = random_assembly(random, num_extra)
+    extra['pose'][1:,:3,3] += 10**4
+    for key in copy:
+        copy[key] = numpy.concatenate((copy[key], extra[key][1:]))
+    
+    return copy
+
+def check_matches(assembly_a, assembly_b, matches):
+    matched_a = [a for a, b in matches]
+    matched_b = [b for a, b in matches]
+    assert len(set(matched_a)) == len(matched_a)
+    assert len(set(matched_b)) == len(matched_b)
+    for a, b in matches:
+        assert assembly_a['shape'][a] == assembly_b['shape'][b]
+        assert assembly_a['color'][a] == assembly_b['color'][b]
+
+def reference_validate_matches(
+    assembly_a, assembly_b, matches, a_to_b, part_names
+):
+    # the original one pair at a time validation
+    valid_matches = set()
+    matched_b = set()
+    for a, a_matches in enumerate(matches):
+        for b in a_matches:
+            if b in matched_b:
+                continue
+            shape_a = assembly_a['shape'][a]
+            shape_b = assembly_b['shape'][b]
+            if shape_a != shape_b or shape_a == 0 or shape_b == 0:
+                continue
+            color_a = assembly_a['color'][a]
+            color_b = assembly_b['color'][b]
+            if color_a != color_b or color_a == 0 or color_b == 0:
+                continue
+            if not pose_match_under_symmetries(
+                LDRAW_SYMMETRY[part_names[shape_a]],
+                a_to_b @ assembly_a['pose'][a],
+                assembly_b['pose'][b],
+            ):
+                continue
+            valid_matches.add((a,b))
+            matched_b.add(b)
+            break
+    
+    return valid_matches
+
+random = numpy.random.RandomState(1234)
+for i in range(20):
+    assembly_a = random_assembly(random, 8)
+    
+    # a moved copy of most of assembly_a plus some unrelated bricks
+    assembly_b = moved_copy(random, assembly_a, 6, 3)
+    matches, offset = match_assemblies(assembly_a, assembly_b, part_names)
+    check_matches(assembly_a, assembly_b, matches)
+    assert len(matches) >= 6
+    
+    # the vectorized validation must agree with the pair by pair loop,
+    # including when several bricks compete for the same candidates
+    num_a = len(assembly_a['shape'])
+    num_b = len(assembly_b['shape'])
+    candidates = [
+        random.choice(num_b, size=random.randint(4), replace=False).tolist()
+        for _ in range(num_a)
+    ]
+    for a_to_b in offset, numpy.eye(4):
+        expected = reference_validate_matches(
+            assembly_a, assembly_b, candidates, a_to_b, part_names)
+        assert validate_matches(
+            assembly_a, assembly_b, candidates, a_to_b, part_names
+        ) == expected
+    
+    # only the bricks listed in instances_a are validated
+    instances_a = numpy.arange(2, num_a)
+    expected = reference_validate_matches(
+        assembly_a, assembly_b, [[]]*2 + candidates[2:], offset, part_names)
+    assert validate_matches(
+        assembly_a,
+        assembly_b,
+        candidates[2:],
+        offset,
+        part_names,
+        instances_a=instances_a,
+    ) == expected
+
+print('matching ok')
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+import os
+import time
+
+import numpy
+
+from ltron.bricks.brick_scene import BrickScene
+import ltron.bricks.snap_connections as snap_connections
+
+logo_path = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'assets', 'ltron_logo.mpd')
+
+scene = BrickScene(track_snaps=True)
+scene.import_ldraw(logo_path)
+
+# brute force every snap pair using the per-snap connection tests
+t0 = time.time()
+expected_edges = set()
+all_snaps = scene.get_all_snaps()
+for snap_a in all_snaps:
+    for snap_b in all_snaps:
+        if snap_a == snap_b:
+            continue
+        if snap_a.connected(snap_b):
+            expected_edges.add((snap_a[0], snap_b[0], snap_a[1], snap_b[1]))
+t1 = time.time()
+
+edges = scene.get_assembly_edges()
+t2 = time.time()
+found_edges = set(tuple(int(e) for e in edge) for edge in edges.T)
+
+print('brute force: %i edges, %.04fs'%(len(expected_edges), t1-t0))
+print('vectorized: %i edges, %.04fs'%(len(found_edges), t2-t1))
+assert found_edges == expected_edges
+
+unidirectional_edges = scene.get_assembly_edges(unidirectional=True)
+assert all(unidirectional_edges[0] <= unidirectional_edges[1])
+assert set(tuple(int(e) for e in edge) for edge in unidirectional_edges.T) == {
+    edge for edge in expected_edges if edge[0] <= edge[1]}
+
+# moving one instance away should disconnect it from everything
+instance = next(iter(scene.instances.values()))
+transform = instance.transform.copy()
+transform[0,3] += 10000
+scene.move_instance(instance, transform)
+edges = scene.get_assembly_edges()
+assert not any(int(instance) in (a, b) for a, b in zip(edges[0], edges[1]))
+
+# the incrementally maintained edges should always match a full recompute
+def full_edges(scene):
+    tracker = scene.snap_tracker
+    all_ids = list(tracker.instance_blocks.keys())
+    return set(tuple(int(e) for e in edge)
+        for edge in tracker.compute_connections(all_ids).T)
+
+scene.move_instance(instance, instance.transform @ numpy.linalg.inv(
+    numpy.array([[1,0,0,10000],[0,1,0,0],[0,0,1,0],[0,0,0,1]])))
+assert set(tuple(int(e) for e in edge)
+    for edge in scene.get_assembly_edges().T) == full_edges(scene)
+
+removed = list(scene.instances.keys())[1]
+scene.remove_instance(removed)
+edges = scene.get_assembly_edges()
+assert removed not in edges[0] and removed not in edges[1]
+assert set(tuple(int(e) for e in edge) for edge in edges.T) == full_edges(scene)
+
+# force tree queries so moved and re-added snaps go through the side tree
+snap_connections.DENSE_QUERY_LIMIT = 0
+scene.get_assembly_edges()
+for instance in list(scene.instances.values())[:3]:
+    transform = instance.transform.copy()
+    transform[1,3] += 8
+    scene.move_instance(instance, transform)
+    edges = scene.get_assembly_edges()
+    assert scene.snap_tracker.side_slots is not None
+    assert set(tuple(int(e) for e in edge) for edge in edges.T) == (
+        full_edges(scene))
+scene.import_ldraw(logo_path)
+edges = scene.get_assembly_edges()
+assert set(tuple(int(e) for e in edge) for edge in edges.T) == full_edges(scene)
+print('passed')
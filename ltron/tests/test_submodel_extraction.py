@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+import os
+
+from ltron.bricks.brick_scene import BrickScene
+from ltron.dataset.datastructure.connected_components import partition
+from ltron.dataset.submodel_extraction import SubmodelExtractor
+
+logo_path = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'assets', 'ltron_logo.mpd')
+
+scene = BrickScene(track_snaps=True)
+scene.import_ldraw(logo_path)
+extractor = SubmodelExtractor(scene)
+
+component_of = {}
+for component in partition(scene).values():
+    for instance_id in component:
+        component_of[instance_id] = set(component)
+
+# a subassembly either has exactly limit connected bricks or is rejected,
+# even when its component runs out of bricks first
+largest = max(len(component) for component in component_of.values())
+for limit in 2, 3, largest, largest+1:
+    for seed in extractor.instance_ids.tolist():
+        members = extractor.grow(seed, limit)
+        if len(component_of[seed]) < limit:
+            assert members is None, (seed, limit, members)
+            continue
+        
+        assert members is not None, (seed, limit)
+        assert len(members) == limit, (seed, limit, members)
+        assert len(set(members)) == limit
+        assert members[0] == seed
+        assert set(members) <= component_of[seed]
+
+# used bricks are never added, and can cut a subassembly short
+seed = max(component_of, key=lambda i : len(component_of[i]))
+used = component_of[seed] - {seed}
+assert extractor.grow(seed, 2, used=used) is None
+
+print('submodel extraction ok')
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import math
+import itertools
+
+import numpy
+
+from pyquaternion import Quaternion
+
+from ltron.geometry.symmetry import (
+    symmetry_tests, get_symmetry_rotations, pose_match_under_symmetries)
+
+def rotation(axis, angle):
+    return Quaternion(axis=axis, angle=angle).transformation_matrix
+
+pose_a = rotation([1,2,3], 0.7)
+pose_a[:3,3] = [10, 20, 30]
+
+# exact symmetric poses, including half turns about x and z
+for symmetry, (axis, angle) in symmetry_tests.items():
+    pose_b = pose_a @ rotation(axis, angle)
+    assert pose_match_under_symmetries([symmetry], pose_a, pose_b), symmetry
+    assert not pose_match_under_symmetries([], pose_a, pose_b), symmetry
+for symmetry, axis in ('rx90', [1,0,0]), ('rz90', [0,0,1]):
+    pose_b = pose_a @ rotation(axis, math.pi)
+    assert pose_match_under_symmetries([symmetry], pose_a, pose_b), symmetry
+
+# near-symmetric poses are only accepted within angular_tolerance
+for symmetry, (axis, angle) in symmetry_tests.items():
+    perpendicular = numpy.cross(axis, [1,1,1])
+    for noise, expected in (
+        (0.01, True), (0.1, False), (0.2, False), (0.3, False)
+    ):
+        offset = rotation(axis, angle) @ rotation(perpendicular, noise)
+        pose_b = pose_a @ offset
+        match = pose_match_under_symmetries([symmetry], pose_a, pose_b)
+        assert match == expected, (symmetry, noise)
+
+# the same pairs as arrays
+poses_b = numpy.stack([
+    pose_a @ rotation([1,0,0], math.pi),
+    pose_a @ rotation([1,0,0], math.pi) @ rotation([0,1,0], 0.2),
+    pose_a @ rotation([1,0,0], math.pi/2.),
+])
+poses_b[2,:3,3] += 2
+poses_a = numpy.stack([pose_a]*3)
+match = pose_match_under_symmetries(['rx180'], poses_a, poses_b)
+assert match.tolist() == [True, False, False]
+
+# the rotation tables are closed groups
+for symmetries, size in (
+    ([], 1),
+    (['ry90'], 4),
+    (['rx180', 'ry180'], 4),
+    (['rx90', 'ry180'], 8),
+    (['rx90', 'ry90'], 24),
+):
+    group = get_symmetry_rotations(symmetries)
+    assert group.shape == (size, 3, 3), symmetries
+    assert numpy.allclose(group[0], numpy.eye(3))
+    def in_group(r):
+        return any(numpy.allclose(r, g, atol=1e-6) for g in group)
+    for g in group:
+        assert numpy.allclose(g.T @ g, numpy.eye(3))
+        assert numpy.isclose(numpy.linalg.det(g), 1.)
+        assert in_group(g.T)
+    for g, h in itertools.product(group, group):
+        assert in_group(g @ h)
+
+# rx180 and ry180 together imply rz180
+pose_b = pose_a @ rotation([0,0,1], math.pi)
+assert pose_match_under_symmetries(['rx180', 'ry180'], pose_a, pose_b)
+
+print('symmetry ok')